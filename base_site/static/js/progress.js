@@ -1,4 +1,38 @@
 $(document).ready(function() {
+  /* the board is sent as columns: see teams/board.py */
+  var LOCKED = 0, UNLOCKED = 1, GUESSED = 2, SOLVED = 3;
+
+  function timeString(unix) {
+    var time = new Date(unix * 1000);
+    return ('0' + time.getHours()).slice(-2) + ':' + ('0' + time.getMinutes()).slice(-2);
+  }
+
+  function renderBoard(board) {
+    var width = board.puzzles.length;
+    var rows = board.teams.map(function(team, t) {
+      var name = board.names[t].length > 40 ? board.names[t].slice(0, 39) + '\u2026' : board.names[t];
+      var row = "<tr class='team_row'><th class='leftmost' data-id=" + team +
+                " style='max-width: 200px; overflow: hidden; text-overflow: ellipsis;' scope='row'>" +
+                $('<div>').text(name).html() + "</th><td class='num_puzzles'></td><td class='last_time'></td>";
+      board.puzzles.forEach(function(puzzle, p) {
+        var i = t * width + p;
+        var state = +board.states[i];
+        var id = "<td id='p" + puzzle + "t" + team + "'";
+        if (state == LOCKED) {
+          row += id + " class='unavailable' style='text-align:center;'></td>";
+        } else if (state == SOLVED) {
+          row += id + " class='solved' data-date=" + board.times[i] + ">" + timeString(board.times[i]) + "</td>";
+        } else {
+          row += id + " class='available' data-date=" + board.times[i] + ">" +
+                 (state == GUESSED ? "<b>" + timeString(board.guessed[i]) + "</b>" : "") + "</td>";
+        }
+      });
+      return row + "</tr>";
+    });
+    $("#progress tbody").html(rows.join(""));
+  }
+  renderBoard(JSON.parse($("#board").text()));
+
   function recolor () {
     $(".available").each(function(){
       var time_diff = Math.floor(Date.now()/1000) - $(this).data("date");
@@ -82,30 +116,8 @@ $(document).ready(function() {
     }).appendTo(tbody);
   }
 
-  var get_posts = function() {
+  var resort = function() {
     if(is_visible()){
-      $.ajax({
-        type: 'get',
-        url: "/staff/progress/",
-        data: {last_solve_pk: last_solve_pk, last_unlock_pk: last_unlock_pk,
-               last_guess_pk: last_guess_pk},
-        success: function (response) {
-          var response = JSON.parse(response);
-          messages = response.messages
-          if(messages.length > 0){
-            for (var i = 0; i < messages.length; i++) {
-              receiveMessage(messages[i]);
-              console.log(messages[i]);
-            };
-            last_solve_pk = response.update_info[0];
-            last_unlock_pk = response.update_info[1];
-            last_guess_pk = response.update_info[2];
-          }
-        },
-        error: function (html) {
-          console.log(html);
-        }
-      });
       update_values();
       if($("#sort_check").is(":checked")) {
         sort_table($("#progress"));
@@ -114,9 +126,41 @@ $(document).ready(function() {
       }
     }
   }
-  setInterval(get_posts, 30000);
+  setInterval(resort, 30000);
   update_values();
 
+  /* the changed cells are pushed as [team pk, puzzle pk, state, unix time] */
+  var opened = false;
+  function connect() {
+    var ws_scheme = (window.location.protocol == 'https:' ? 'wss' : 'ws') + '://';
+    var sock = new WebSocket(ws_scheme + window.location.host + '/ws/staff/progress/' + episode_pk + '/');
+    sock.onopen = function() {
+      if (opened) {
+        // the cells changed while disconnected are not replayed
+        $.ajax({
+          url: window.location.pathname,
+          dataType: "json",
+          success: function(board) {
+            renderBoard(board);
+            recolor();
+            update_values();
+            resort();
+          }
+        });
+      }
+      opened = true;
+    };
+    sock.onmessage = function(e) {
+      var data = JSON.parse(e.data);
+      if (data.type == 'cells') {
+        data.content.cells.forEach(receiveCell);
+      }
+    };
+    sock.onclose = function() {
+      setTimeout(connect, 5000);
+    };
+  }
+  connect();
 
   $('.unlock_form').on('submit', function(e) {
     e.preventDefault();
@@ -131,23 +175,36 @@ $(document).ready(function() {
     });
   });
 
-  function receiveMessage(update) {
-    $td = $("#p" + update.puzzle.id + "t" + update.team_pk);
-    if(update.status_type == "solve"){
+  function cellState($td) {
+    if ($td.hasClass('solved')) {
+      return SOLVED;
+    } else if ($td.hasClass('available')) {
+      return $td.find('b').length ? GUESSED : UNLOCKED;
+    }
+    return LOCKED;
+  }
+
+  function receiveCell(cell) {
+    var $td = $("#p" + cell[1] + "t" + cell[0]);
+    var time_str = timeString(cell[3]);
+    // a solved cell is final, and an unlock does not hide the last guess
+    if ($td.length == 0 || cellState($td) == SOLVED || (cell[2] == UNLOCKED && cellState($td) != LOCKED)) {
+      return;
+    }
+    if (cell[2] == SOLVED) {
       $td.removeClass();
       $td.addClass('solved');
-      $td.html(update.time_str);
+      $td.html(time_str);
       $td.css("background", "");
-      $td.data("date", (Date.now()/1000));
-    }
-    else if(update.status_type == "unlock"){
+      $td.data("date", cell[3]);
+    } else if (cell[2] == UNLOCKED) {
       $td.removeClass();
       $td.addClass('available');
-      $td.data("date", (Date.now()/1000));
+      $td.data("date", cell[3]);
       $td.html(" ");
-    }
-    else if(update.status_type == "guess"){
-      $td.html("<b>" + update.time_str + "</b>");
+      recolor();
+    } else if (cell[2] == GUESSED) {
+      $td.html("<b>" + time_str + "</b>");
     }
   }
 });
@@ -71,7 +71,7 @@ $(function() {
     }
      $.ajax({
       type: 'POST',
-      url: '',
+      url: 'guess/',
       data: $.param(data),
       contentType: 'application/x-www-form-urlencoded; charset=UTF-8',
       success:  function(data) {
@@ -127,7 +127,8 @@ $(function() {
       error: function(xhr, status, error) {
         button.removeData('cooldown')
         if (xhr.responseJSON && xhr.responseJSON.error == 'too fast') {
-          message('You have to wait a few seconds beween consecutive guesses.', '')
+          var seconds = Math.ceil((xhr.responseJSON.timeout_length || 5000) / 1000)
+          message('You have to wait ' + seconds + ' seconds before your next guess.', '')
         } else if (xhr.responseJSON && xhr.responseJSON.error == 'already answered') {
           message('Your team has already correctly answered this puzzle!', '')
         } else {
@@ -305,6 +306,22 @@ function receivedOldGuess(content) {
   }
 }
 
+// id of the last guess received, to replay only the ones after it when reconnecting
+var lastGuess = 0;
+
+function receivedGuesses(content) {
+  // rows of [id, timestamp, guess, correct, by]
+  content.guesses.forEach(function(row) {
+    var guess = {'guess_uid': row[0], 'timestamp': row[1], 'guess': row[2], 'correct': row[3], 'by': row[4]}
+    if (content.new) {
+      receivedNewGuess(guess)
+    } else {
+      receivedOldGuess(guess)
+    }
+  })
+  lastGuess = Math.max(lastGuess, content.cursor)
+}
+
 
 
 
@@ -392,7 +409,7 @@ function addEureka(eureka, eureka_uid, feedback) {
 }
 
 function receivedNewEureka(content) {
-  if(!eurekas.includes(content.hint_uid)){
+  if(!eurekas.includes(content.eureka_uid)){
     sleep(5000).then(()=>{
                addEureka(content.eureka, content.eureka_uid, content.feedback)
                 });
@@ -401,7 +418,7 @@ function receivedNewEureka(content) {
 
 
 function receivedOldEureka(content) {
-  if(!eurekas.includes(content.hint_uid)){
+  if(!eurekas.includes(content.eureka_uid)){
     addEureka(content.eureka, content.eureka_uid, content.feedback)
   }
 }
@@ -425,16 +442,28 @@ function openEventSocket() {
     'new_eureka': receivedNewEureka,
     'old_eureka': receivedOldEureka,
     'new_guess': receivedNewGuess,
-    'old_guess': receivedOldGuess,
+    'guesses': receivedGuesses,
     'error': receivedError,
+    // events of the team and of the hunt, not shown on a puzzle page
+    'new_unlocks': function() {},
+    'new_episode': function() {},
+    'leaderboard': function() {},
   }
 
+  var container = $('.puzzle-container')
+  var puzzle = String(container.data('puzzle'))
   var ws_scheme = (window.location.protocol == 'https:' ? 'wss' : 'ws') + '://'
-  var sock = new WebSocket(ws_scheme + window.location.host + '/ws' + window.location.pathname)
-  sock.onmessage = function(e) {
-    var data = JSON.parse(e.data)
+  var url = ws_scheme + window.location.host + '/ws/hunt/' + container.data('hunt') + '/team/'
+
+  function receive(data) {
+    if (data.puzzle !== undefined && data.puzzle != puzzle) {
+      return
+    }
     lastUpdated = Date.now()
 
+    if (data.type == 'new_guess') {
+      lastGuess = Math.max(lastGuess, data.content.guess_uid)
+    }
     if (!(data.type in socketHandlers)) {
       throw `Invalid message type: ${data.type}, content: ${data.content}`
     } else {
@@ -442,19 +471,54 @@ function openEventSocket() {
       handler(data.content)
     }
   }
-  sock.onerror = function() {
-    message('Websocket is broken. You will not receive new information without refreshing the page.')
+  function requests() {
+    var from = lastUpdated != undefined ? lastUpdated : 'all'
+    return [
+      {'type': 'subscribe', 'puzzle': puzzle},
+      {'type': 'guesses-plz', 'after': lastGuess, 'puzzle': puzzle},
+      {'type': 'hints-plz', 'from': from, 'puzzle': puzzle},
+      {'type': 'unlocks-plz', 'puzzle': puzzle},
+    ]
   }
-  sock.onopen = function() {
-    if (lastUpdated != undefined) {
-      sock.send(JSON.stringify({'type': 'guesses-plz', 'from': lastUpdated}))
-      sock.send(JSON.stringify({'type': 'hints-plz', 'from': lastUpdated}))
-      sock.send(JSON.stringify({'type': 'unlocks-plz'}))
-    } else {
-      sock.send(JSON.stringify({'type': 'guesses-plz', 'from': 'all'}))
-      sock.send(JSON.stringify({'type': 'hints-plz', 'from': 'all'}))
-      sock.send(JSON.stringify({'type': 'unlocks-plz', 'from': 'all'}))
+  function broken() {
+    message('Websocket is broken, reconnecting...')
+  }
+
+  if (window.SharedWorker) {
+    // one socket for all the pages of the hunt open in the browser
+    var worker = new SharedWorker(container.data('socket-worker'), 'team-socket-' + container.data('hunt'))
+    worker.port.onmessage = function(e) {
+      if (e.data.type == 'open') {
+        requests().forEach(function(request) { worker.port.postMessage({'type': 'send', 'message': request}) })
+      } else if (e.data.type == 'broken') {
+        broken()
+      } else {
+        receive(e.data.message)
+      }
+    }
+    worker.port.postMessage({'type': 'connect', 'url': url, 'puzzle': puzzle})
+    window.addEventListener('beforeunload', function() {
+      worker.port.postMessage({'type': 'close'})
+    })
+  } else {
+    // seconds before reopening a closed socket, doubled after each failure
+    var delay = 1
+    var connect = function() {
+      var sock = new WebSocket(url)
+      sock.onmessage = function(e) {
+        receive(JSON.parse(e.data))
+      }
+      sock.onopen = function() {
+        delay = 1
+        requests().forEach(function(request) { sock.send(JSON.stringify(request)) })
+      }
+      sock.onclose = function() {
+        broken()
+        setTimeout(connect, delay * 1000)
+        delay = Math.min(delay * 2, 60)
+      }
     }
+    connect()
   }
 }
 
@@ -46,7 +46,35 @@ $(document).ready(function() {
       }
     });
   }
-  setInterval(get_posts, 10000);
+
+  // the new and updated guesses are pushed through a websocket, polling is only a fallback
+  var polling = null;
+  function selected(pk) {
+    return pk && pk != 'None' ? pk : null;
+  }
+  function poll() {
+    if (polling === null) {
+      polling = setInterval(get_posts, 10000);
+    }
+  }
+  if (window.WebSocket) {
+    var ws_scheme = (window.location.protocol == 'https:' ? 'wss' : 'ws') + '://';
+    var sock = new WebSocket(ws_scheme + window.location.host + '/ws/staff/queue/');
+    sock.onopen = function() {
+      sock.send(JSON.stringify({'type': 'subscribe', 'team': selected(team_id), 'puzzle': selected(puzzle_id)}));
+      // the guesses written since the page was rendered
+      get_posts();
+    };
+    sock.onmessage = function(e) {
+      var data = JSON.parse(e.data);
+      if (data.type == 'guess') {
+        receiveMessage(data.content.row);
+      }
+    };
+    sock.onclose = poll;
+  } else {
+    poll();
+  }
 
   function formListener(e) {
     e.preventDefault();
@@ -74,7 +102,7 @@ $(document).ready(function() {
         flashing = !focused;
       }
       guess.prependTo("#sub_table");
-      if($('#sub_table tr').length >= 30){
+      if($('#sub_table tr').length >= 30 && !loadedOlder){
         $('#sub_table tr:last').remove();
       }
     } else {
@@ -83,6 +111,45 @@ $(document).ready(function() {
     $('.sub_form').on('submit', formListener);
   }
 
+  /* older guesses, rendered here like staff/queue_row.html */
+  function renderRow(row, teams, puzzles) {
+    var guess = $('<tr class="guess"><th scope="row"></th><td></td><td></td><td></td></tr>');
+    var time = new Date(row[4]);
+    var hour = ('0' + time.getHours()).slice(-2) + ':' + ('0' + time.getMinutes()).slice(-2);
+    var day = time.toLocaleDateString('en-US', {weekday: 'short'}) + ' ' + ('0' + time.getDate()).slice(-2);
+    guess.attr('data-id', row[0]);
+    guess.addClass(row[6] == '' ? 'warning' : (row[5] ? 'success' : 'danger'));
+    guess.children().eq(0).text(teams[row[1]]).css({'max-width': '200px', 'overflow': 'hidden', 'text-overflow': 'ellipsis'});
+    guess.children().eq(1).text(puzzles[row[2]]);
+    guess.children().eq(2).text(row[3]).css({'max-width': '200px', 'overflow-wrap': 'break-word'});
+    guess.children().eq(3).text(hour + ' (' + day + ')');
+    return guess;
+  }
+
+  var loadedOlder = false;
+  $('#older').on('click', function() {
+    var button = $(this);
+    loadedOlder = true;
+    $.ajax({
+      type: 'get',
+      url: "/staff/queue/guesses/",
+      data: {before: button.data('before'), team_id: selected(team_id), puzzle_id: selected(puzzle_id)},
+      success: function (response) {
+        response.rows.forEach(function(row) {
+          renderRow(row, response.teams, response.puzzles).appendTo("#sub_table");
+        });
+        if (response.next === null) {
+          button.remove();
+        } else {
+          button.data('before', response.next);
+        }
+      },
+      error: function (html) {
+        console.log(html);
+      }
+    });
+  });
+
   /* open a text box for submitting an email */
   $(document).delegate('.needs-response', 'click', function() {
     $(this).siblings('form').show();
@@ -0,0 +1,73 @@
+/***************************
+****************************
+****** TEAM WEBSOCKET ******
+****************************
+***************************/
+// Shared worker of the puzzle pages of a hunt open in the browser: it holds the one websocket of
+// the team and passes to each page the events of its puzzle, the events of the team and of the
+// hunt, and the answers to its own requests.
+
+var sock = null
+var pages = []
+var nextId = 0
+// seconds before reopening a closed socket, doubled after each failure
+var delay = 1
+
+function post(page, data) {
+  page.port.postMessage(data)
+}
+
+function connect(url) {
+  sock = new WebSocket(url)
+  sock.onmessage = function(e) {
+    var data = JSON.parse(e.data)
+    pages.forEach(function(page) {
+      if (data.request !== undefined ? data.request == page.id :
+          data.puzzle === undefined || data.puzzle == page.puzzle) {
+        post(page, {'type': 'message', 'message': data})
+      }
+    })
+  }
+  sock.onopen = function() {
+    delay = 1
+    // the pages send their requests again, from what they already received
+    pages.forEach(function(page) { post(page, {'type': 'open'}) })
+  }
+  sock.onclose = function() {
+    pages.forEach(function(page) { post(page, {'type': 'broken'}) })
+    setTimeout(function() {
+      if (pages.length) {
+        connect(url)
+      }
+    }, delay * 1000)
+    delay = Math.min(delay * 2, 60)
+  }
+}
+
+function close(page) {
+  pages = pages.filter(function(other) { return other !== page })
+  if (sock.readyState == WebSocket.OPEN && !pages.some(function(other) { return other.puzzle == page.puzzle })) {
+    sock.send(JSON.stringify({'type': 'unsubscribe', 'puzzle': page.puzzle}))
+  }
+}
+
+onconnect = function(e) {
+  var page = {'port': e.ports[0], 'id': nextId++, 'puzzle': null}
+  page.port.onmessage = function(e) {
+    if (e.data.type == 'connect') {
+      page.puzzle = e.data.puzzle
+      pages.push(page)
+      if (sock === null || sock.readyState == WebSocket.CLOSED) {
+        connect(e.data.url)
+      } else if (sock.readyState == WebSocket.OPEN) {
+        post(page, {'type': 'open'})
+      }
+    } else if (e.data.type == 'send') {
+      if (sock.readyState == WebSocket.OPEN) {
+        sock.send(JSON.stringify(Object.assign({'request': page.id}, e.data.message)))
+      }
+    } else if (e.data.type == 'close') {
+      close(page)
+    }
+  }
+}
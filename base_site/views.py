@@ -21,6 +21,6 @@ from teams.forms import PersonForm, UserForm
 
 def index(request):
     """ Main landing page view, mostly static with the exception of hunt info """
-    curr_hunt = Hunt.objects.get(is_current_hunt=True)
+    curr_hunt = Hunt.objects.get_current()
     team = curr_hunt.team_from_user(request.user)
     return render(request, "index.html", {'curr_hunt': curr_hunt, 'team': team})
@@ -22,6 +22,7 @@ from baton.admin import DropdownFilter, RelatedDropdownFilter, ChoicesDropdownFi
 import re
 
 from . import models
+from .dag import invalidate_dag
 from teams.widgets import HtmlEditor
 from . import widgets
 
@@ -40,7 +41,7 @@ class HuntAdmin(MirrorAdmin, admin.ModelAdmin):
     fieldsets = (
         ('Basic Info', {
             'fields': ('hunt_name', 'hunt_number', 'team_size', 'is_current_hunt', 'is_demo', 'eureka_feedback', ),
-            'classes': ('order-0', 'baton-tabs-init', 'baton-tab-fs-date', 'baton-tab-fs-template', 'baton-tab-fs-discord', ),
+            'classes': ('order-0', 'baton-tabs-init', 'baton-tab-fs-date', 'baton-tab-fs-template', 'baton-tab-fs-discord', 'baton-tab-fs-guesses', ),
         }),
         ('Dates', {
             'fields': ( ('start_date', 'display_start_date'), ('end_date', 'display_end_date'),),
@@ -54,6 +55,10 @@ class HuntAdmin(MirrorAdmin, admin.ModelAdmin):
             'fields': ( 'discord_url','discord_bot_id', ),
             'classes': ('tab-fs-discord', ),
         }),
+        ('Guesses', {
+            'fields': ( 'guess_window', ('guess_budget_user', 'guess_budget_team', 'guess_budget_team_puzzle'), ),
+            'classes': ('tab-fs-guesses', ),
+        }),
     )
     mirror_fields = ( ('template', {
         'mode':'htmlmixed',
@@ -181,6 +186,7 @@ class PuzzleAdminForm(forms.ModelForm):
         if puz.pk:
             puz.puzzle_set.clear()
             puz.puzzle_set.add(*self.cleaned_data['reverse_unlocks'])
+        invalidate_dag(puz.episode.hunt_id)
         return puz
 
     def clean_answer(self):
@@ -0,0 +1,93 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.cache import cache
+
+import threading
+import time
+import uuid
+
+
+_missing = object()
+
+
+def fetch_tokens(keys):
+    """ Returns the current version tokens stored at keys, creating those that do not exist yet """
+    tokens = cache.get_many(keys)
+    missing = [k for k in keys if k not in tokens]
+    if missing:
+        for k in missing:
+            cache.add(k, uuid.uuid4().hex, None)
+        tokens.update(cache.get_many(missing))
+    return tuple(tokens.get(k) for k in keys)
+
+
+class VersionedLocalCache(object):
+    """ A process-local cache whose entries are invalidated across processes through version
+    tokens kept in the shared (redis) cache.
+
+    Each entry depends on two tokens: one for its key and one for the whole namespace. An entry is
+    trusted without any round trip for ``ttl`` seconds, after which the tokens are fetched again
+    (a single cache get) and the entry is rebuilt only if one of them has changed.
+
+    If ``shared_timeout`` is given, built values are also stored in the shared cache (for that many
+    seconds) so that only one process has to build each version. """
+
+    def __init__(self, namespace, ttl=5, shared_timeout=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.shared_timeout = shared_timeout
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def version_keys(self, key):
+        """ The (namespace, key) version keys an entry depends on, for use with fetch_tokens """
+        return ('version:%s:*' % self.namespace, 'version:%s:%s' % (self.namespace, key))
+
+    def _tokens(self, key):
+        return fetch_tokens(self.version_keys(key))
+
+    def get(self, key, builder):
+        """ Returns the value stored for key, calling builder() to (re)compute it when needed """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and now < entry[1] + self.ttl:
+            return entry[2]
+
+        # Fetch the tokens before building so that an invalidation racing with the build leaves
+        # the entry outdated rather than silently up to date.
+        tokens = self._tokens(key)
+        if entry is not None and entry[0] == tokens:
+            value = entry[2]
+        elif self.shared_timeout is None:
+            value = builder()
+        else:
+            shared_key = 'cached:%s:%s:%s:%s' % ((self.namespace, key) + tokens)
+            value = cache.get(shared_key, _missing)
+            if value is _missing:
+                value = builder()
+                cache.set(shared_key, value, self.shared_timeout)
+        with self._lock:
+            self._entries[key] = (tokens, now, value)
+        return value
+
+    def invalidate(self, key):
+        """ Invalidates the entry for key in every process """
+        cache.set(self.version_keys(key)[1], uuid.uuid4().hex, None)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_all(self):
+        """ Invalidates every entry of the namespace in every process """
+        cache.set(self.version_keys(None)[0], uuid.uuid4().hex, None)
+        with self._lock:
+            self._entries.clear()
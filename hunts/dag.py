@@ -0,0 +1,76 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+
+from .caching import VersionedLocalCache
+
+
+# Immutable snapshot of the unlocking structure of a hunt, so that unlocks and access checks never
+# go through the Puzzle.unlocks / Episode.unlocks relations:
+#   episode_of:      puzzle pk -> episode pk
+#   required:        puzzle pk -> num_required_to_unlock
+#   parents:         puzzle pk -> tuple of the pks of the puzzles it is unlocked by
+#   children:        puzzle pk -> tuple of the pks of the puzzles it unlocks
+#   episode_puzzles: episode pk -> tuple of its puzzle pks, by puzzle number
+#   episode_next:    episode pk -> pk of the episode it unlocks, or None
+#   first_episodes:  pks of the episodes that are not unlocked by another one
+HuntDag = namedtuple('HuntDag', ['episode_of', 'required', 'parents', 'children',
+                                 'episode_puzzles', 'episode_next', 'first_episodes'])
+
+
+def build_dag(hunt_pk):
+    """ Builds the DAG snapshot of a hunt from the database (three queries) """
+    from .models import Episode, Puzzle
+
+    episode_next = dict(Episode.objects.filter(hunt_id=hunt_pk).values_list('pk', 'unlocks_id'))
+    unlocked = set(episode_next.values())
+    first_episodes = tuple(pk for pk in episode_next if pk not in unlocked)
+
+    episode_of = {}
+    required = {}
+    episode_puzzles = {pk: [] for pk in episode_next}
+    puzzles = Puzzle.objects.filter(episode__hunt_id=hunt_pk).order_by('puzzle_number')
+    for pk, episode_pk, num_required in puzzles.values_list('pk', 'episode_id', 'num_required_to_unlock'):
+        episode_of[pk] = episode_pk
+        required[pk] = num_required
+        episode_puzzles[episode_pk].append(pk)
+
+    parents = {pk: [] for pk in episode_of}
+    children = {pk: [] for pk in episode_of}
+    edges = Puzzle.unlocks.through.objects.filter(from_puzzle__episode__hunt_id=hunt_pk,
+                                                  to_puzzle__episode__hunt_id=hunt_pk)
+    for from_pk, to_pk in edges.values_list('from_puzzle_id', 'to_puzzle_id'):
+        parents[to_pk].append(from_pk)
+        children[from_pk].append(to_pk)
+
+    return HuntDag(episode_of, required,
+                   {pk: tuple(pks) for pk, pks in parents.items()},
+                   {pk: tuple(pks) for pk, pks in children.items()},
+                   {pk: tuple(pks) for pk, pks in episode_puzzles.items()},
+                   episode_next, first_episodes)
+
+
+_dags = VersionedLocalCache('dag', shared_timeout=24 * 3600)
+
+
+def get_dag(hunt_pk):
+    """ Returns the (cached) DAG snapshot of the hunt """
+    return _dags.get(hunt_pk, lambda: build_dag(hunt_pk))
+
+
+def invalidate_dag(hunt_pk=None):
+    """ Bumps the DAG version of one hunt, or of every hunt if hunt_pk is None """
+    if hunt_pk is None:
+        _dags.invalidate_all()
+    else:
+        _dags.invalidate(hunt_pk)
@@ -0,0 +1,89 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Short-circuit for guesses a team already submitted: the previous verdict is returned without
+creating a Guess or running Guess.respond again """
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import VersionedLocalCache, fetch_tokens
+from .matching import matcher_version_keys, normalize_guess
+
+import hashlib
+
+
+# Only the version tokens of this cache are used: they change when a team loses its eurekas
+_teams = VersionedLocalCache('guesses')
+
+
+class GuessCache(object):
+    """ Remembers the (wrong or eureka) verdict given to a team for a guess on a puzzle.
+
+    Entries are keyed by the normalized guess and stored with the version tokens of the puzzle's
+    matcher and of the team, so that they are dropped when the answer or the eurekas change, or when
+    the team is reset. The tokens and the entry are read together, in a single cache lookup. Correct
+    answers are never remembered since they change the state of the team. """
+
+    def __init__(self, timeout=3600):
+        self.timeout = timeout
+
+    def _key(self, team, puzzle, text):
+        digest = hashlib.sha1(normalize_guess(text).encode('utf-8')).hexdigest()
+        return 'guess:%d:%d:%s' % (team.pk, puzzle.pk, digest)
+
+    def _count(self, hunt, outcome):
+        key = 'guess_cache:%s:%d' % (outcome, hunt.pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # first count, or expired or evicted: the counter is only indicative anyway
+            cache.add(key, 1, None)
+
+    def lookup(self, hunt, team, puzzle, text):
+        """ Returns (slot, response): the previous response to this guess, or None, and where to
+            store the response to it """
+        if not getattr(settings, 'GUESS_CACHE_ENABLE', True):
+            return None, None
+        key = self._key(team, puzzle, text)
+        version_keys = matcher_version_keys(puzzle.pk) + _teams.version_keys(team.pk)
+        values = cache.get_many(version_keys + (key,))
+        tokens = tuple(values.get(k) for k in version_keys)
+        if None in tokens:
+            # first guess since the tokens were created or evicted
+            tokens = fetch_tokens(version_keys)
+        entry = values.get(key)
+        response = entry[1] if entry is not None and entry[0] == tokens else None
+        self._count(hunt, 'hits' if response is not None else 'misses')
+        return (key, tokens), response
+
+    def store(self, slot, response):
+        """ Remembers the response given to a guess, unless it solved the puzzle """
+        if slot is not None and response['status'] in ('wrong', 'eureka'):
+            key, tokens = slot
+            cache.set(key, (tokens, response), self.timeout)
+
+    def stats(self, hunt):
+        """ The number of guesses of the hunt that were (not) answered from the cache """
+        counts = cache.get_many(['guess_cache:hits:%d' % hunt.pk, 'guess_cache:misses:%d' % hunt.pk])
+        hits = counts.get('guess_cache:hits:%d' % hunt.pk, 0)
+        misses = counts.get('guess_cache:misses:%d' % hunt.pk, 0)
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'rate': 100 * hits / total if total else 0}
+
+
+guess_cache = GuessCache()
+
+
+def invalidate_team_guesses(team_pk):
+    """ Forgets every verdict remembered for a team """
+    _teams.invalidate(team_pk)
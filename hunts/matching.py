@@ -0,0 +1,150 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+
+from .caching import VersionedLocalCache
+
+import re
+import logging
+logger = logging.getLogger(__name__)
+
+
+# The parts of an Eureka needed to answer a guess, without having to touch the database
+EurekaEntry = namedtuple('EurekaEntry', ['pk', 'answer', 'feedback', 'admin_only'])
+
+
+def normalize_guess(text):
+    """ The canonical form of a guess: upper case and without spaces """
+    return text.upper().replace(" ", "")
+
+
+def _compile(regex, name):
+    try:
+        return re.compile(regex, re.IGNORECASE)
+    except re.error as e:
+        logger.warning("Ignoring invalid regex %r of %s: %s" % (regex, name, e))
+        return None
+
+
+# Eureka regexes made only of these characters match exactly one (case insensitive) string
+_LITERAL = re.compile(r'[A-Za-z0-9_\-]*')
+# Group references and inline flags do not survive being embedded in a larger pattern
+_STANDALONE = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[aiLmsux]')
+
+
+class EurekaAutomaton(object):
+    """ Finds the first eureka (in priority order) whose regex fully matches a guess.
+
+    Plain string eurekas are looked up in a dict, the other regexes are joined into a single
+    alternation of named groups, so that a guess is checked with one scan instead of one scan per
+    eureka. The few regexes that cannot be embedded are still tried one at a time. """
+
+    def __init__(self, eurekas):
+        """ eurekas is a list of (EurekaEntry, regex) pairs, in priority order """
+        self.entries = []
+        self.literals = {}
+        self.combined = None
+        self.combined_first = None
+        self.standalone = []
+
+        parts = []
+        for entry, regex in eurekas:
+            regex = regex.replace(" ", "")
+            compiled = _compile(regex, "eureka %s" % entry.pk)
+            if compiled is None:
+                continue
+            index = len(self.entries)
+            self.entries.append(entry)
+            if _LITERAL.fullmatch(regex):
+                self.literals.setdefault(regex.casefold(), index)
+            elif _STANDALONE.search(regex):
+                self.standalone.append((index, compiled))
+            else:
+                parts.append((index, regex, compiled))
+
+        if parts:
+            try:
+                self.combined = re.compile("|".join("(?P<e%d>%s)" % part[:2] for part in parts), re.IGNORECASE)
+                self.combined_first = parts[0][0]
+            except re.error:
+                self.standalone.extend((index, compiled) for index, regex, compiled in parts)
+                self.standalone.sort(key=lambda item: item[0])
+
+    def match(self, guess):
+        """ Returns the EurekaEntry of the first eureka matching the (normalized) guess, or None """
+        best = self.literals.get(guess.casefold())
+        if self.combined is not None and (best is None or self.combined_first < best):
+            # Alternatives are tried in order, so the group that matched is the first one that can
+            # match the whole guess. Our group encloses all of the user's groups, hence lastgroup.
+            m = self.combined.fullmatch(guess)
+            if m is not None:
+                index = int(m.lastgroup[1:])
+                if best is None or index < best:
+                    best = index
+        for index, regex in self.standalone:
+            if best is not None and index > best:
+                break
+            if regex.fullmatch(guess) is not None:
+                best = index
+                break
+        return self.entries[best] if best is not None else None
+
+
+class PuzzleMatcher(object):
+    """ The answer, answer regex and eureka regexes of a puzzle, compiled once so that checking a
+    guess needs neither a query nor a regex compilation """
+
+    def __init__(self, answer, answer_regex, eurekas):
+        """ eurekas is a list of (EurekaEntry, regex) pairs, in priority order """
+        self.answer = normalize_guess(answer)
+        self.answer_regex = _compile(answer_regex, "answer") if answer_regex != "" else None
+        self.eurekas = EurekaAutomaton(eurekas)
+
+    @classmethod
+    def from_puzzle(cls, puzzle):
+        default_feedback = puzzle.episode.hunt.eureka_feedback
+        eurekas = [(EurekaEntry(e.pk, e.answer, e.feedback if e.feedback != '' else default_feedback, e.admin_only),
+                    e.regex)
+                   for e in puzzle.eureka_set.order_by('pk')]
+        return cls(puzzle.answer, puzzle.answer_regex, eurekas)
+
+    def is_correct(self, text):
+        """ A boolean indicating if the given guess matches either the answer or the regex """
+        guess = normalize_guess(text)
+        return (guess == self.answer or
+                (self.answer_regex is not None and self.answer_regex.fullmatch(guess) is not None))
+
+    def match_eureka(self, text):
+        """ Returns the EurekaEntry of the first eureka matching the guess, or None """
+        return self.eurekas.match(normalize_guess(text))
+
+
+_matchers = VersionedLocalCache('matcher')
+
+
+def get_matcher(puzzle):
+    """ Returns the (process-wide cached) matcher of the given puzzle """
+    return _matchers.get(puzzle.pk, lambda: PuzzleMatcher.from_puzzle(puzzle))
+
+
+def invalidate_matcher(puzzle_pk=None):
+    """ Invalidates the matcher of one puzzle, or of every puzzle if puzzle_pk is None """
+    if puzzle_pk is None:
+        _matchers.invalidate_all()
+    else:
+        _matchers.invalidate(puzzle_pk)
+
+
+def matcher_version_keys(puzzle_pk):
+    """ The version keys of the matcher of a puzzle: their tokens change whenever it is invalidated """
+    return _matchers.version_keys(puzzle_pk)
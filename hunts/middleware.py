@@ -10,48 +10,40 @@
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
+from asgiref.sync import sync_to_async
+from django.utils.deprecation import MiddlewareMixin
 from .models import Team
-from hunts.models import Hunt, Puzzle
+from hunts.resolver import get_puzzle, get_hunt
 
-class PuzzleMiddleware(object):
+import asyncio
+
+
+# The puzzle, hunt and team middlewares only have an async process_view, so that under ASGI they
+# cost nothing to async views, which resolve the puzzle, hunt and team themselves off the event loop
+# (see hunts.views.hunt.puzzle_guess). A sync process_view would run on the single thread that
+# Django 3.1 shares between all the sync parts of async requests. Sync views still get their
+# lookups on that thread, as before.
+def resolved_by_view(view_func):
+    return asyncio.iscoroutinefunction(view_func)
+
+
+class PuzzleMiddleware(MiddlewareMixin):
     """
     Automatically fetch the puzzle if kwargs[puzzle_id] is set
     """
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
-        return self.get_response(request)
-
-    def process_view(self, request, view_func, view_args, view_kwargs):
+    async def process_view(self, request, view_func, view_args, view_kwargs):
         request.puzzle = None
-        try:
-            if 'puzzle_id' in view_kwargs:
-                request.puzzle = Puzzle.objects.get(puzzle_id=view_kwargs['puzzle_id'])
-        except Puzzle.DoesNotExist:
-            request.puzzle = None
+        if 'puzzle_id' in view_kwargs and not resolved_by_view(view_func):
+            request.puzzle = await sync_to_async(get_puzzle, thread_sensitive=True)(view_kwargs['puzzle_id'])
 
 
-class HuntMiddleware(object):
+class HuntMiddleware(MiddlewareMixin):
     """
     Automatically fetch the hunt if the user is logged in
     Either use kwargs[hunt_num] or default to current hunt
     """
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
-        return self.get_response(request)
-
-    def process_view(self, request, view_func, view_args, view_kwargs):
+    async def process_view(self, request, view_func, view_args, view_kwargs):
         request.hunt = None
-        try:
-            if 'hunt_num' in view_kwargs:
-                request.hunt = Hunt.objects.get(hunt_number=view_kwargs['hunt_num'])
-            else:
-                if request.puzzle:
-                    request.hunt = request.puzzle.episode.hunt
-                else:
-                    request.hunt = Hunt.objects.get(is_current_hunt=True)
-        except Hunt.DoesNotExist:
-            request.hunt = None
+        if not resolved_by_view(view_func):
+            request.hunt = await sync_to_async(get_hunt, thread_sensitive=True)(request.puzzle,
+                                                                               view_kwargs.get('hunt_num'))
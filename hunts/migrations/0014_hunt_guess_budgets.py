@@ -0,0 +1,33 @@
+# Generated by Django 3.1.7 on 2026-10-18 12:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hunts', '0013_auto_20210516_1459'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hunt',
+            name='guess_budget_team',
+            field=models.PositiveIntegerField(default=0, help_text='Number of guesses a team can submit per window (all puzzles together), 0 for no limit'),
+        ),
+        migrations.AddField(
+            model_name='hunt',
+            name='guess_budget_team_puzzle',
+            field=models.PositiveIntegerField(default=1, help_text='Number of guesses a team can submit per window on the same puzzle, 0 for no limit'),
+        ),
+        migrations.AddField(
+            model_name='hunt',
+            name='guess_budget_user',
+            field=models.PositiveIntegerField(default=1, help_text='Number of guesses a user can submit per window, 0 for no limit'),
+        ),
+        migrations.AddField(
+            model_name='hunt',
+            name='guess_window',
+            field=models.PositiveIntegerField(default=7, help_text='Length (in seconds) of the sliding window the guess budgets below apply to'),
+        ),
+    ]
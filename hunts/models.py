@@ -15,11 +15,18 @@ from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.utils import timezone
 from django.conf import settings
 from django.db import models, transaction
-from django.db.models import F
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.contrib.postgres.fields import ArrayField
 from datetime import timedelta
-from teams.models import Team, Person, Guess, TeamPuzzleLink, TeamEpisodeLink
-
+from teams.models import Team, Guess, TeamPuzzleLink
+from .caching import VersionedLocalCache
+from .matching import get_matcher, invalidate_matcher
+from .dag import get_dag, invalidate_dag
+from teams.progress import get_progress, invalidate_progress
+from teams.membership import get_user_team
+
+import copy
 import os
 import re
 import zipfile
@@ -48,6 +55,23 @@ def get_hunt_file_path(hunt, filename):
 
 
 
+class HuntManager(models.Manager):
+    """ Manager caching the current hunt, which is needed by nearly every request """
+
+    def get_current(self):
+        """ Returns (a private copy of) the current hunt, only hitting the database after it changed.
+            Raises Hunt.DoesNotExist if there is no current hunt """
+        return copy.deepcopy(_current_hunt.get('current', lambda: self.get(is_current_hunt=True)))
+
+    def invalidate_current(self):
+        """ Drops the cached current hunt in every process, now and once the transaction commits """
+        _current_hunt.invalidate('current')
+        transaction.on_commit(lambda: _current_hunt.invalidate('current'))
+
+
+_current_hunt = VersionedLocalCache('current_hunt')
+
+
 class Hunt(models.Model):
     """ Base class for a hunt. Contains basic details about a puzzlehunt. """
 
@@ -96,7 +120,20 @@ class Hunt(models.Model):
         null=True,
         blank=True,
         help_text="The template string to be rendered to HTML on the puzzle page")
+    guess_window = models.PositiveIntegerField(
+        default=7,
+        help_text="Length (in seconds) of the sliding window the guess budgets below apply to")
+    guess_budget_user = models.PositiveIntegerField(
+        default=1,
+        help_text="Number of guesses a user can submit per window, 0 for no limit")
+    guess_budget_team = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of guesses a team can submit per window (all puzzles together), 0 for no limit")
+    guess_budget_team_puzzle = models.PositiveIntegerField(
+        default=1,
+        help_text="Number of guesses a team can submit per window on the same puzzle, 0 for no limit")
 
+    objects = HuntManager()
 
     def clean(self, *args, **kwargs):
         """ Overrides the standard clean method to ensure that only one hunt is the current hunt """
@@ -117,6 +154,7 @@ class Hunt(models.Model):
         if self.is_current_hunt:
             Hunt.objects.filter(is_current_hunt=True).update(is_current_hunt=False)
         super(Hunt, self).save(*args, **kwargs)
+        Hunt.objects.invalidate_current()
 
     @property
     def is_locked(self):
@@ -157,11 +195,7 @@ class Hunt(models.Model):
         """ Takes a user and a hunt and returns either the user's team for that hunt or None """
         if(not user.is_authenticated):
             return None
-        try:
-            teams = Person.objects.get(user=user).teams.filter(hunt=self)
-            return teams[0] if (len(teams) > 0) else None
-        except Person.DoesNotExist:
-            return None
+        return get_user_team(user.pk, self.pk)
 
     def can_access(self, user, team):
         return self.is_public or user.is_staff or (team and (self.is_open or (team.is_playtester_team and team.playtest_started)))
@@ -171,29 +205,28 @@ class Hunt(models.Model):
         if (user.is_staff or self.is_public):
             episode_list = self.episode_set.order_by('ep_number').all()
         else:
-            if team.is_playtester_team:
-                 episode_pks = TeamEpisodeLink.objects \
-                    .filter(team=team) \
-                    .values_list('episode', flat=True)
-            else:
-                episode_pks = TeamEpisodeLink.objects \
-                    .filter(team=team, episode__start_date__lte=timezone.now()+F("headstart")) \
-                    .values_list('episode', flat=True)
+            episode_pks = get_progress(team).visible_episodes(team.is_playtester_team)
             episode_list = Episode.objects.filter(pk__in=episode_pks).order_by('ep_number')
 
         return episode_list
 
     def get_formatted_episodes(self, user, team):
-#        episodes = sorted(self.get_episodes(user, team), key=lambda p: p.ep_number)
-        episodes = self.get_episodes(user,team)
-        if user.is_staff or self.is_public:
-            episodes = [{'ep': ep, 'puz': ep.puzzle_set.all(), 'solves': 0} for ep in episodes]
-        else:
-            episodes = [{'ep': ep, 'puz': team.puz_unlocked.filter(episode=ep), 'solves':0} for ep in episodes]
-        if team is not None:
-            for i in range(len(episodes)):
-                episodes[i]['solves'] = team.puz_solved.filter(episode=episodes[i]['ep']).count()
-        return episodes
+        episodes = list(self.get_episodes(user,team))
+        progress = get_progress(team)
+        puzzles = Puzzle.objects.filter(episode__in=episodes).order_by('puzzle_number')
+        if not (user.is_staff or self.is_public):
+            puzzles = puzzles.filter(pk__in=progress.puz_unlocked)
+        episode_puzzles = {ep.pk: [] for ep in episodes}
+        for puz in puzzles:
+            episode_puzzles[puz.episode_id].append(puz)
+
+        dag = get_dag(self.pk)
+        formatted = []
+        for ep in episodes:
+            all_puzzles = dag.episode_puzzles.get(ep.pk, ())
+            solves = 0 if progress is None else sum(1 for pk in all_puzzles if pk in progress.puz_solved)
+            formatted.append({'ep': ep, 'puz': episode_puzzles[ep.pk], 'solves': solves, 'total': len(all_puzzles)})
+        return formatted
 
     def get_puzzle_list(self, user, team):
         """ Return the list of puzzles that a user/team can see"""
@@ -300,6 +333,11 @@ class PuzzleManager(models.Manager):
                     .exclude(pk=puz.pk) \
                     .update(puzzle_number=models.F('puzzle_number') - 1)
 
+        # update() does not send signals
+        invalidate_dag(puz.episode.hunt_id)
+        if ep_changed:
+            invalidate_dag(old_episode.hunt_id)
+
 
 class Puzzle(models.Model):
     """ A class representing a puzzle within a hunt """
@@ -366,6 +404,11 @@ class Puzzle(models.Model):
         message['name'] = self.puzzle_name
         return message
 
+    @property
+    def matcher(self):
+        """ The compiled answer/eureka matcher of the puzzle, shared by the whole process """
+        return get_matcher(self)
+
     @property
     def safename(self):
         name = self.puzzle_name.lower().replace(" ", "_")
@@ -375,20 +418,14 @@ class Puzzle(models.Model):
         return str(self.puzzle_number) + "-" + str(self.puzzle_id) + " " + self.puzzle_name + " (" + self.episode.ep_name + ")"
 
     def starting_time_for_team(self, team):
-        episode = self.episode
-        if team is None:
-            return episode.start_date
-        else:
-            try:
-                puz_unlock = TeamPuzzleLink.objects.get(puzzle=self, team=team)
-                ep_unlock = TeamEpisodeLink.objects.get(episode=episode, team=team)
-                if team.is_playtester_team:
-                    return puz_unlock.time
-                return max(puz_unlock.time,episode.start_date-ep_unlock.headstart)
-            except TeamPuzzleLink.DoesNotExist:
-                return episode.start_date
-            except TeamEpisodeLink.DoesNotExist:
-                return episode.start_date
+        """ When the team could start working on the puzzle (see TeamPuzzleLink.effective_start),
+            or the start date of the episode if the team did not unlock it """
+        if team is not None:
+            start = (TeamPuzzleLink.objects.filter(puzzle=self, team=team)
+                     .values_list('effective_start', flat=True).first())
+            if start is not None:
+                return start
+        return self.episode.start_date
 
 
 def puzzle_file_path(instance, filename):
@@ -524,28 +561,21 @@ class Hint(models.Model):
     def compact_id(self):
         return self.id
 
-    def delay_for_team(self, team):
+    def delay_for_team(self, team, start_time=None):
         """Returns how long until the hint unlocks for the given team.
 
-        Parameters as for `unlocked_by`.
+        Parameters as for `unlocked_by`; start_time is the starting time of the puzzle for the
+        team, if the caller already knows it. The release of the hints of unlocked puzzles is also
+        stored in TeamHintLink (see teams.hints).
         """
         if team is None:
             return self.time
-        else:
-            if self.eurekas.all().count() > 0:
-              teams_eurekas = team.teameurekalink_set.all()
-              start_time = self.starting_time_for_team(team)
-              eureka_times = []
-              for eureka in self.eurekas.all():
-                for team_eureka in teams_eurekas:
-                  if eureka == team_eureka.eureka:
-                      eureka_times.append(team_eureka.time - start_time)
-              if len(eureka_times) >= self.number_eurekas:
-                return min(self.time, max(eureka_times) + self.short_time)
-              else:
-                return self.time
-            else:
-                return self.time
+        from teams.hints import release_time
+        if start_time is None:
+            start_time = self.starting_time_for_team(team)
+        found = team.teameurekalink_set.filter(eureka__hint=self).values_list('time', flat=True)
+        release, sped_up = release_time(start_time, self.time, self.number_eurekas, self.short_time, list(found))
+        return release - start_time
 
     def starting_time_for_team(self, team):
         return self.puzzle.starting_time_for_team(team)
@@ -586,3 +616,75 @@ class APIToken(models.Model):
 
     def __str__(self):
         return str(self.token)
+
+
+# drop compiled answer matchers when an answer, a regex or a feedback changes
+@receiver(post_save, sender=Puzzle)
+@receiver(post_delete, sender=Puzzle)
+def invalidate_puzzle_matcher(sender, instance, *args, **kwargs):
+    invalidate_matcher(instance.pk)
+
+@receiver(post_save, sender=Eureka)
+@receiver(post_delete, sender=Eureka)
+def invalidate_eureka_matcher(sender, instance, *args, **kwargs):
+    invalidate_matcher(instance.puzzle_id)
+
+# the default eureka feedback is stored on the hunt
+@receiver(post_save, sender=Hunt)
+def invalidate_hunt_matchers(sender, instance, *args, **kwargs):
+    invalidate_matcher()
+
+# episode start dates are part of the team progress
+@receiver(post_save, sender=Episode)
+def invalidate_episode_progress(sender, instance, *args, **kwargs):
+    invalidate_progress()
+
+# the hint schedule of the teams that unlocked the puzzle of a hint
+@receiver(post_save, sender=Hint)
+def refresh_hint(sender, instance, *args, **kwargs):
+    from teams.hints import refresh_hint_schedule
+    refresh_hint_schedule(hints=[instance.pk])
+
+@receiver(m2m_changed, sender=Hint.eurekas.through)
+def refresh_hint_eurekas(sender, instance, action, reverse, pk_set, *args, **kwargs):
+    from teams.hints import refresh_hint_schedule
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        refresh_hint_schedule(hints=[instance.pk])
+    elif action == 'post_clear':
+        refresh_hint_schedule(puzzles=[instance.puzzle_id])
+    else:
+        refresh_hint_schedule(hints=pk_set)
+
+# the effective start of the unlocks depends on the episode start date
+@receiver(post_save, sender=Episode)
+def refresh_episode_starts(sender, instance, created, *args, **kwargs):
+    if not created:
+        from teams.unlocks import refresh_effective_starts
+        refresh_effective_starts(episode=instance)
+
+# drop the DAG snapshots when the unlocking structure changes
+@receiver(post_save, sender=Puzzle)
+@receiver(post_save, sender=Episode)
+@receiver(post_delete, sender=Puzzle)
+@receiver(post_delete, sender=Episode)
+@receiver(m2m_changed, sender=Puzzle.unlocks.through)
+def invalidate_hunt_dag(sender, *args, **kwargs):
+    invalidate_dag()
+
+# Hunt.save already takes care of the current hunt cache
+@receiver(post_delete, sender=Hunt)
+def invalidate_current_hunt(sender, instance, *args, **kwargs):
+    Hunt.objects.invalidate_current()
+
+# puzzles are cached with their episode and hunt by the request resolver
+@receiver(post_save, sender=Puzzle)
+@receiver(post_save, sender=Episode)
+@receiver(post_save, sender=Hunt)
+@receiver(post_delete, sender=Puzzle)
+@receiver(post_delete, sender=Episode)
+@receiver(post_delete, sender=Hunt)
+def invalidate_resolved_puzzles(sender, *args, **kwargs):
+    from .resolver import invalidate_puzzles
+    invalidate_puzzles()
@@ -0,0 +1,152 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+""" The staff overview of a hunt: where each team is stuck, on its last unlocked puzzle. Each part of
+the rows (last unlocks, solves, guesses, eurekas, hint releases) is fetched for every team at once
+by a grouped query and the rows are assembled in memory, so the number of queries does not grow
+with the number of teams. The rows are cached for a few seconds and shared by the staff viewers. """
+
+from django.core.cache import cache
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.utils import timezone
+
+from teams.models import Team, TeamPuzzleLink, TeamEurekaLink, TeamHintLink, PuzzleSolve
+from .models import Eureka, Guess, Hint
+
+from collections import defaultdict
+
+
+def getColor(minutes, minutes_lastguess, team_hints, total_hints):
+    """ The background color of an overview row """
+    if minutes_lastguess > 60 or (minutes_lastguess < 0 and minutes > 30):
+        return "rgb(213,213,213)"
+    if minutes < 0:
+        return "rgb(192,163,255)"
+    if total_hints:
+        minutes += team_hints * 60. / total_hints
+    if (minutes < 60):
+        return "rgb(" + str(int(168*(1-minutes/60.)+255*minutes/60.)) + ",255,163)"
+    elif (minutes < 120):
+        minutes -= 60
+        return "rgb(255," + str(int(255*(1-minutes/60.)+163*minutes/60.)) + ",163)"
+    else:
+        return "rgb(255,163,163)"
+
+
+def _minutes(now, time):
+    return int((now - time).total_seconds()/60)
+
+
+def overview_rows(hunt):
+    """ The rows of the overview of the hunt, one per team by team name """
+    now = timezone.now()
+    last_unlock = (TeamPuzzleLink.objects.filter(team=OuterRef('pk')).order_by('-time', '-pk').values('pk')[:1])
+    teams = list(Team.objects.filter(hunt=hunt).order_by('team_name')
+                 .annotate(last_unlock=Subquery(last_unlock)).values_list('pk', 'team_name', 'last_unlock'))
+    unlocks = {link.team_id: link for link in TeamPuzzleLink.objects.select_related('puzzle__episode')
+               .filter(pk__in=[last for pk, name, last in teams if last is not None])}
+
+    solved = defaultdict(set)
+    for team_id, puzzle_id in PuzzleSolve.objects.filter(team__hunt=hunt).values_list('team', 'puzzle'):
+        solved[team_id].add(puzzle_id)
+
+    # the puzzle each team is stuck on
+    stuck = {team_id: link.puzzle_id for team_id, link in unlocks.items() if link.puzzle_id not in solved[team_id]}
+    puzzles = set(stuck.values())
+
+    guesses = {}
+    for team_id, puzzle_id, nb, last in (Guess.objects.filter(team__hunt=hunt, puzzle__in=puzzles).order_by()
+                                         .values_list('team', 'puzzle').annotate(Count('pk'), Max('pk'))):
+        if stuck.get(team_id) == puzzle_id:
+            guesses[team_id] = (nb, last)
+    last_guesses = {guess.pk: guess for guess in
+                    Guess.objects.filter(pk__in=[last for nb, last in guesses.values()]).only('guess_text', 'guess_time')}
+
+    eurekas = defaultdict(list)
+    admin_eurekas = defaultdict(list)
+    for team_id, puzzle_id, answer, admin_only, time in (
+            TeamEurekaLink.objects.filter(team__hunt=hunt, eureka__puzzle__in=puzzles).order_by('time')
+            .values_list('team', 'eureka__puzzle', 'eureka__answer', 'eureka__admin_only', 'time')):
+        if stuck.get(team_id) == puzzle_id:
+            (admin_eurekas if admin_only else eurekas)[team_id].append((answer, time))
+    total_eurekas = dict(Eureka.objects.filter(puzzle__in=puzzles, admin_only=False).order_by()
+                         .values_list('puzzle').annotate(Count('pk')))
+    total_hints = dict(Hint.objects.filter(puzzle__in=puzzles).order_by().values_list('puzzle').annotate(Count('pk')))
+
+    releases = defaultdict(list)
+    for team_id, puzzle_id, time in (TeamHintLink.objects.filter(team__hunt=hunt, hint__puzzle__in=puzzles)
+                                     .values_list('team', 'hint__puzzle', 'time')):
+        if stuck.get(team_id) == puzzle_id:
+            releases[team_id].append(time)
+
+    rows = []
+    for team_id, team_name, last in teams:
+        nb_solve = len(solved[team_id])
+        if team_id not in stuck:
+            rows.append({'team': team_name,
+                         'puzzle': {'name': 'None found' if last is None else 'Hunt Finished!', 'time': '-', 'index': nb_solve if last is None else 0, 'color': "rgb(163,163,163)"},
+                         'guesses': {'nb': '-', 'last': '...', 'time': '-'},
+                         'eurekas': {'nb': 0, 'last': '...', 'time': '-', 'total': 1},
+                         'hints': {'nb': 0, 'last_time': '-', 'next_time': '-', 'total': 1},
+                         'admin_eurekas': []
+                         })
+            continue
+        unlock = unlocks[team_id]
+        puzzle = unlock.puzzle
+        start_time = unlock.effective_start or puzzle.episode.start_date
+        time_stuck = max(-1, _minutes(now, start_time))
+
+        nb_guess, last_guess = guesses.get(team_id, (0, None))
+        last_guess = last_guesses.get(last_guess)
+        text_lastguess = '' if last_guess is None else last_guess.guess_text
+        time_lastguess = -1 if last_guess is None else _minutes(now, last_guess.guess_time)
+
+        team_eurekas = eurekas[team_id]
+        text_lasteureka = team_eurekas[-1][0] if team_eurekas else ''
+        time_lasteureka = _minutes(now, team_eurekas[-1][1]) if team_eurekas else -1
+
+        team_hints = 0
+        last_hint_time = 360
+        next_hint_time = 360  # default max time: 6h
+        for release in releases[team_id]:
+            delay = (release - now).total_seconds()
+            if delay < 0:
+                team_hints += 1
+                last_hint_time = int(min(last_hint_time, -delay/60))
+            else:
+                next_hint_time = int(min(next_hint_time, delay/60))
+        if last_hint_time == 360:
+            last_hint_time = -1
+        if next_hint_time == 360:
+            next_hint_time = -1
+
+        hints = total_hints.get(puzzle.pk, 0)
+        color = getColor(time_stuck, time_lastguess, team_hints, hints)
+        rows.append({'team': team_name,
+                     'puzzle': {'name': puzzle.puzzle_name, 'time': time_stuck, 'index': nb_solve+1, 'color': color},
+                     'guesses': {'nb': nb_guess, 'last': text_lastguess, 'time': time_lastguess},
+                     'eurekas': {'nb': len(team_eurekas), 'last': text_lasteureka, 'time': time_lasteureka, 'total': total_eurekas.get(puzzle.pk, 0)},
+                     'hints': {'nb': team_hints, 'last_time': last_hint_time, 'next_time': next_hint_time, 'total': hints},
+                     'admin_eurekas': [{'txt': answer, 'time': _minutes(now, time)} for answer, time in admin_eurekas[team_id]],
+                     })
+    return rows
+
+
+def cached_overview_rows(hunt, timeout=10):
+    """ The rows of the overview of the hunt, computed at most once every timeout seconds for all
+        the staff viewers """
+    key = 'overview:%d' % hunt.pk
+    rows = cache.get(key)
+    if rows is None:
+        rows = overview_rows(hunt)
+        cache.set(key, rows, timeout)
+    return rows
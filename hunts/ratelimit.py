@@ -0,0 +1,130 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Sliding window limiter for guesses, with per-user, per-team and per-team-per-puzzle budgets """
+
+from django.conf import settings
+from django.core.cache import cache
+
+import threading
+import time
+import uuid
+
+
+# KEYS: one sorted set per budget, holding the timestamps (ms) of the accepted guesses
+# ARGV: now (ms), window (ms), unique member, then the limit of each key
+# Returns {allowed, wait}: if allowed, the guess is recorded in every window and wait is the time
+# until the next guess will be allowed; otherwise nothing is recorded and wait is the time until
+# this guess would have been allowed.
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+
+local function wait_for(key, limit, count)
+    local oldest = redis.call('ZRANGE', key, count - limit, count - limit, 'WITHSCORES')
+    return tonumber(oldest[2]) + window - now
+end
+
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i + 3])
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+    local count = redis.call('ZCARD', key)
+    if count >= limit then
+        wait = math.max(wait, wait_for(key, limit, count))
+    end
+end
+if wait > 0 then
+    return {0, wait}
+end
+
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i + 3])
+    redis.call('ZADD', key, now, ARGV[3])
+    redis.call('PEXPIRE', key, window)
+    local count = redis.call('ZCARD', key)
+    if count >= limit then
+        wait = math.max(wait, wait_for(key, limit, count))
+    end
+end
+return {1, wait}
+"""
+
+
+class GuessLimiter(object):
+    """ Checks and records guesses against the budgets of a hunt in one atomic redis call.
+
+    Without a redis cache (development, tests), the same algorithm runs on the django cache under a
+    process lock, which is only atomic within one process. """
+
+    def __init__(self):
+        self._script = None
+        self._lock = threading.Lock()
+
+    def _redis_script(self):
+        if self._script is None:
+            try:
+                from django_redis import get_redis_connection
+                self._script = get_redis_connection('default').register_script(SLIDING_WINDOW_SCRIPT)
+            except (ImportError, NotImplementedError):
+                self._script = False
+        return self._script
+
+    def _budgets(self, hunt, team, puzzle, user):
+        """ (key, limit) pairs of the budgets this guess counts against; a limit of 0 means none """
+        budgets = [('user:%d:%d' % (hunt.pk, user.pk), hunt.guess_budget_user),
+                   ('team:%d' % team.pk, hunt.guess_budget_team),
+                   ('puzzle:%d:%d' % (team.pk, puzzle.pk), hunt.guess_budget_team_puzzle)]
+        return [('ratelimit:' + key, limit) for key, limit in budgets if limit > 0]
+
+    def hit(self, hunt, team, puzzle, user):
+        """ Records a guess if it is within every budget.
+
+        Returns (allowed, wait) where wait (in seconds) is the time until the next guess will be
+        allowed if this one was, or until this one would have been allowed otherwise. """
+        if not getattr(settings, 'RATELIMIT_ENABLE', True):
+            return True, 0
+        budgets = self._budgets(hunt, team, puzzle, user)
+        if not budgets:
+            return True, 0
+
+        now = int(time.time() * 1000)
+        window = hunt.guess_window * 1000
+        member = '%d:%s' % (now, uuid.uuid4().hex)
+        script = self._redis_script()
+        if script:
+            allowed, wait = script(keys=[cache.make_key(key) for key, limit in budgets],
+                                   args=[now, window, member] + [limit for key, limit in budgets])
+        else:
+            allowed, wait = self._local_hit(budgets, now, window)
+        return bool(allowed), max(wait, 0) / 1000
+
+    def _local_hit(self, budgets, now, window):
+        with self._lock:
+            windows = {key: [t for t in cache.get(key, []) if t > now - window] for key, limit in budgets}
+
+            def wait_for(key, limit):
+                stamps = windows[key]
+                if len(stamps) < limit:
+                    return 0
+                return stamps[len(stamps) - limit] + window - now
+
+            wait = max(wait_for(key, limit) for key, limit in budgets)
+            if wait > 0:
+                return 0, wait
+            for key, limit in budgets:
+                windows[key].append(now)
+                cache.set(key, windows[key], window / 1000)
+            return 1, max(wait_for(key, limit) for key, limit in budgets)
+
+
+guess_limiter = GuessLimiter()
@@ -0,0 +1,91 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Resolution of the puzzle, hunt and team a request (or a websocket) is about, shared by the
+middlewares, the views and the consumers so that each of them is only looked up once """
+
+from collections import namedtuple
+
+from .caching import VersionedLocalCache
+from .models import Hunt, Puzzle
+
+import copy
+
+
+RequestContext = namedtuple('RequestContext', ['puzzle', 'hunt', 'team'])
+
+
+def _load_puzzle_ids():
+    ids = {}
+    for pk, puzzle_id in Puzzle.objects.values_list('pk', 'puzzle_id'):
+        ids.setdefault(puzzle_id.lower(), {})[puzzle_id] = pk
+    return ids
+
+
+def _load_puzzle(pk):
+    return Puzzle.objects.select_related('episode__hunt').filter(pk=pk).first()
+
+
+# The ids come from URLs and websocket messages: only the ids of existing puzzles are cached, as a
+# single map to their pks, so that unknown ids cost neither a query nor a cache entry
+_puzzle_ids = VersionedLocalCache('puzzle-ids')
+_puzzles = VersionedLocalCache('puzzle')
+
+
+def _puzzle_pk(puzzle_id):
+    """ The pk of the puzzle with the given id, matched exactly if several ids only differ by
+        case, else case insensitively; None if there is no such puzzle """
+    matches = _puzzle_ids.get('all', _load_puzzle_ids).get(puzzle_id.lower(), {})
+    if puzzle_id in matches:
+        return matches[puzzle_id]
+    if len(matches) == 1:
+        return next(iter(matches.values()))
+    return None
+
+
+def get_puzzle(puzzle_id):
+    """ Returns (a private copy of) the puzzle with the given case insensitive id, with its episode
+        and hunt already loaded, or None """
+    pk = _puzzle_pk(puzzle_id)
+    if pk is None:
+        return None
+    return copy.deepcopy(_puzzles.get(pk, lambda: _load_puzzle(pk)))
+
+
+def invalidate_puzzles():
+    """ Drops every cached puzzle (puzzle ids can be renamed, so there is no finer invalidation) """
+    _puzzle_ids.invalidate_all()
+    _puzzles.invalidate_all()
+
+
+def get_hunt(puzzle=None, hunt_num=None):
+    """ The hunt of the puzzle, or with the given number, or else the current hunt; None if there
+        is no such hunt """
+    if puzzle is not None and hunt_num is None:
+        return puzzle.episode.hunt
+    try:
+        hunt = Hunt.objects.get_current()
+    except Hunt.DoesNotExist:
+        hunt = None
+    if hunt_num is not None and (hunt is None or hunt.hunt_number != int(hunt_num)):
+        hunt = Hunt.objects.filter(hunt_number=hunt_num).first()
+    return hunt
+
+
+def resolve(user, puzzle_id=None, hunt_num=None):
+    """ Resolves the puzzle, hunt and team of a user's request """
+    puzzle = get_puzzle(puzzle_id) if puzzle_id is not None else None
+    hunt = get_hunt(puzzle, hunt_num)
+    team = None
+    if hunt is not None and user.is_authenticated:
+        team = hunt.team_from_user(user)
+    return RequestContext(puzzle, hunt, team)
@@ -54,21 +54,21 @@ def duration(td):
 
 @register.filter()
 def render_with_context(value, user):
-    return Template(value).render(Context({'curr_hunt': Hunt.objects.get(is_current_hunt=True), 'user': user}))
+    return Template(value).render(Context({'curr_hunt': Hunt.objects.get_current(), 'user': user}))
     
 @register.filter()
 def render_hunt_with_context(value, team):
-    hunt = Hunt.objects.get(is_current_hunt=True)
+    hunt = Hunt.objects.get_current()
     nbsolve = 0
     if team is not None:
       nbsolve = team.ep_solved.count()
-    return Template(value).render(Context({'curr_hunt': Hunt.objects.get(is_current_hunt=True),  'nb_solve': nbsolve}))
+    return Template(value).render(Context({'curr_hunt': hunt,  'nb_solve': nbsolve}))
     
 @register.simple_tag(takes_context=True)
 def render_with_context_simpletag(context):
     user = context['user']
     value = context['flatpage'].content
-    hunt = Hunt.objects.get(is_current_hunt=True)
+    hunt = Hunt.objects.get_current()
     team = hunt.team_from_user(user)
     nbsolve = 0
     if team is not None:
@@ -82,7 +82,7 @@ def set_curr_hunt(parser, token):
 
 class CurrentHuntEventNode(template.Node):
     def render(self, context):
-        context['tmpl_curr_hunt'] = Hunt.objects.get(is_current_hunt=True)
+        context['tmpl_curr_hunt'] = Hunt.objects.get_current()
         return ''
 
 @register.filter
@@ -115,5 +115,5 @@ class HuntFromContextEventNode(template.Node):
             context['tmpl_hunt'] = context['puzzle'].hunt
             return ''
         else:
-            context['tmpl_hunt'] = Hunt.objects.get(is_current_hunt=True)
+            context['tmpl_hunt'] = Hunt.objects.get_current()
             return ''
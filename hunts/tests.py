@@ -10,6 +10,638 @@
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
-from django.test import TestCase
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-# Create your tests here.
+from .guess_cache import GuessCache, invalidate_team_guesses
+from .matching import EurekaEntry, PuzzleMatcher, invalidate_matcher
+from .middleware import HuntMiddleware, PuzzleMiddleware
+from .models import Hunt, Episode, Puzzle, Eureka, Hint
+from .ratelimit import GuessLimiter
+from .resolver import get_puzzle
+from .views import hunt as hunt_views
+from .views.hunt import puzzle_guess
+from teams.board import GUESSED, UNLOCKED
+from teams.consumers import PuzzleWebsocket, TeamWebsocket, puzzle_group
+from teams.hint_scheduler import hint_scheduler
+from teams.hints import with_hint_counts
+from teams.middleware import TeamMiddleware
+from teams.models import Team, Person, Guess, PuzzleSolve, TeamEpisodeLink, TeamPuzzleLink, TeamHintLink
+from teams.routing import websocket_urlpatterns
+
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import patch
+import asyncio
+import os
+import threading
+import tracemalloc
+import unittest
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def close_guess_workers():
+    """ Closes the DB connections that the workers of the async guess view keep open, which would
+        otherwise prevent the test database from being dropped """
+    workers = settings.GUESS_WORKERS
+    # every worker waits for the others, so that each of them runs exactly one of the jobs
+    barrier = threading.Barrier(workers)
+
+    def close():
+        barrier.wait()
+        connections.close_all()
+    for future in [hunt_views._guess_executor.submit(close) for i in range(workers)]:
+        future.result()
+
+
+class PuzzleMatcherTests(SimpleTestCase):
+    def matcher(self, *regexes):
+        return PuzzleMatcher("the answer", "ANS.*", [(EurekaEntry(i, r, "", False), r) for i, r in enumerate(regexes)])
+
+    def match(self, matcher, text):
+        entry = matcher.match_eureka(text)
+        return entry.pk if entry is not None else None
+
+    def test_answer(self):
+        matcher = self.matcher()
+        self.assertTrue(matcher.is_correct("The Answer"))
+        self.assertTrue(matcher.is_correct("answers"))
+        self.assertFalse(matcher.is_correct("an answer"))
+
+    def test_first_match_wins(self):
+        matcher = self.matcher("STEP.*", "step one", "(STEP)(ONE)", "ST(E)P\\1", "other")
+        self.assertEqual(self.match(matcher, "Step One"), 0)
+        self.assertEqual(self.match(matcher, "stepe"), 0)
+        self.assertEqual(self.match(matcher, "other"), 4)
+        self.assertIsNone(self.match(matcher, "nothing"))
+
+    def test_literals_and_regexes_keep_their_order(self):
+        matcher = self.matcher("A|B", "b", "C", "(?i)c+", "(X)(Y)?")
+        self.assertEqual(self.match(matcher, "b"), 0)
+        self.assertEqual(self.match(matcher, "c"), 2)
+        self.assertEqual(self.match(matcher, "cc"), 3)
+        self.assertEqual(self.match(matcher, "x"), 4)
+
+    def test_full_match_only(self):
+        matcher = self.matcher("AB", "A.", "ABC")
+        self.assertEqual(self.match(matcher, "abc"), 2)
+        self.assertEqual(self.match(matcher, "ax"), 1)
+
+    def test_invalid_regex_is_skipped(self):
+        matcher = self.matcher("(unclosed", "fine")
+        self.assertEqual(self.match(matcher, "fine"), 1)
+
+
+class CurrentHuntTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.hunt = Hunt.objects.create(hunt_name="hunt", hunt_number=1, team_size=3, start_date=now,
+                                        end_date=now, display_start_date=now, display_end_date=now,
+                                        is_current_hunt=True)
+
+    def current_hunt_queries(self, queries):
+        return [q for q in queries if '"hunts_hunt"."is_current_hunt"' in q['sql'] and 'UPDATE' not in q['sql']]
+
+    def test_index_fetches_current_hunt_once_then_never(self):
+        with CaptureQueriesContext(connection) as cold:
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(self.current_hunt_queries(cold.captured_queries)), 1)
+
+        with CaptureQueriesContext(connection) as warm:
+            self.client.get('/')
+        self.assertEqual(len(self.current_hunt_queries(warm.captured_queries)), 0)
+
+    def test_async_guess_endpoint(self):
+        self.addCleanup(close_guess_workers)
+        self.assertEqual(self.client.get('/puzzle/abc/guess/').status_code, 405)
+        self.assertEqual(self.client.post('/puzzle/abc/guess/', {'answer': 'x'}).status_code, 404)
+
+    def test_middlewares_leave_async_views_alone(self):
+        """ The lookups of the async guess view are done on its workers, not on the shared thread """
+        request = RequestFactory().post('/puzzle/abc/guess/')
+        request.user = AnonymousUser()
+        with self.assertNumQueries(0):
+            for middleware in (PuzzleMiddleware, HuntMiddleware, TeamMiddleware):
+                async_to_sync(middleware(lambda request: None).process_view)(request, puzzle_guess, (),
+                                                                             {'puzzle_id': 'abc'})
+        self.assertEqual((request.puzzle, request.hunt, request.team), (None, None, None))
+
+    def test_save_invalidates_current_hunt(self):
+        self.assertEqual(Hunt.objects.get_current().pk, self.hunt.pk)
+        now = timezone.now()
+        other = Hunt.objects.create(hunt_name="other", hunt_number=2, team_size=3, start_date=now,
+                                    end_date=now, display_start_date=now, display_end_date=now,
+                                    is_current_hunt=True)
+        self.assertEqual(Hunt.objects.get_current().pk, other.pk)
+        with self.assertNumQueries(0):
+            Hunt.objects.get_current()
+
+
+class ResolverTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.hunt = Hunt.objects.create(hunt_name="hunt", hunt_number=1, team_size=3, start_date=now,
+                                        end_date=now, display_start_date=now, display_end_date=now,
+                                        is_current_hunt=True)
+
+    def test_puzzle_resolution(self):
+        episode = Episode.objects.create(ep_name="episode", ep_number=1, start_date=timezone.now(), hunt=self.hunt)
+        lower = Puzzle.objects.create(episode=episode, puzzle_name="a", puzzle_number=1, puzzle_id="abc", answer="a")
+        upper = Puzzle.objects.create(episode=episode, puzzle_name="b", puzzle_number=2, puzzle_id="ABC", answer="b")
+        self.assertEqual(get_puzzle("abc").pk, lower.pk)
+        self.assertEqual(get_puzzle("ABC").pk, upper.pk)
+        self.assertIsNone(get_puzzle("Abc"))
+        # unknown ids are neither queried nor remembered
+        get_puzzle("abc")
+        with self.assertNumQueries(0):
+            for i in range(10):
+                self.assertIsNone(get_puzzle("unknown%d" % i))
+        self.assertFalse(any(cache.has_key('version:puzzle:unknown%d' % i) for i in range(10)))
+
+
+@override_settings(RATELIMIT_ENABLE=True,
+                   CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GuessLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.limiter = GuessLimiter()
+        self.hunt = SimpleNamespace(pk=1, guess_window=7, guess_budget_user=2, guess_budget_team=0,
+                                    guess_budget_team_puzzle=1)
+        self.team = SimpleNamespace(pk=1)
+        self.user = SimpleNamespace(pk=1)
+
+    def hit(self, puzzle_pk):
+        return self.limiter.hit(self.hunt, self.team, SimpleNamespace(pk=puzzle_pk), self.user)
+
+    def test_budgets(self):
+        allowed, wait = self.hit(1)
+        self.assertTrue(allowed)
+        self.assertAlmostEqual(wait, 7, delta=0.1)
+        # the per-puzzle budget is spent, but not the per-user one
+        allowed, wait = self.hit(1)
+        self.assertFalse(allowed)
+        self.assertGreater(wait, 0)
+        self.assertTrue(self.hit(2)[0])
+        self.assertFalse(self.hit(3)[0])
+
+    @override_settings(RATELIMIT_ENABLE=False)
+    def test_disabled(self):
+        for i in range(3):
+            self.assertEqual(self.hit(1), (True, 0))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GuessCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.cache = GuessCache()
+        self.hunt = SimpleNamespace(pk=1)
+        self.team = SimpleNamespace(pk=1)
+        self.puzzle = SimpleNamespace(pk=1)
+
+    def lookup(self, text):
+        return self.cache.lookup(self.hunt, self.team, self.puzzle, text)
+
+    def test_same_normalized_guess_hits(self):
+        slot, response = self.lookup("Wrong Guess")
+        self.assertIsNone(response)
+        self.cache.store(slot, {"status": "wrong", "message": "Wrong Answer"})
+        self.assertEqual(self.lookup("wrongguess")[1]["status"], "wrong")
+        self.assertEqual(self.cache.stats(self.hunt), {'hits': 1, 'misses': 1, 'rate': 50})
+
+    def test_correct_is_not_stored(self):
+        slot, response = self.lookup("answer")
+        self.cache.store(slot, {"status": "correct", "message": "Correct!"})
+        self.assertIsNone(self.lookup("answer")[1])
+
+    def test_invalidation(self):
+        slot, response = self.lookup("eureka")
+        self.cache.store(slot, {"status": "eureka", "message": "Keep going"})
+        invalidate_matcher(self.puzzle.pk)
+        self.assertIsNone(self.lookup("eureka")[1])
+        slot, response = self.lookup("eureka")
+        self.cache.store(slot, {"status": "eureka", "message": "Keep going"})
+        invalidate_team_guesses(self.team.pk)
+        self.assertIsNone(self.lookup("eureka")[1])
+
+    def test_single_lookup(self):
+        slot, response = self.lookup("wrong")
+        self.cache.store(slot, {"status": "wrong", "message": "Wrong Answer"})
+        with patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            self.assertEqual(self.lookup("wrong")[1]["status"], "wrong")
+        self.assertEqual(get_many.call_count, 1)
+
+
+class HuntFixture(object):
+    """ A current hunt with an episode of two puzzles, the first unlocking the second, and a team of
+        five users """
+    def setUp(self):
+        now = timezone.now()
+        self.hunt = Hunt.objects.create(hunt_name="hunt", hunt_number=1, team_size=3, start_date=now,
+                                        end_date=now, display_start_date=now, display_end_date=now,
+                                        is_current_hunt=True)
+        episode = Episode.objects.create(ep_name="episode", ep_number=1, start_date=now, hunt=self.hunt)
+        self.puzzle = Puzzle.objects.create(episode=episode, puzzle_name="first", puzzle_number=1,
+                                            puzzle_id="first", answer="first", num_required_to_unlock=0)
+        self.episode = episode
+        second = Puzzle.objects.create(episode=episode, puzzle_name="second", puzzle_number=2,
+                                       puzzle_id="second", answer="second", num_required_to_unlock=1)
+        self.puzzle.unlocks.add(second)
+        self.team = Team.objects.create(team_name="team", hunt=self.hunt, join_code="AAAAA")
+        self.users = [User.objects.create(username="user%d" % i) for i in range(5)]
+        for user in self.users:
+            Person.objects.create(user=user).teams.add(self.team)
+
+    def guess(self, user, text):
+        guess = Guess.objects.create(guess_text=text, team=self.team, user=user, puzzle=self.puzzle,
+                                     guess_time=timezone.now())
+        return guess.respond()
+
+
+class StaffFixture(HuntFixture):
+    """ The hunt fixture, seen by a staff member """
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create(username="staff", is_staff=True))
+
+
+class SolveTests(HuntFixture, TransactionTestCase):
+    def test_async_guess(self):
+        self.addCleanup(close_guess_workers)
+        self.hunt.end_date = timezone.now() + timedelta(days=1)
+        self.hunt.save()
+        self.client.force_login(self.users[0])
+        response = self.client.post('/puzzle/first/guess/', {'answer': 'wrong'})
+        self.assertEqual((response.json()['status'], response.json()['by']), ('wrong', 'user0'))
+
+    def test_solve_query_count(self):
+        self.guess(self.users[0], "wrong")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.guess(self.users[0], "first")["status"], "correct")
+        self.assertLessEqual(len(queries), 12)
+        self.assertTrue(self.team.puz_unlocked.filter(puzzle_id="second").exists())
+        # a second correct guess only takes the lock and sees the solve
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.guess(self.users[1], "first")["status"], "correct")
+        self.assertLessEqual(len(queries), 4)
+        self.assertEqual(PuzzleSolve.objects.filter(team=self.team, puzzle=self.puzzle).count(), 1)
+
+    def test_parallel_correct_guesses(self):
+        barrier = threading.Barrier(len(self.users))
+        errors = []
+
+        def submit(user):
+            try:
+                guess = Guess.objects.create(guess_text="first", team=self.team, user=user, puzzle=self.puzzle,
+                                             guess_time=timezone.now())
+                barrier.wait()
+                guess.respond()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(PuzzleSolve.objects.filter(team=self.team, puzzle=self.puzzle).count(), 1)
+        self.assertEqual(self.team.puz_unlocked.filter(puzzle_id="second").count(), 1)
+
+    def test_effective_start(self):
+        unlock = TeamPuzzleLink.objects.get(team=self.team, puzzle=self.puzzle)
+        self.assertEqual(self.puzzle.starting_time_for_team(self.team), unlock.time)
+        # the episode opens later, but a headstart lets the team in earlier
+        self.episode.start_date = unlock.time + timedelta(hours=1)
+        self.episode.save()
+        self.assertEqual(self.puzzle.starting_time_for_team(self.team), self.episode.start_date)
+        link = TeamEpisodeLink.objects.get(team=self.team, episode=self.episode)
+        link.headstart = timedelta(minutes=20)
+        link.save()
+        self.assertEqual(self.puzzle.starting_time_for_team(self.team), unlock.time + timedelta(minutes=40))
+        self.assertEqual(TeamPuzzleLink.objects.starting_times([self.team], [self.puzzle]),
+                         {(self.team.pk, self.puzzle.pk): unlock.time + timedelta(minutes=40)})
+        self.team.playtester = True
+        self.team.save()
+        self.assertEqual(self.puzzle.starting_time_for_team(self.team), unlock.time)
+
+    def test_hint_schedule(self):
+        eureka = Eureka.objects.create(puzzle=self.puzzle, regex="eureka", answer="eureka", feedback="")
+        hint = Hint.objects.create(puzzle=self.puzzle, text="hint", time=timedelta(hours=1),
+                                   short_time=timedelta(minutes=10))
+        hint.eurekas.add(eureka)
+        start = self.puzzle.starting_time_for_team(self.team)
+        link = TeamHintLink.objects.get(team=self.team, hint=hint)
+        self.assertEqual((link.time, link.sped_up), (start + timedelta(hours=1), False))
+        self.assertEqual(hint.delay_for_team(self.team), timedelta(hours=1))
+
+        self.guess(self.users[0], "eureka")
+        link.refresh_from_db()
+        self.assertTrue(link.sped_up)
+        self.assertEqual(hint.delay_for_team(self.team), link.time - start)
+        self.assertLess(link.time - start, timedelta(minutes=11))
+
+        self.guess(self.users[0], "first")
+        solve = with_hint_counts(PuzzleSolve.objects.filter(team=self.team)).get()
+        self.assertEqual(solve.hints, 0)
+        TeamHintLink.objects.update(time=start)
+        self.assertEqual(with_hint_counts(PuzzleSolve.objects.filter(team=self.team)).get().hints, 1)
+
+    def test_hint_release(self):
+        hint_scheduler.release_due()
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)('puzzle-%d.events.team-%d' % (self.puzzle.pk, self.team.pk), channel)
+        later = Hint.objects.create(puzzle=self.puzzle, text="later", time=timedelta(hours=1), short_time=timedelta(0))
+        now = Hint.objects.create(puzzle=self.puzzle, text="now", time=timedelta(0), short_time=timedelta(0))
+        # released once per team, whatever the number of sockets
+        self.assertEqual(hint_scheduler.release_due(), 1)
+        self.assertEqual(hint_scheduler.release_due(), 0)
+        message = async_to_sync(layer.receive)(channel)
+        self.assertEqual(message['content']['content']['hint_uid'], now.pk)
+        TeamHintLink.objects.filter(hint=later).update(time=timezone.now())
+        hint_scheduler.schedule([(self.team.pk, self.puzzle.pk, later.pk, timezone.now())])
+        self.assertEqual(hint_scheduler.release_due(), 1)
+
+
+class StaffQueueTests(StaffFixture, TransactionTestCase):
+    def test_pages(self):
+        guesses = [Guess.objects.create(guess_text="guess%d" % i, team=self.team, user=self.users[0],
+                                        puzzle=self.puzzle, guess_time=timezone.now()) for i in range(5)]
+        first = self.client.get('/staff/queue/guesses/', {'limit': 3, 'team_id': self.team.pk}).json()
+        self.assertEqual([row[3] for row in first['rows']], ["guess4", "guess3", "guess2"])
+        self.assertEqual(first['teams'], {str(self.team.pk): "team"})
+        with CaptureQueriesContext(connection) as queries:
+            last = self.client.get('/staff/queue/guesses/', {'limit': 3, 'before': first['next']}).json()
+        self.assertEqual([row[0] for row in last['rows']], [guesses[1].pk, guesses[0].pk])
+        self.assertIsNone(last['next'])
+        # no count and no offset
+        self.assertFalse(any('COUNT' in query['sql'] or 'OFFSET' in query['sql'] for query in queries))
+        self.assertContains(self.client.get('/staff/queue/'), "guess4")
+
+
+class StaffProgressTests(StaffFixture, TransactionTestCase):
+    def test_board(self):
+        Team.objects.create(team_name="another", hunt=self.hunt, join_code="BBBBB")
+        self.guess(self.users[0], "wrong")
+        self.guess(self.users[0], "first")
+        solve = PuzzleSolve.objects.get(team=self.team, puzzle=self.puzzle)
+        with CaptureQueriesContext(connection) as queries:
+            board = self.client.get('/staff/progress/%d' % self.episode.pk,
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual(board['names'], ["another", "team"])
+        self.assertEqual(board['puzzles'], [self.puzzle.pk, self.puzzle.unlocks.get().pk])
+        # another team only has the first puzzle, team solved it which unlocked the second
+        self.assertEqual(board['states'], "1031")
+        self.assertEqual(board['times'][2], int(solve.guess.guess_time.timestamp()))
+        self.assertLessEqual(len(queries), 8)
+        self.assertContains(self.client.get('/staff/progress/%d' % self.episode.pk), 'id="board"')
+
+
+class StaffOverviewTests(StaffFixture, TransactionTestCase):
+    def test_query_count(self):
+        Hint.objects.create(puzzle=self.puzzle, text="hint", time=timedelta(0), short_time=timedelta(0))
+
+        def overview():
+            cache.delete('overview:%d' % self.hunt.pk)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/staff/overview/')
+            return response, len(queries)
+
+        self.guess(self.users[0], "wrong")
+        overview()
+        response, few = overview()
+        self.assertContains(response, "1 (wrong)")
+        for i in range(10):
+            team = Team.objects.create(team_name="team%d" % i, hunt=self.hunt, join_code="B%04d" % i)
+            Guess.objects.create(guess_text="wrong", team=team, user=self.users[0], puzzle=self.puzzle,
+                                 guess_time=timezone.now())
+        # as many queries for 11 teams as for one
+        response, many = overview()
+        self.assertEqual(many, few)
+        self.assertContains(response, "1 / 1", count=11)
+        # and none while the rows are cached
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/staff/overview/')
+        self.assertLess(len(queries), few)
+
+
+class PuzzleWebsocketTests(TransactionTestCase):
+    def setUp(self):
+        now = timezone.now()
+        hunt = Hunt.objects.create(hunt_name="hunt", hunt_number=1, team_size=3, start_date=now,
+                                   end_date=now, display_start_date=now, display_end_date=now,
+                                   is_current_hunt=True)
+        episode = Episode.objects.create(ep_name="episode", ep_number=1, start_date=now, hunt=hunt)
+        self.puzzle = Puzzle.objects.create(episode=episode, puzzle_name="first", puzzle_number=1,
+                                            puzzle_id="first", answer="first", num_required_to_unlock=0)
+        Hint.objects.create(puzzle=self.puzzle, text="hint", time=timedelta(0), short_time=timedelta(0))
+        self.team = Team.objects.create(team_name="team", hunt=hunt, join_code="AAAAA")
+        self.user = User.objects.create(username="user")
+        Person.objects.create(user=self.user).teams.add(self.team)
+        Guess.objects.create(guess_text="wrong", team=self.team, user=self.user, puzzle=self.puzzle,
+                             guess_time=now)
+        self.application = URLRouter(websocket_urlpatterns)
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(self.application, "ws/puzzle/first/")
+        communicator.scope['user'] = self.user
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive(self, communicator, message_type):
+        """ The next message of the given type (the hint scheduler can send new_hint at any time) """
+        while True:
+            message = await communicator.receive_json_from()
+            if message['type'] == message_type:
+                return message
+
+    def test_replay(self):
+        async def replay():
+            communicator = await self.connect()
+            await communicator.send_json_to({'type': 'guesses-plz', 'after': 0})
+            guesses = await self.receive(communicator, 'guesses')
+            await database_sync_to_async(Guess.objects.create)(guess_text="first", team=self.team, user=self.user,
+                                                               puzzle=self.puzzle, guess_time=timezone.now())
+            live = await self.receive(communicator, 'new_guess')
+            await communicator.send_json_to({'type': 'guesses-plz', 'after': guesses['content']['cursor']})
+            later = await self.receive(communicator, 'guesses')
+            await communicator.send_json_to({'type': 'hints-plz', 'from': 'all'})
+            hint = await self.receive(communicator, 'new_hint')
+            await communicator.disconnect()
+            return guesses, live, later, hint
+
+        guesses, live, later, hint = async_to_sync(replay)()
+        self.assertTrue(live['content']['correct'])
+        self.assertEqual(guesses['type'], 'guesses')
+        self.assertFalse(guesses['content']['new'])
+        self.assertEqual([row[2:] for row in guesses['content']['guesses']], [['wrong', False, 'user']])
+        # only the guess after the cursor, with its stored correctness
+        self.assertTrue(later['content']['new'])
+        self.assertEqual([row[2:] for row in later['content']['guesses']], [['first', True, 'user']])
+        self.assertEqual((hint['type'], hint['content']['hint']), ('new_hint', 'hint'))
+
+    def test_staff_without_team(self):
+        """ Staff without a team get the replies of the puzzle, without guesses """
+        staff = User.objects.create(username="staff", is_staff=True)
+
+        async def replay():
+            communicator = WebsocketCommunicator(self.application, "ws/puzzle/first/")
+            communicator.scope['user'] = staff
+            connected, subprotocol = await communicator.connect()
+            await communicator.send_json_to({'type': 'guesses-plz', 'after': 0})
+            await communicator.send_json_to({'type': 'hints-plz', 'from': 'all'})
+            hint = await self.receive(communicator, 'new_hint')
+            await communicator.disconnect()
+            return connected, hint
+
+        connected, hint = async_to_sync(replay)()
+        self.assertTrue(connected)
+        self.assertEqual(hint['content']['hint'], 'hint')
+
+    def test_team_socket(self):
+        """ One team socket carries the puzzles the team subscribed to and the events of the team """
+        Puzzle.objects.create(episode=self.puzzle.episode, puzzle_name="second", puzzle_number=2,
+                              puzzle_id="second", answer="second", num_required_to_unlock=1)
+        TeamEpisodeLink.objects.get_or_create(team=self.team, episode=self.puzzle.episode)
+        TeamPuzzleLink.objects.get_or_create(team=self.team, puzzle=self.puzzle)
+        TeamPuzzleLink.objects.filter(team=self.team, puzzle__puzzle_id="second").delete()
+        hunt = self.puzzle.episode.hunt
+        hunt.end_date = timezone.now() + timedelta(days=1)
+        hunt.save()
+
+        async def session():
+            communicator = WebsocketCommunicator(self.application, "ws/hunt/1/team/")
+            communicator.scope['user'] = self.user
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'type': 'subscribe', 'puzzle': 'second'})
+            locked = await self.receive(communicator, 'error')
+            await communicator.send_json_to({'type': 'subscribe', 'puzzle': 'first'})
+            await communicator.send_json_to({'type': 'guesses-plz', 'after': 0, 'puzzle': 'first', 'request': 7})
+            replayed = await self.receive(communicator, 'guesses')
+            await sync_to_async(PuzzleWebsocket._send_message)(puzzle_group(self.puzzle.pk, self.team.pk),
+                                                               {'type': 'new_guess', 'content': {}})
+            event = await self.receive(communicator, 'new_guess')
+            await sync_to_async(TeamWebsocket.send_new_unlocks)(self.team.pk, ['second'])
+            unlock = await self.receive(communicator, 'new_unlocks')
+            await communicator.disconnect()
+            return locked, replayed, event, unlock
+
+        locked, replayed, event, unlock = async_to_sync(session)()
+        self.assertEqual(locked['type'], 'error')
+        self.assertEqual((replayed['puzzle'], replayed['request'], replayed['content']['guesses'][0][2]),
+                         ('first', 7, 'wrong'))
+        self.assertEqual((event['type'], event['puzzle']), ('new_guess', 'first'))
+        self.assertEqual(unlock, {'type': 'new_unlocks', 'content': {'puzzles': ['second']}})
+
+    def test_staff_queue(self):
+        """ The guesses are pushed to the staff queues subscribed to their team """
+        staff = User.objects.create(username="staff", is_staff=True)
+
+        async def queue():
+            communicator = WebsocketCommunicator(self.application, "ws/staff/queue/")
+            communicator.scope['user'] = self.user
+            refused, subprotocol = await communicator.connect()
+            communicator = WebsocketCommunicator(self.application, "ws/staff/queue/")
+            communicator.scope['user'] = staff
+            connected, subprotocol = await communicator.connect()
+            await communicator.send_json_to({'type': 'subscribe', 'team': self.team.pk, 'puzzle': None})
+            other = WebsocketCommunicator(self.application, "ws/staff/queue/")
+            other.scope['user'] = staff
+            await other.connect()
+            await other.send_json_to({'type': 'subscribe', 'team': self.team.pk, 'puzzle': self.puzzle.pk + 1})
+            await database_sync_to_async(Guess.objects.create)(guess_text="again", team=self.team, user=self.user,
+                                                               puzzle=self.puzzle, guess_time=timezone.now())
+            guess = await communicator.receive_json_from()
+            filtered = await other.receive_nothing()
+            await communicator.disconnect()
+            await other.disconnect()
+            return refused, connected, guess, filtered
+
+        refused, connected, guess, filtered = async_to_sync(queue)()
+        self.assertFalse(refused)
+        self.assertTrue(connected)
+        self.assertEqual(guess['type'], 'guess')
+        self.assertIn("again", guess['content']['row'])
+        self.assertTrue(filtered)
+
+    @patch('teams.consumers.LISTENER_REFRESH', 0.01)
+    def test_progress_board(self):
+        """ The staff boards of the episode receive the cells changed by a guess and an unlock, even
+            after their listener mark was evicted """
+        staff = User.objects.create(username="staff", is_staff=True)
+        second = Puzzle.objects.create(episode=self.puzzle.episode, puzzle_name="second", puzzle_number=2,
+                                       puzzle_id="second", answer="second", num_required_to_unlock=1)
+        TeamPuzzleLink.objects.filter(team=self.team, puzzle=second).delete()
+
+        async def board():
+            communicator = WebsocketCommunicator(self.application, "ws/staff/progress/%d/" % self.puzzle.episode_id)
+            communicator.scope['user'] = staff
+            connected, subprotocol = await communicator.connect()
+            await sync_to_async(cache.clear)()
+            await asyncio.sleep(0.1)
+            await database_sync_to_async(Guess.objects.create)(guess_text="again", team=self.team, user=self.user,
+                                                               puzzle=self.puzzle, guess_time=timezone.now())
+            guessed = await communicator.receive_json_from()
+            await database_sync_to_async(TeamPuzzleLink.objects.create)(team=self.team, puzzle=second,
+                                                                        time=timezone.now())
+            unlocked = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return connected, guessed, unlocked
+
+        connected, guessed, unlocked = async_to_sync(board)()
+        self.assertTrue(connected)
+        self.assertEqual([cell[:3] for cell in guessed['content']['cells']], [[self.team.pk, self.puzzle.pk, GUESSED]])
+        self.assertEqual([cell[:3] for cell in unlocked['content']['cells']], [[self.team.pk, second.pk, UNLOCKED]])
+
+    @unittest.skipUnless(os.environ.get('WEBSOCKET_SOAK'), "set WEBSOCKET_SOAK to a number of sockets")
+    def test_soak(self):
+        """ Holds WEBSOCKET_SOAK idle sockets and logs the memory they take """
+        count = int(os.environ['WEBSOCKET_SOAK'])
+
+        async def soak():
+            await (await self.connect()).disconnect()
+            threads = threading.active_count()
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            communicators = [await self.connect() for i in range(count)]
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            used = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+            grown = threading.active_count() - threads
+            for communicator in communicators:
+                await communicator.disconnect()
+            return used / count, grown
+
+        per_socket, threads = async_to_sync(soak)()
+        logger.info("%d sockets: %.1f kB each, %d more threads" % (count, per_socket / 1024, threads))
+        # no thread per socket, and no large buffer either
+        self.assertLess(threads, 5)
+        self.assertLess(per_socket, 64 * 1024)
+
+
+@unittest.skipIf(settings.CHANNEL_LAYERS['default']['BACKEND'].endswith('InMemoryChannelLayer'),
+                 "needs the redis channel layer")
+class ChannelLayerTests(SimpleTestCase):
+    def test_cross_process_delivery(self):
+        out = StringIO()
+        call_command('check_channel_layer', workers=3, stdout=out)
+        self.assertIn("3 workers received", out.getvalue())
@@ -35,6 +35,7 @@ from . import views
 
 puzzlepatterns = [
     path('', views.hunt.PuzzleView.as_view(), name='puzzle'),
+    path('guess/', views.hunt.puzzle_guess, name='puzzle_guess'),
     path('media/<path:file_path>', views.hunt.PuzzleFile.as_view(), name='puzzle_file'),
     path('solution/<path:file_path>', views.hunt.SolutionFile.as_view(), name='solution_file'),
 ]
@@ -55,6 +56,7 @@ urlpatterns = [
     url(r'^staff/$', views.staff.index, name='staffindex'),
     url(r'^staff/', include([
         url(r'^queue/$', views.staff.queue, name='queue'),
+        url(r'^queue/guesses/$', views.staff.queue_guesses, name='queue_guesses'),
         url(r'^progress/(?P<ep_pk>[0-9]+)$', views.staff.progress, name='progress'),
         url(r'^overview/$', views.staff.overview, name='overview'),
         url(r'^charts/$', views.stats.charts, name='charts'), # staff charts seem useless
@@ -15,12 +15,12 @@ from datetime import datetime
 from dateutil import tz
 from django.conf import settings
 from datetime import timedelta
-from ratelimit.utils import is_ratelimited
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse, Http404, HttpResponseForbidden, HttpResponseNotFound
-from django.http import HttpResponseBadRequest, JsonResponse
+from django.http import HttpResponse, Http404, HttpResponseNotFound
+from django.http import HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse
+from django.db import close_old_connections
 from django.shortcuts import get_object_or_404, render, redirect
 from django.template import RequestContext
 from django.template.loader import render_to_string
@@ -34,13 +34,22 @@ from django.db.models import F, Max, Count, Min, Subquery, OuterRef
 from django.db.models.fields import PositiveIntegerField
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.mixins import LoginRequiredMixin
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import mimetypes
 import json
+import math
 import os
 import re
 
-from hunts.models import Puzzle, Hunt, Guess, Unlockable
+from hunts.models import Hunt, Guess, Unlockable
 from teams.models import PuzzleSolve, EpisodeSolve, TeamEpisodeLink
+from teams.ingest import write_behind_enabled, enqueue_guess
+from hunts.dag import get_dag
+from teams.progress import get_progress
+from hunts.ratelimit import guess_limiter
+from hunts.guess_cache import guess_cache
+from hunts.resolver import resolve
 from .mixin import RequiredPuzzleAccessMixin, RequiredSolutionAccessMixin
 from hashlib import sha256
 
@@ -100,7 +109,7 @@ class SolutionFile(RequiredSolutionAccessMixin, View):
 
 def current_hunt(request):
     """ A simple view that calls ``teams.hunt_views.hunt`` with the current hunt's number. """
-    return redirect(reverse('hunt', kwargs={'hunt_num' : Hunt.objects.get(is_current_hunt=True).hunt_number}))
+    return redirect(reverse('hunt', kwargs={'hunt_num' : Hunt.objects.get_current().hunt_number}))
 
 
 class HuntIndex(View):
@@ -138,9 +147,10 @@ class HuntIndex(View):
               message = "You're an admin, you should delete your progress before the hunt starts<br>"
             if team.is_playtester_team:
               message = "Thanks for beta-testing the hunt, please stay focused ;)<br>"
-            ep_solved = team.ep_solved.count()
+            progress = get_progress(team)
+            ep_solved = len(progress.ep_solved)
             if len(episodes)>0 and ep_solved == len(episodes):
-              if len(episodes) == hunt.episode_set.count():
+              if len(episodes) == len(get_dag(hunt.pk).episode_next):
                 try:
                   time = team.episodesolve_set.get(episode = episodes[-1]['ep']).time
                 except:
@@ -158,7 +168,7 @@ class HuntIndex(View):
               message = message + ' <br>  -------------  <br> Use "!finish ' + str(team.token) +'" on your private team channel on discord to unlock the finisher channel'
             if len(episodes) == 0:
               unlocks = team.ep_unlocked
-              if (unlocks.count()>0):
+              if (len(progress.ep_unlocked)>0):
                   message = message + 'Welcome to the hunt! <br> The first Episode will start at ' + unlocks.first().start_date.astimezone(time_zone).strftime('%H:%M, %d/%m %Z')
                 
 
@@ -167,11 +177,6 @@ class HuntIndex(View):
 
 
 
-def get_ratelimit_key(group, request):
-    return request.ratelimit_key
-
-
-
 # simple way to encode a prepuzzle response string
 def encode(key, string):
     encoded_chars = []
@@ -188,27 +193,7 @@ class PuzzleView(RequiredPuzzleAccessMixin, View):
     render the basic per-puzzle pages.
     """
 
-    def check_rate(self,request, puzzle_id):
-        request.puzzle = get_object_or_404(Puzzle, puzzle_id__iexact=puzzle_id)
-        request.hunt = request.puzzle.episode.hunt
-        request.team = request.hunt.team_from_user(request.user)
-
-        limited = False
-        if(request.team is not None):
-            request.ratelimit_key = request.user.username
-            limited = is_ratelimited(request, fn=PuzzleView.as_view(), key='user', rate='1/7s', method='POST',
-                           increment=True)
-        #if (not limited and not request.hunt.is_public):
-        #    limited = is_ratelimited(request, fn=PuzzleView.as_view(), key=get_ratelimit_key, rate='5/m', method='POST',
-        #                   increment=True)
-
-        return limited or getattr(request, 'limited', False)
-
     def get(self, request, puzzle_id):
-        if self.check_rate(request, puzzle_id):
-            logger.info("User %s rate-limited for puzzle %s" % (str(request.user), puzzle_id))
-            return HttpResponseForbidden()
-
         puzzle_files = {f.slug: reverse(
             'puzzle_file',
             kwargs={
@@ -219,10 +204,10 @@ class PuzzleView(RequiredPuzzleAccessMixin, View):
         text = Template(request.puzzle.template).safe_substitute(**puzzle_files)
         episodes = request.hunt.get_formatted_episodes(request.user, request.team)
 
-        try:
-          puzzle_solve = PuzzleSolve.objects.get(puzzle__puzzle_id=puzzle_id, team=request.team)
+        progress = get_progress(request.team)
+        if progress is not None and request.puzzle.pk in progress.puz_solved:
           status = 'solved'
-        except PuzzleSolve.DoesNotExist:
+        else:
           status = 'unsolved'
 
 
@@ -271,52 +256,105 @@ class PuzzleView(RequiredPuzzleAccessMixin, View):
 
 
     def post(self, request, puzzle_id):
-        if self.check_rate(request, puzzle_id):
-            logger.info("User %s rate-limited for puzzle %s" % (str(request.user), puzzle_id))
-            return JsonResponse({'error': 'too fast'}, status=429)
+        return submit_guess(request, puzzle_id)
 
-        team = request.team
-        puzzle = request.puzzle
-        user = request.user
-        
-        # Dealing with answer guesss, proper procedure is to create a guess
-        # object and then rely on Guess.respond for automatic responses.
-        if(team is None or puzzle.episode.hunt.is_finished or team.hunt != puzzle.episode.hunt):
-                # If the hunt isn't public and you aren't signed in, please stop...
-                return JsonResponse({'error':'fail'})
-
-
-        given_answer = request.POST.get('answer', '')
-        if given_answer == '':
-            return JsonResponse({'error': 'no answer given'}, status=400)
-        if not given_answer.replace(" ","").isalnum():
-            return JsonResponse({'error': 'do not disable client-side sanitization...'}, status=400)
-
-        guess = Guess(
-            guess_text=given_answer,
-            team=team,
-            user=user,
-            puzzle=puzzle,
-            guess_time=timezone.now()
-        )
+
+def submit_guess(request, puzzle_id):
+    """ Answers the guess POSTed for the request's puzzle """
+    team = request.team
+    puzzle = request.puzzle
+    user = request.user
+    
+    # Dealing with answer guesss, proper procedure is to create a guess
+    # object and then rely on Guess.respond for automatic responses.
+    if(team is None or puzzle.episode.hunt.is_finished or team.hunt != puzzle.episode.hunt):
+        # If the hunt isn't public and you aren't signed in, please stop...
+        return JsonResponse({'error':'fail'})
+
+
+    given_answer = request.POST.get('answer', '')
+    if given_answer == '':
+        return JsonResponse({'error': 'no answer given'}, status=400)
+    if not given_answer.replace(" ","").isalnum():
+        return JsonResponse({'error': 'do not disable client-side sanitization...'}, status=400)
+
+    # A guess the team already submitted gets the same verdict again, without any DB work
+    cache_key, response = guess_cache.lookup(request.hunt, team, puzzle, given_answer)
+    now = timezone.now()
+    if response is not None:
+        response.update(guess=given_answer, by=request.user.username, timeout_length=0, timeout_end=str(now))
+        return JsonResponse(response)
+
+    allowed, wait = guess_limiter.hit(request.hunt, team, puzzle, user)
+    timeout = {'timeout_length': wait * 1000, 'timeout_end': str(now + timedelta(seconds=wait))}
+    if not allowed:
+        logger.info("User %s rate-limited for puzzle %s" % (str(request.user), puzzle_id))
+        response = JsonResponse(dict(error='too fast', **timeout), status=429)
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
+
+    guess = Guess(
+        guess_text=given_answer,
+        team=team,
+        user=user,
+        puzzle=puzzle,
+        guess_time=timezone.now()
+    )
+    matcher = puzzle.matcher
+    if (write_behind_enabled() and not matcher.is_correct(given_answer) and
+            matcher.match_eureka(given_answer) is None):
+        # Plain wrong answers change nothing: answer right away and insert them later in batches
+        enqueue_guess(guess)
+        response = {"status": "wrong", "message": "Wrong Answer"}
+    else:
         guess.save()
         response = guess.respond()
-        if not guess.is_correct:
-            now = timezone.now()
-            minimum_time = timedelta(seconds=5)
-
-            response['guess'] = given_answer
-            response['timeout_length'] = minimum_time.total_seconds() * 1000
-            response['timeout_end'] = str(now + minimum_time)
-        response['by'] = request.user.username
-        
-        return JsonResponse(response)
+    guess_cache.store(cache_key, response)
+    if response['status'] != 'correct':
+        response['guess'] = given_answer
+        response.update(timeout)
+    response['by'] = request.user.username
+    
+    return JsonResponse(response)
+
+
+# The blocking part of the guesses received by puzzle_guess runs on this pool: a guess waiting for a
+# worker costs a coroutine instead of a thread. Each worker keeps its own DB connection.
+_guess_executor = ThreadPoolExecutor(max_workers=settings.GUESS_WORKERS, thread_name_prefix='guess')
+
+
+def _guess_job(request, puzzle_id):
+    close_old_connections()
+    try:
+        # not resolved by the middlewares for async views
+        request.puzzle, request.hunt, request.team = resolve(request.user, puzzle_id)
+        if request.puzzle is None:
+            raise Http404('Puzzle not found')
+        # same access rule as RequiredPuzzleAccessMixin, the other cases are handled by submit_guess
+        if (not request.hunt.is_public and not request.user.is_staff and request.team is not None and
+                not get_progress(request.team).puzzle_visible(request.puzzle, request.team.is_playtester_team)):
+            raise Http404('Puzzle not accessible')
+        return submit_guess(request, puzzle_id)
+    finally:
+        close_old_connections()
+
+
+async def puzzle_guess(request, puzzle_id):
+    """ Async counterpart of PuzzleView.post, used by the puzzle page to submit guesses """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_guess_executor, _guess_job, request, puzzle_id)
+
+
+# csrf_exempt cannot wrap a coroutine function in this version of django
+puzzle_guess.csrf_exempt = True
 
 
 @login_required
 def unlockables(request):
     """ A view to render the unlockables page for hunt participants. """
-    team = Hunt.objects.get(is_current_hunt=True).team_from_user(request.user)
+    team = Hunt.objects.get_current().team_from_user(request.user)
     if(team is None):
         return render(request, 'access_error.html', {'reason': "team"})
     unlockables = Unlockable.objects.filter(puzzle__in=team.puz_solved.all())
@@ -329,7 +367,10 @@ def int_to_rank(n):
 #TODO: clean time format + clear useless info out of all_teams before sending
 @login_required
 def leaderboard(request):
-    curr_hunt = get_object_or_404(Hunt, is_current_hunt=True)
+    try:
+      curr_hunt = Hunt.objects.get_current()
+    except Hunt.DoesNotExist:
+      raise Http404('No current hunt')
     teams = curr_hunt.team_set.all()
     all_teams = teams.annotate(solves=Count('puz_solved')).filter(solves__gt=0)
     all_teams = all_teams.annotate(last_time=Max('puzzlesolve__guess__guess_time'))
@@ -341,7 +382,7 @@ def leaderboard(request):
     else:
       all_teams = all_teams[:10]
 
-    team = Hunt.objects.get(is_current_hunt=True).team_from_user(request.user)
+    team = curr_hunt.team_from_user(request.user)
     if(team is None):
       solves_data = []
     else:
@@ -355,7 +396,7 @@ def leaderboard(request):
           rank = int_to_rank(PuzzleSolve.objects.filter(puzzle= unlock.puzzle, guess__guess_time__lt= solve.time).count()+1)
           solves_data.append({'name' : unlock.name, 'sol_time': solve.time, 'duration':  format_duration(solve.duration), 'rank': rank})
         except ObjectDoesNotExist:
-          start = unlock.puzzle.starting_time_for_team(unlock.team)
+          start = unlock.effective_start or unlock.puzzle.episode.start_date
           if (timezone.now() > start):
             solves_data.append({'name' : unlock.name, 'sol_time': '' , 'duration':  format_duration(timezone.now()-start)})
 
@@ -16,6 +16,7 @@ from django.conf import settings
 from django.urls import reverse_lazy
 from django.http import JsonResponse, Http404
 from hunts.models import APIToken
+from teams.progress import get_progress
 
 class RequiredPuzzleAccessMixin():
     def dispatch(self, request, *args, **kwargs):
@@ -29,8 +30,7 @@ class RequiredPuzzleAccessMixin():
             elif (not request.user.is_staff):
                 if request.team is None:
                     return redirect(reverse('registration'))
-                elif request.puzzle.episode not in request.hunt.get_episodes(request.user,request.team) \
-                        or request.puzzle not in request.team.puz_unlocked.all():
+                elif not get_progress(request.team).puzzle_visible(request.puzzle, request.team.is_playtester_team):
                    # return redirect(reverse('hunt', kwargs={'hunt_num' : request.hunt.hunt_number }))
                     # do not reveal if a puzzle exists
                     raise Http404('Puzzle not accessible')
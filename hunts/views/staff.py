@@ -16,8 +16,7 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import admin
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.mail import EmailMessage
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.http import HttpResponse, HttpResponseNotFound, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseNotFound, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.template.loader import render_to_string
 from django.utils import timezone
@@ -27,11 +26,15 @@ from django.db.models.fields import PositiveIntegerField
 from django.db.models.functions import Lower
 from huey.contrib.djhuey import result
 import json
-from copy import deepcopy
 # from silk.profiling.profiler import silk_profile
 
 from hunts.models import Guess, Hunt, Puzzle, Episode
-from teams.models import Team, TeamPuzzleLink, PuzzleSolve, Person
+from hunts.dag import get_dag
+from hunts.guess_cache import guess_cache
+from hunts.overview import cached_overview_rows
+from teams.board import episode_board
+from teams.models import Team, TeamPuzzleLink, Person
+from teams.ingest import drain, load_related, pending_guesses
 from teams.forms import GuessForm, UnlockForm, EmailForm, LookupForm
 
 DT_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
@@ -39,11 +42,62 @@ DT_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
 
 @staff_member_required
 def index(request):
-    context = {'hunt': Hunt.objects.get(is_current_hunt=True)}
+    curr_hunt = Hunt.objects.get_current()
+    context = {'hunt': curr_hunt, 'guess_cache': guess_cache.stats(curr_hunt)}
     return render(request, 'staff/index.html', context)
 
 
 
+QUEUE_PAGE_SIZE = 30
+
+
+def _queue_page(hunt, team_id=None, puzzle_id=None, before=None, limit=QUEUE_PAGE_SIZE):
+    """ The newest guesses of the hunt (or of a team and/or a puzzle) with an id below before, and
+        whether there are older ones. Keyset pagination on the guess id, so that a deep page is an
+        index range scan instead of a COUNT and an OFFSET over the whole hunt. """
+    dummies = set(Team.objects.filter(hunt=hunt, location="DUMMY").values_list('pk', flat=True))
+    guesses = Guess.objects.filter(puzzle__in=Puzzle.objects.filter(episode__hunt=hunt).values('pk'))
+    guesses = guesses.exclude(team__in=dummies)
+    if team_id is not None:
+        guesses = guesses.filter(team_id=team_id)
+    if puzzle_id is not None:
+        guesses = guesses.filter(puzzle_id=puzzle_id)
+    if before is not None:
+        guesses = guesses.filter(pk__lt=before)
+    guesses = list(guesses.select_related('team', 'puzzle').order_by('-pk')[:limit + 1])
+    # the newest guesses may still be queued by the write-behind ingestion
+    saved = {g.pk for g in guesses}
+    pending = pending_guesses(hunt.pk, team_id, puzzle_id, before=before, limit=limit + 1)
+    guesses += load_related([g for g in pending if g.pk not in saved and g.team_id not in dummies])
+    guesses.sort(key=lambda g: g.pk, reverse=True)
+    return guesses[:limit], len(guesses) > limit
+
+
+@staff_member_required
+def queue_guesses(request):
+    """
+    A page of the queue as JSON, for the pages older than the first one: the guesses with an id
+    below "before" as rows of [id, team, puzzle, guess, time, correct, response], with the names of
+    their teams and puzzles, and the id to ask for the next page (or null).
+    """
+    try:
+        team_id = int(request.GET["team_id"]) if request.GET.get("team_id") else None
+        puzzle_id = int(request.GET["puzzle_id"]) if request.GET.get("puzzle_id") else None
+        before = int(request.GET["before"]) if request.GET.get("before") else None
+        limit = max(1, min(int(request.GET.get("limit", QUEUE_PAGE_SIZE)), 200))
+    except ValueError:
+        return JsonResponse({'error': 'invalid parameter'}, status=400)
+    hunt = Hunt.objects.get_current()
+    guesses, more = _queue_page(hunt, team_id, puzzle_id, before, limit)
+    return JsonResponse({
+        'rows': [[g.pk, g.team_id, g.puzzle_id, g.guess_text, g.guess_time.isoformat(), g.correct,
+                  g.response_text] for g in guesses],
+        'teams': {g.team_id: g.team.team_name for g in guesses},
+        'puzzles': {g.puzzle_id: g.puzzle.puzzle_name for g in guesses},
+        'next': guesses[-1].pk if more else None,
+    })
+
+
 @staff_member_required
 def queue(request):
     """
@@ -56,52 +110,49 @@ def queue(request):
         if not form.is_valid():
             return HttpResponse(status=400)
         response = form.cleaned_data['response']
-        s = Guess.objects.get(pk=form.cleaned_data['sub_id'])
+        if not Guess.objects.filter(pk=form.cleaned_data['sub_id']).exists():
+            # the guess may still be queued by the write-behind ingestion
+            drain()
+        s = get_object_or_404(Guess, pk=form.cleaned_data['sub_id'])
         s.update_response(response)
         guesss = [s]
 
     elif request.is_ajax():
         last_date = datetime.strptime(request.GET.get("last_date"), DT_FORMAT)
         last_date = last_date.replace(tzinfo=tz.gettz('UTC'))
-        guesss = Guess.objects.filter(modified_date__gt=last_date)
-        guesss = guesss.exclude(team__location="DUMMY")
+        hunt = Hunt.objects.get_current()
+        guesss = Guess.objects.filter(modified_date__gt=last_date, puzzle__episode__hunt=hunt)
+        guesss = guesss.exclude(team__location="DUMMY").select_related('team', 'puzzle')
         team_id = request.GET.get("team_id")
         puzzle_id = request.GET.get("puzzle_id")
         if(team_id and team_id != "None"):
             guesss = guesss.filter(team__pk=team_id)
         if(puzzle_id and puzzle_id != "None"):
             guesss = guesss.filter(puzzle__pk=puzzle_id)
+        # the polling fallback shows at most a page of the guesses still queued
+        pending = pending_guesses(hunt.pk, team_id=int(team_id) if team_id and team_id != "None" else None,
+                                  puzzle_id=int(puzzle_id) if puzzle_id and puzzle_id != "None" else None,
+                                  limit=QUEUE_PAGE_SIZE)
+        pending = load_related([g for g in pending if g.modified_date > last_date])
+        guesss = list(guesss) + [g for g in pending if g.team.location != "DUMMY"]
 
     else:
-        page_num = request.GET.get("page_num")
         team_id = request.GET.get("team_id")
         puzzle_id = request.GET.get("puzzle_id")
-        hunt = Hunt.objects.get(is_current_hunt=True)
-        guesss = Guess.objects.filter(puzzle__episode__hunt=hunt).exclude(team__location="DUMMY")
-        arg_string = ""
-        if(team_id):
-            team_id = int(team_id)
-            guesss = guesss.filter(team__pk=team_id)
-            arg_string = arg_string + ("&team_id=%s" % team_id)
-        if(puzzle_id):
-            puzzle_id = int(puzzle_id)
-            guesss = guesss.filter(puzzle__pk=puzzle_id)
-            arg_string = arg_string + ("&puzzle_id=%s" % puzzle_id)
-        guesss = guesss.select_related('team', 'puzzle').order_by('-pk')
-        pages = Paginator(guesss, 30)
-        try:
-            guesss = pages.page(page_num)
-        except PageNotAnInteger:
-            guesss = pages.page(1)
-        except EmptyPage:
-            guesss = pages.page(pages.num_pages)
+        hunt = Hunt.objects.get_current()
+        team_id = int(team_id) if team_id else None
+        puzzle_id = int(puzzle_id) if puzzle_id else None
+        guesss, more = _queue_page(hunt, team_id, puzzle_id)
+        next_before = guesss[-1].pk if more else None
         puzzle_list = [puzzle for episode in hunt.episode_set.all() for puzzle in episode.puzzle_set.all()]
 
     form = GuessForm()
+    dates = [g.modified_date for g in pending_guesses(limit=1)]
     try:
-        last_date = Guess.objects.latest('modified_date').modified_date.strftime(DT_FORMAT)
+        dates.append(Guess.objects.latest('modified_date').modified_date)
     except Guess.DoesNotExist:
-        last_date = timezone.now().strftime(DT_FORMAT)
+        dates.append(timezone.now())
+    last_date = max(dates).strftime(DT_FORMAT)
     guess_list = [render_to_string('staff/queue_row.html', {'guess': guess},
                                         request=request)
                        for guess in guesss]
@@ -111,7 +162,7 @@ def queue(request):
         context = {'guess_list': guess_list, 'last_date': last_date}
         return HttpResponse(json.dumps(context))
     else:
-        context = {'form': form, 'page_info': guesss, 'arg_string': arg_string,
+        context = {'form': form, 'next_before': next_before,
                    'guess_list': guess_list, 'last_date': last_date, 'hunt': hunt,
                    'puzzle_id': puzzle_id, 'team_id': team_id, 'puzzle_list': puzzle_list}
         return render(request, 'staff/queue.html', context)
@@ -120,9 +171,9 @@ def queue(request):
 @staff_member_required
 def progress(request, ep_pk):
     """
-    A view to handle puzzle unlocks via POST, handle unlock/solve update requests via AJAX,
-    and render the progress page. Rendering the progress page is extremely data intensive and so
-    the view involves a good amount of pre-fetching.
+    A view to handle puzzle unlocks via POST and render the progress page, which then receives the
+    changed cells through a websocket. The board is sent as columns (see teams.board) and the grid
+    is built by the page; AJAX requests get the board alone.
     """
     
     episode = get_object_or_404(Episode, pk=ep_pk)
@@ -149,193 +200,30 @@ def progress(request, ep_pk):
                 return HttpResponse(json.dumps(response))
         return HttpResponse(status=400)
 
-    elif request.is_ajax():
-        update_info = []
-        if not ("last_solve_pk" in request.GET and
-                "last_unlock_pk" in request.GET and
-                "last_guess_pk" in request.GET):
-            return HttpResponse(status=404)
-        results = []
-
-        last_solve_pk = request.GET.get("last_solve_pk")
-        solves = PuzzleSolve.objects.filter(pk__gt=last_solve_pk, episode=episode)
-        for solve in solves:
-            results.append(solve.serialize_for_ajax())
-
-        last_unlock_pk = request.GET.get("last_unlock_pk")
-        unlocks = TeamPuzzleLink.objects.filter(pk__gt=last_unlock_pk)
-        for unlock in unlocks:
-            results.append(unlock.serialize_for_ajax())
-
-        last_guess_pk = request.GET.get("last_guess_pk")
-        guesss = Guess.objects.filter(pk__gt=last_guess_pk)
-        for guess in guesss:
-            if(not guess.team.puz_solved.filter(pk=guess.puzzle.pk).exists()):
-                results.append(guess.serialize_for_ajax())
-
-        if(len(results) > 0):
-            try:
-                last_solve_pk = PuzzleSolve.objects.latest('id').id
-            except PuzzleSolve.DoesNotExist:
-                last_solve_pk = 0
-            try:
-                last_unlock_pk = TeamPuzzleLink.objects.latest('id').id
-            except TeamPuzzleLink.DoesNotExist:
-                last_unlock_pk = 0
-            try:
-                last_guess_pk = Guess.objects.latest('id').id
-            except Guess.DoesNotExist:
-                last_guess_pk = 0
-            update_info = [last_solve_pk, last_unlock_pk, last_guess_pk]
-        response = json.dumps({'messages': results, 'update_info': update_info})
-        return HttpResponse(response)
-
     else:
-        curr_hunt = Hunt.objects.get(is_current_hunt=True)
-        teams = curr_hunt.team_set.all().order_by('team_name')
-#        puzzles = curr_hunt.puzzle_set.all().order_by('puzzle_number')
-        
-        
-        puzzles = [p for p in episode.puzzle_set.order_by('puzzle_number')]
-#        puzzles = [p  for episode in curr_hunt.episode_set.order_by('ep_number').all() for p in episode.puzzle_set.order_by('puzzle_number')]
-        # An array of solves, organized by team then by puzzle
-        # This array is essentially the grid on the progress page
-        # The structure is messy, it was built part by part as features were added
-
-        sol_dict = {}
-        puzzle_dict = {}
-        for puzzle in puzzles:
-            puzzle_dict[puzzle.pk] = ['locked', puzzle.puzzle_id]
-        for team in teams:
-            sol_dict[team.pk] = deepcopy(puzzle_dict)
-
-        data = TeamPuzzleLink.objects.filter(puzzle__episode=episode)
-        data = data.values_list('team', 'puzzle').annotate(Max('time'))
-
-        for point in data:
-            sol_dict[point[0]][point[1]] = ['unlocked', point[2]]
-
-        data = Guess.objects.filter(puzzle__episode=episode)
-        data = data.values_list('team', 'puzzle').annotate(Max('guess_time'))
-        data = data.annotate(Count('puzzlesolve'))
-
-        for point in data:
-            if(point[3] == 0):
-                sol_dict[point[0]][point[1]].append(point[2])
-            else:
-                sol_dict[point[0]][point[1]] = ['solved', point[2]]
-        sol_list = []
-        for team in teams:
-            puzzle_list = [[puzzle.puzzle_id] + sol_dict[team.pk][puzzle.pk] for puzzle in puzzles]
-            sol_list.append({'team': {'name': team.team_name, 'pk': team.pk},
-                             'puzzles': puzzle_list})
-
-        try:
-            last_solve_pk = PuzzleSolve.objects.latest('id').id
-        except PuzzleSolve.DoesNotExist:
-            last_solve_pk = 0
-        try:
-            last_unlock_pk = TeamPuzzleLink.objects.latest('id').id
-        except TeamPuzzleLink.DoesNotExist:
-            last_unlock_pk = 0
-        try:
-            last_guess_pk = Guess.objects.latest('id').id
-        except Guess.DoesNotExist:
-            last_guess_pk = 0
-        context = {'puzzle_list': puzzles, 'team_list': teams, 'sol_list': sol_list,
-                   'last_unlock_pk': last_unlock_pk, 'last_solve_pk': last_solve_pk,
-                   'last_guess_pk': last_guess_pk, 'hunt': curr_hunt}
+        curr_hunt = Hunt.objects.get_current()
+        teams = list(curr_hunt.team_set.order_by('team_name').values_list('pk', 'team_name'))
+        # The grid is rendered by the page from the columns of the board
+        board = episode_board(episode, [pk for pk, name in teams])
+        board['names'] = [name for pk, name in teams]
+        if request.is_ajax():
+            return JsonResponse(board)
+
+        puzzles = episode.puzzle_set.order_by('puzzle_number')
+        context = {'puzzle_list': puzzles, 'board': board, 'episode': episode, 'hunt': curr_hunt}
         return render(request, 'staff/progress.html', context)
 
 
 
 
-# background color of overview row
-def getColor(minutes, minutes_lastguess, team_hints, total_hints): 
-    if minutes_lastguess > 60 or (minutes_lastguess < 0 and minutes >30):
-      return "rgb(213,213,213)"
-    if minutes < 0:
-      return "rgb(192,163,255)"
-    minutes += team_hints * 60. / total_hints
-    if (minutes < 60):
-      return "rgb(" + str(int(168*(1-minutes/60.)+255*minutes/60.))  + ",255,163)"
-    elif (minutes < 120):
-      minutes -= 60
-      return "rgb(255," + str(int(255*(1-minutes/60.)+163*minutes/60.))  + ",163)"
-    else:
-      return "rgb(255,163,163)"
-
 @staff_member_required
 def overview(request):
     """
     A view to show the current state of each team on their last unlocked puzzle (if it is not solved)
     """
     # not relevant if puzzles unlocked before are unsolved
-
-    # TODO no idea about the performance of this code, in terms of prefecthing database accesses
-    curr_hunt = Hunt.objects.get(is_current_hunt=True)
-    teams = curr_hunt.team_set.all().order_by('team_name')
-
-    sol_list = []
-    for team in teams:
-      puz_solved = team.puz_solved
-      nb_solve = puz_solved.count()
-      puzzle_unlock = team.teampuzzlelink_set.order_by('time').last()
-      if (puzzle_unlock == None or (puzzle_unlock.puzzle in puz_solved.all())):
-        sol_list.append({'team': team.team_name,
-                       'puzzle': {'name': 'None found' if puzzle_unlock==None else 'Hunt Finished!', 'time': '-', 'index': nb_solve if puzzle_unlock==None else 0, 'color': "rgb(163,163,163)"},
-                       'guesses': {'nb' : '-' , 'last': '...', 'time': '-' },
-                       'eurekas': {'nb' : 0 , 'last': '...', 'time': '-', 'total': 1},
-                       'hints': {'nb' : 0 , 'last_time': '-', 'next_time': '-', 'total': 1},
-                       'admin_eurekas' : []
-                       })
-        continue
-      puzzle = puzzle_unlock.puzzle
-      puzzle_name = puzzle.puzzle_name
-      time_stuck = max(-1,int((timezone.now() - puzzle.starting_time_for_team(team)).total_seconds()/60))
-      guesses = Guess.objects.filter(puzzle=puzzle, team=team).order_by('guess_time')
-      nb_guess = guesses.count()
-      lastguess = guesses.last()
-      text_lastguess = '' if lastguess == None else lastguess.guess_text
-      time_lastguess = -1 if lastguess == None else int((timezone.now() - lastguess.guess_time).total_seconds()/60)
-      team_eurekas = team.eurekas.filter(puzzle=puzzle, admin_only=False).annotate(time=F('teameurekalink__time')).order_by('time')
-      lasteureka = team_eurekas.last()
-      time_lasteureka = -1 if lasteureka == None else int((timezone.now() - lasteureka.time).total_seconds()/60)
-      text_lasteureka = '' if lasteureka== None else lasteureka.answer
-      total_eureka = puzzle.eureka_set.filter(admin_only=False).count()
-
-      admin_eurekas = team.eurekas.filter(puzzle=puzzle, admin_only=True).annotate(time=F('teameurekalink__time')).order_by('time')
-      list_admin_eurekas = []
-      for eureka in admin_eurekas.all():
-        list_admin_eurekas.append({'txt': eureka.answer, 'time': int((timezone.now() - eureka.time).total_seconds()/60)})
-
-      hints = puzzle.hint_set
-      total_hints = hints.count()
-      team_hints = 0
-      last_hint_time = 360
-      next_hint_time = 360 # default max time: 6h
-      for hint in hints.all():
-          delay = hint.delay_for_team(team) - (timezone.now() - hint.starting_time_for_team(team))
-          delay = delay.total_seconds()
-          if delay < 0:
-            team_hints += 1
-            last_hint_time = int(min(last_hint_time, -delay/60))
-          else:
-            next_hint_time = int(min(next_hint_time, delay/60))
-      if last_hint_time == 360:
-        last_hint_time = -1
-      if next_hint_time == 360:
-        next_hint_time = -1
-        
-      color = getColor(time_stuck, time_lastguess, team_hints, total_hints)
-
-      sol_list.append({'team': team.team_name,
-                       'puzzle': {'name': puzzle_name, 'time': time_stuck, 'index': nb_solve+1, 'color': color},
-                       'guesses': {'nb' : nb_guess , 'last': text_lastguess, 'time': time_lastguess },
-                       'eurekas': {'nb' : team_eurekas.count() , 'last': text_lasteureka, 'time': time_lasteureka, 'total': total_eureka},
-                       'hints': {'nb' : team_hints , 'last_time': last_hint_time, 'next_time': next_hint_time, 'total': total_hints},
-                       'admin_eurekas' : list_admin_eurekas,
-                       })
+    curr_hunt = Hunt.objects.get_current()
+    sol_list = cached_overview_rows(curr_hunt)
 
     context = {'data': sol_list, 'hunt':curr_hunt}
     return render(request, 'staff/overview.html', context)
@@ -369,7 +257,7 @@ def hunt_management(request):
 def hunt_info(request):
     """ A view to render the hunt info page, which contains room and allergy information """
 
-    curr_hunt = Hunt.objects.get(is_current_hunt=True)
+    curr_hunt = Hunt.objects.get_current()
     if request.method == 'POST':
         if "json_data" in request.POST:
             team_data = json.loads(request.POST.get("json_data"))
@@ -414,7 +302,7 @@ def control(request):
     This view is not responsible for rendering any normal pages.
     """
 
-    curr_hunt = Hunt.objects.get(is_current_hunt=True)
+    curr_hunt = Hunt.objects.get_current()
     if(request.method == 'GET' and "action" in request.GET):
         if(request.GET['action'] == "check_task"):
             task_result = result(request.GET['task_id'])
@@ -460,7 +348,7 @@ def lookup(request):
     """
     person = None
     team = None
-    hunt = Hunt.objects.get(is_current_hunt=True)
+    hunt = Hunt.objects.get_current()
     if request.method == 'POST':
         lookup_form = LookupForm(request.POST)
         if lookup_form.is_valid():
@@ -493,9 +381,20 @@ def lookup(request):
 def puzzle_dag(request):
     """ A view to render the DAG of puzzles unlocking relations """
 
-    puzzles = Puzzle.objects.all()
-    episodes = Episode.objects.all()
     hunts = Hunt.objects.all()
+    episodes = Episode.objects.select_related('hunt').all()
+    puzzles = Puzzle.objects.all()
 
-    context = {'puzzles': puzzles, 'episodes':episodes, 'hunts': hunts, 'hunt': Hunt.objects.get(is_current_hunt=True)}
+    # unlocking relations come from the DAG snapshots rather than the M2M table
+    dags = {hunt.pk: get_dag(hunt.pk) for hunt in hunts}
+    episode_hunt = {ep.pk: ep.hunt_id for ep in episodes}
+    edges = []
+    for puz in puzzles:
+        dag = dags[episode_hunt[puz.episode_id]]
+        # a puzzle added since the snapshot was built has no relations yet
+        puz.num_parents = len(dag.parents.get(puz.pk, ()))
+        edges.extend((puz.pk, child) for child in dag.children.get(puz.pk, ()))
+
+    context = {'puzzles': puzzles, 'episodes':episodes, 'hunts': hunts, 'edges': edges,
+               'hunt': Hunt.objects.get_current()}
     return render(request, 'staff/puzzle_dag.html', context)
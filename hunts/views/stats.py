@@ -35,11 +35,12 @@ from copy import deepcopy
 from collections import Counter
 # from silk.profiling.profiler import silk_profile
 
-import re
 import math
 import os.path
 from hunts.models import Guess, Hunt, Puzzle
+from hunts.dag import get_dag
 from teams.models import Team, TeamPuzzleLink, PuzzleSolve, Person
+from teams.hints import with_hint_counts
 from teams.forms import GuessForm, UnlockForm, EmailForm, LookupForm
 
 DT_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
@@ -53,9 +54,9 @@ def add_apps_to_context(context, request):
 
 def get_last_hunt_or_none(request):
     if (request.user.is_staff):
-        hunt = Hunt.objects.filter(is_current_hunt=True)
-        nb_puzzle = len([0 for episode in hunt.first().episode_set.all() for puzzle in episode.puzzle_set.all()])
-        return hunt.annotate(puz=Value(nb_puzzle, output_field=PositiveIntegerField())).first()
+        hunt = Hunt.objects.get_current()
+        hunt.puz = len(get_dag(hunt.pk).episode_of)
+        return hunt
 
     last_hunts = Hunt.objects.filter(end_date__lt=timezone.now()).order_by('-end_date')
     if last_hunts.count() == 0:
@@ -134,10 +135,7 @@ def teams(request):
       
       team_data = []   
       for team in teams.all():
-        hints = 0
-        for solve in team.puzzlesolve_set.all():
-            duration = solve.duration
-            hints += sum([hint.delay_for_team(team) < duration for hint in solve.puzzle.hint_set.all()])
+        hints = sum(solve.hints for solve in with_hint_counts(team.puzzlesolve_set.all()))
         guesses = Guess.objects.filter(puzzle__episode__hunt=hunt, team__team_name=team.team_name).count()
         team_data.append({'team_name': team.team_name, 'solves': team.solves, 'last_time':team.last_time, 'guesses':guesses, 'hints':hints, 'pk':team.pk, 'size': team.size})
 
@@ -186,7 +184,7 @@ def team(request):
         context['hunt'].update({'display_start_date': parse_datetime(context['hunt']['display_start_date'])})
         
     else:
-      solves = team.puzzlesolve_set.annotate(time=F('guess__guess_time'), puzId = F('puzzle__puzzle_id')).order_by('time')
+      solves = with_hint_counts(team.puzzlesolve_set.annotate(time=F('guess__guess_time'), puzId = F('puzzle__puzzle_id')).order_by('time'))
       unlocks = team.teampuzzlelink_set.annotate(puzId = F('puzzle__puzzle_id'), name = F('puzzle__puzzle_name')).order_by('time')
 
       solves_data = []
@@ -204,7 +202,7 @@ def team(request):
           rank = int_to_rank(PuzzleSolve.objects.filter(puzzle= unlock.puzzle, guess__guess_time__lt= solvetime).count()+1)
      #     wrap = ExpressionWrapper(F('guess__guess_time')-F('unlock_time'), output_field=fields.DurationField())
           rankduration = int_to_rank(PuzzleSolve.objects.filter(puzzle = unlock.puzzle, duration__lt=duration).count()+1)
-          hints = sum([hint.delay_for_team(team) < duration for hint in unlock.puzzle.hint_set.all()])
+          hints = solve.hints
           duration = format_duration(duration)
         except ObjectDoesNotExist:
           pass
@@ -255,7 +253,7 @@ def puzzles(request):
         dic['min_dur'] = format_duration(dic['min_dur'])
         dic['success'] = solves.count()
         dic['name'] = puz.puzzle_name
-        hints = [sum([hint.delay_for_team(sol.team) < sol.duration for hint in puz.hint_set.all()]) for sol in solves]
+        hints = [sol.hints for sol in with_hint_counts(solves)]
         dic['min_hints'] = 0 if len(hints)==0 else min(hints)
         dic['av_hints'] =  0 if len(hints)==0 else round(sum(hints)/len(hints), 2)
         if (unlocks.count() == 0):
@@ -310,7 +308,7 @@ def puzzle(request):
 
     else:
     
-      solves = PuzzleSolve.objects.filter(puzzle=puz)
+      solves = with_hint_counts(PuzzleSolve.objects.filter(puzzle=puz))
 
       data = []
 
@@ -318,7 +316,7 @@ def puzzle(request):
         duration = sol.duration
         sol_time = sol.guess.guess_time
         guesses = sol.team.guess_set.filter(puzzle=puz, guess_time__lte=sol_time).count()
-        hints = sum([hint.delay_for_team(sol.team) < sol.duration for hint in puz.hint_set.all()])
+        hints = sol.hints
         eurekas = [ {'txt' : eur.eureka.answer , 'time': format_duration(eur.time - sol_time + duration) } for eur in sol.team.teameurekalink_set.filter(eureka__puzzle=puz,time__lt=sol_time).all()]
         data.append({'duration':format_duration(duration), 'sol_time': sol_time, 'guesses':guesses, 'hints': hints, 'eurekas':eurekas, 'team':sol.team.team_name, 'team_pk':sol.team.pk})
         
@@ -329,20 +327,12 @@ def puzzle(request):
       guesses = Counter(elem[0] for elem in guesses).most_common(30) # want 10 most common uncorrect answers, take some margin to remove eureka and answers
       
       common_guess = []
+      matcher = puz.matcher
       
       for g,c in guesses:
         if c < 2:
           break
-        if (g == puz.answer.lower().replace(" ","") or
-                 (puz.answer_regex!="" and re.fullmatch(puz.answer_regex, g, re.IGNORECASE))):
-          continue
-          
-        eur = False
-        for resp in puz.eureka_set.all():
-          if(re.fullmatch(resp.regex.replace(" ",""), g, re.IGNORECASE)):
-            eur = True
-            break
-        if eur:
+        if matcher.is_correct(g) or matcher.match_eureka(g) is not None:
           continue
         
         common_guess.append({'txt': g, 'teams': c})
@@ -398,11 +388,12 @@ def charts(request):
       for ep in hunt.episode_set.order_by('ep_number').all():
         minTime = timezone.now()
         solve_ep = []
+        starts = TeamPuzzleLink.objects.starting_times([team.pk for team in teams], ep.puzzle_set.all())
         for team in teams:
           solves = team.puzzlesolve_set.filter(puzzle__episode=ep)
           solves = solves.order_by('guess__guess_time')
           if len(solves)>0:
-            start_time = solves[0].puzzle.starting_time_for_team(team)
+            start_time = starts.get((team.pk, solves[0].puzzle_id)) or ep.start_date
           solves = solves.values_list('guess__guess_time', flat=True)
           if len(solves)>0:
             minTime = min(minTime, start_time)
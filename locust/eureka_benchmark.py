@@ -0,0 +1,63 @@
+# Compares the single pass eureka matcher of hunts/matching.py against the former
+# "one re.fullmatch per eureka" loop of Guess.respond, for puzzles with 1, 10 and 100 eurekas.
+#
+# Usage (from the repository root): python locust/eureka_benchmark.py
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hunts.matching import EurekaEntry, PuzzleMatcher
+
+SIZES = [1, 10, 100]
+NUMBER = 20000
+
+
+def make_eurekas(n):
+    """ A mix of plain answers and real regexes, like the eurekas of an actual hunt """
+    eurekas = []
+    for i in range(n):
+        if i % 2:
+            regex = "partial answer %d" % i
+        else:
+            regex = "(THE)?STEP%d(S|ED)?" % i
+        eurekas.append((EurekaEntry(i, regex, "", False), regex))
+    return eurekas
+
+
+def sample_guess(i):
+    """ A guess matching the i-th eureka of make_eurekas """
+    return "partial answer %d" % i if i % 2 else "the step %d" % i
+
+
+def loop_match(eurekas, text):
+    """ The matching loop of Guess.respond before the matcher cache """
+    noSpace = text.upper().replace(" ", "")
+    for entry, regex in eurekas:
+        if(not re.fullmatch(regex.replace(" ", ""), noSpace, re.IGNORECASE) is None):
+            return entry
+    return None
+
+
+def main():
+    print("%9s %-12s %12s %12s %8s" % ("eurekas", "guess", "loop (us)", "matcher (us)", "speedup"))
+    for n in SIZES:
+        eurekas = make_eurekas(n)
+        matcher = PuzzleMatcher("ANSWER", "", eurekas)
+        guesses = [("wrong", "definitely wrong"),
+                   ("first", sample_guess(0)),
+                   ("last", sample_guess(n - 1))]
+        for name, text in guesses:
+            expected = loop_match(eurekas, text)
+            assert expected == matcher.match_eureka(text)
+            assert (expected is None) == (name == "wrong")
+            loop = timeit.timeit(lambda: loop_match(eurekas, text), number=NUMBER) / NUMBER * 1e6
+            fast = timeit.timeit(lambda: matcher.match_eureka(text), number=NUMBER) / NUMBER * 1e6
+            print("%9d %-12s %12.2f %12.2f %7.1fx" % (n, name, loop, fast, loop / fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# Load test of the guess endpoints at hunt start: every simulated player submits wrong guesses (and
+# the right answer once in a while) to the puzzles of the current hunt, as fast as the rate limit
+# lets it.
+#
+# It uses the players created by reset_data.py (test_user_N / passwordN, on teams of the current
+# hunt with unlocked puzzles) and the current locust API (locust >= 1.0), unlike locustfile.py.
+#
+# Usage, against a daphne server with the hunt started:
+#   locust -f locust/guess_load.py --headless -u 500 -r 50 -t 3m --host http://localhost:8000 --csv guess
+# The p99 latency of each endpoint is in the "99%" column of guess_stats.csv. Set GUESS_URL=sync to
+# compare with the synchronous PuzzleView.post endpoint.
+
+import itertools
+import os
+import random
+import re
+from string import ascii_lowercase
+
+from locust import HttpUser, task, between
+
+ASYNC = os.environ.get("GUESS_URL", "async") == "async"
+PLAYERS = int(os.environ.get("GUESS_PLAYERS", 864))  # players created by reset_data.py
+
+user_numbers = itertools.cycle(range(PLAYERS))
+puzzle_link = re.compile(r'href="/puzzle/([0-9a-zA-Z]{3,12})/"')
+
+
+def random_string(n):
+    return ''.join(random.choice(ascii_lowercase) for i in range(n))
+
+
+class Submitter(HttpUser):
+    # the default budgets allow one guess per puzzle and per user every 7 seconds
+    wait_time = between(5, 9)
+
+    def on_start(self):
+        number = next(user_numbers)
+        self.client.get("/login/")
+        self.client.post("/login/", {"username": "test_user_%d" % number,
+                                     "password": "password%d" % number,
+                                     "csrfmiddlewaretoken": self.client.cookies.get("csrftoken", "")},
+                         headers={"Referer": self.host + "/login/"})
+        response = self.client.get("/hunt/current/")
+        self.puzzle_ids = sorted(set(puzzle_link.findall(response.text))) or ["101"]
+
+    @task
+    def guess(self):
+        puzzle_id = random.choice(self.puzzle_ids)
+        answer = "answer" + puzzle_id if random.random() < 1.0 / 9.0 else random_string(10)
+        url = "/puzzle/%s/guess/" % puzzle_id if ASYNC else "/puzzle/%s/" % puzzle_id
+        with self.client.post(url, {"answer": answer}, name="guess " + ("async" if ASYNC else "sync"),
+                              catch_response=True) as response:
+            # being rate-limited is an expected answer, not a failure
+            if response.status_code == 429:
+                response.success()
@@ -141,11 +141,33 @@ HUEY = {
 WSGI_APPLICATION = 'server.wsgi.application'
 ASGI_APPLICATION = 'server.routing.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
-    },
-}
+# Group messages (guesses, eurekas, hints) go through redis so that they reach the sockets of every
+# daphne process; several comma separated urls shard the groups and channels between redis servers.
+# CHANNEL_LAYER=memory keeps them in the process, for a single process without redis.
+CHANNEL_REDIS_HOSTS = os.getenv("CHANNEL_REDIS_HOSTS", default="redis://redis:6379/2").split(",")
+CHANNEL_CAPACITY = int(os.getenv("CHANNEL_CAPACITY", default=100))  # Messages queued per socket before new ones are dropped
+CHANNEL_EXPIRY = int(os.getenv("CHANNEL_EXPIRY", default=60))  # Seconds before an undelivered message is dropped
+CHANNEL_GROUP_EXPIRY = int(os.getenv("CHANNEL_GROUP_EXPIRY", default=86400))  # Seconds a socket stays in its groups
+
+if os.getenv("CHANNEL_LAYER", default="redis") == "memory":
+    CHANNEL_LAYERS = {
+        'default': {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": CHANNEL_REDIS_HOSTS,
+                "prefix": "puzzlehunt",
+                "capacity": CHANNEL_CAPACITY,
+                "expiry": CHANNEL_EXPIRY,
+                "group_expiry": CHANNEL_GROUP_EXPIRY,
+            },
+        },
+    }
 
 # URL settings
 LOGIN_REDIRECT_URL = '/'
@@ -160,6 +182,8 @@ DEBUG_TOOLBAR_PATCH_SETTINGS = False
 BOOTSTRAP_ADMIN_SIDEBAR_MENU = True
 DEFAULT_HINT_LOCKOUT = 60  # 60 Minutes
 HUNT_REGISTRATION_LOCKOUT = 2  # 2 Days
+GUESS_WRITE_BEHIND_BATCH = 500  # Guesses inserted per query by the write-behind ingestion
+GUESS_WORKERS = 16  # Threads (and DB connections) per process for the async guess endpoint
 
 # Internationalization
 LANGUAGE_CODE = 'en-us'
@@ -242,6 +266,7 @@ if os.environ.get("SENTRY_DSN"):
 
 # ENV settings
 DEBUG = os.getenv("DJANGO_ENABLE_DEBUG", default="False").lower() == "true"
+GUESS_WRITE_BEHIND = os.getenv("GUESS_WRITE_BEHIND", default="False").lower() == "true"
 SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY")
 DATABASES = {'default': dj_database_url.config(conn_max_age=600)}
 
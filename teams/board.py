@@ -0,0 +1,87 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+""" The staff progress board of an episode: a cell per (team, puzzle) with a state and a time. The
+changes of the cells are pushed to the open boards as they are written, as [team pk, puzzle pk,
+state, unix time] deltas, instead of being polled.
+
+The board itself is served as columns rather than a grid of objects: the team pks, the puzzle pks,
+and row-major matrices (one row per team) of the states as a string of digits, of the times of the
+unlocks or solves and of the times of the last guesses, as unix times, 0 when there is none """
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+
+# in increasing order: a cell never goes back to a lower state
+LOCKED, UNLOCKED, GUESSED, SOLVED = range(4)
+
+
+def board_group(episode_id):
+    """ The group of the staff boards of an episode """
+    return f'progress-{episode_id}.board'
+
+
+def cell(team_id, puzzle_id, state, time):
+    return [team_id, puzzle_id, state, int(time.timestamp())]
+
+
+def episode_board(episode, teams):
+    """ The columnar board of an episode for the given teams (pks or a queryset, in the order of the
+        rows), from an aggregate query on the unlocks and one on the guesses """
+    from .models import TeamPuzzleLink
+    from hunts.models import Guess
+
+    team_ids = list(teams.values_list('pk', flat=True)) if hasattr(teams, 'values_list') else list(teams)
+    puzzle_ids = list(episode.puzzle_set.order_by('puzzle_number').values_list('pk', flat=True))
+    row = {pk: i * len(puzzle_ids) for i, pk in enumerate(team_ids)}
+    column = {pk: i for i, pk in enumerate(puzzle_ids)}
+    states = bytearray(len(team_ids) * len(puzzle_ids))
+    times = [0] * len(states)
+    guessed = [0] * len(states)
+
+    unlocks = (TeamPuzzleLink.objects.filter(puzzle__episode=episode).order_by()
+               .values_list('team', 'puzzle').annotate(Max('time')))
+    for team_id, puzzle_id, time in unlocks:
+        if team_id in row:
+            i = row[team_id] + column[puzzle_id]
+            states[i] = UNLOCKED
+            times[i] = int(time.timestamp())
+
+    guesses = (Guess.objects.filter(puzzle__episode=episode).order_by().values_list('team', 'puzzle')
+               .annotate(last=Max('guess_time'), solve=Min('guess_time', filter=Q(puzzlesolve__isnull=False)),
+                         solves=Count('puzzlesolve')))
+    for team_id, puzzle_id, last, solve, solves in guesses:
+        if team_id not in row:
+            continue
+        i = row[team_id] + column[puzzle_id]
+        if solves:
+            states[i] = SOLVED
+            times[i] = int(solve.timestamp())
+        elif states[i] != LOCKED:
+            states[i] = GUESSED
+        guessed[i] = int(last.timestamp())
+
+    return {'teams': team_ids, 'puzzles': puzzle_ids, 'states': ''.join(map(str, states)), 'times': times,
+            'guessed': guessed}
+
+
+def send_cells(episode_id, cells):
+    """ Sends cells of the board of an episode to its boards, once the transaction commits """
+    if not cells:
+        return
+
+    def send():
+        from .consumers import PuzzleWebsocket, has_listeners
+        group = board_group(episode_id)
+        if has_listeners(group):
+            PuzzleWebsocket._send_message(group, {'type': 'cells', 'content': {'cells': cells}})
+    transaction.on_commit(send)
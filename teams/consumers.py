@@ -10,24 +10,33 @@
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
-import asyncio
 from collections import defaultdict
-from datetime import datetime, timedelta
+from datetime import timedelta
 
-from asgiref.sync import async_to_sync, sync_to_async
-from channels.generic.websocket import JsonWebsocketConsumer
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.shortcuts import get_object_or_404
 from django.db import transaction
 from django.db.models.signals import pre_save, post_save, pre_delete
 from django.dispatch import receiver
+from django.template.loader import render_to_string
 from django.utils import timezone
-from .models import Guess, TeamEurekaLink
-from hunts.models import Puzzle, Hunt, Hint
+from django.db.models import OuterRef, Subquery
+from .models import Guess, TeamEurekaLink, TeamHintLink
+from .board import GUESSED, board_group, cell, send_cells
+from .hint_scheduler import hint_scheduler
+from .ingest import pending_guesses
+from .progress import get_progress
+from hunts.models import Hunt
+from hunts.resolver import get_puzzle, resolve
 
 from . import utils
 
+import asyncio
 
 
 def format_duration(arg):
@@ -88,8 +97,10 @@ class TeamMixin:
         # tenant or anything!
         # This means this is a bit weirdly placed.
         try:
-            hunt = get_object_or_404(Hunt, hunt_number=self.scope['url_route']['kwargs']['hunt_num'])
-            self.team = hunt.team_from_user(self.scope['user'])
+            context = resolve(self.scope['user'], hunt_num=self.scope['url_route']['kwargs']['hunt_num'])
+            if context.hunt is None:
+                raise Hunt.DoesNotExist
+            self.team = context.team
         except (ObjectDoesNotExist, AttributeError):
             # A user on the website will never open the websocket without getting a userprofile and team.
             self.close()
@@ -97,101 +108,127 @@ class TeamMixin:
         return super().websocket_connect(message)
 
 
-class PuzzleWebsocket(JsonWebsocketConsumer):
+def puzzle_group(puzzle_id, team_id=None):
+    """ The group of the sockets of a team on a puzzle (or of the staff without a team): many small
+        groups, which the redis channel layer spreads over its shards by name """
+    if team_id:
+        return f'puzzle-{puzzle_id}.events.team-{team_id}'
+    else:
+        return f'puzzle-{puzzle_id}.events'
+
+
+def team_group(team_id):
+    """ The group of the team sockets of a team, for its unlocks """
+    return f'team-{team_id}.events'
+
+
+def hunt_group(hunt_id):
+    """ The group of every team socket of a hunt, for the leaderboard """
+    return f'hunt-{hunt_id}.events'
+
+
+def queue_group(hunt_id):
+    """ The group of the staff queues of a hunt, which filter the guesses of their team or puzzle """
+    return f'queue-{hunt_id}'
+
+
+# A staff group is listened to while one of its sockets refreshed its mark less than LISTENER_TTL
+# seconds ago: the mark outlives the sockets of a dead process by at most that long, and an evicted one
+# is restored by the next refresh
+LISTENER_TTL = 90
+LISTENER_REFRESH = 30
+
+
+def _listeners_key(group):
+    return 'listeners:%s' % group
+
+
+def mark_listener(group):
+    cache.set(_listeners_key(group), True, LISTENER_TTL)
+
+
+def has_listeners(group):
+    """ Whether a staff page of the group is open, so that messages are worth rendering and sending """
+    return cache.get(_listeners_key(group)) is not None
+
+
+async def listen(group):
+    """ Marks a staff group as listened to, then keeps the mark alive until the returned task is
+        cancelled """
+    await database_sync_to_async(mark_listener)(group)
+
+    async def refresh():
+        while True:
+            await asyncio.sleep(LISTENER_REFRESH)
+            await database_sync_to_async(mark_listener)(group)
+    return asyncio.ensure_future(refresh())
+
+
+class PuzzleWebsocket(AsyncJsonWebsocketConsumer):
+    """ The socket of a puzzle page. It holds no thread: the database is only accessed through
+        database_sync_to_async, when connecting and when the page asks for the past events """
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.connected = False
 
     @classmethod
     def _puzzle_groupname(cls, puzzle, team=None):
-        if team:
-            return f'puzzle-{puzzle.id}.events.team-{team.id}'
-        else:
-            return f'puzzle-{puzzle.id}.events'
-
-    def connect(self):
-        keywords = self.scope['url_route']['kwargs']
-        puzzle_id = keywords['puzzle_id']
-        self.puzzle = get_object_or_404(Puzzle, puzzle_id__iexact=puzzle_id)
-        self.hunt = self.puzzle.episode.hunt
-        self.team = self.hunt.team_from_user(self.scope['user'])
-        self.is_staff = self.scope['user'].is_staff
-        async_to_sync(self.channel_layer.group_add)(
-            self._puzzle_groupname(self.puzzle, self.team), self.channel_name
-        )
-        self.setup_hint_timers()
+        return puzzle_group(puzzle.id, team.id if team else None)
+
+    @database_sync_to_async
+    def _resolve(self):
+        user = self.scope['user']
+        context = resolve(user, puzzle_id=self.scope['url_route']['kwargs']['puzzle_id'])
+        return context, user.is_staff
+
+    async def connect(self):
+        context, self.is_staff = await self._resolve()
+        if context.puzzle is None:
+            await self.close()
+            return
+        self.puzzle, self.hunt, self.team = context
+        await self.channel_layer.group_add(self._puzzle_groupname(self.puzzle, self.team), self.channel_name)
+        # hints are released by the scheduler of the process to the group joined above
+        hint_scheduler.start(asyncio.get_event_loop())
 
         self.connected = True
-        self.accept()
+        await self.accept()
 
-    def disconnect(self, close_code):
-        super().disconnect(close_code)
+    async def disconnect(self, close_code):
         if not self.connected:
             return
-
+        await self.channel_layer.group_discard(self._puzzle_groupname(self.puzzle, self.team), self.channel_name)
 
     @classmethod
     def _send_message(cls, group, message):
         layer = get_channel_layer()
-        async_to_sync(layer.group_send)(group, {'type': 'send_json_msg', 'content': message})
+        async_to_sync(layer.group_send)(group, {'type': 'send_json_msg', 'group': group, 'content': message})
 
-    def send_json_msg(self, content, close=False):
+    async def send_json_msg(self, content, close=False):
         # For some reason consumer dispatch doesn't strip off the outer dictionary with 'type': 'send_json'
         # (or whatever method name) so we override and do it here. This saves us having to define a separate
         # method which just calls send_json for each type of message.
-        super().send_json(content['content'])
-
-
-
-    def setup_hint_timers(self):
-        self.hint_events = {}
-        hints = self.puzzle.hint_set.all()
-        for hint in hints:
-            self.schedule_hint(hint)
-
-    def schedule_hint_msg(self, message):
-        try:
-            hint = Hint.objects.get(id=message['hint_uid'])
-        except (TypeError, KeyError):
-            raise ValueError('Cannot schedule a hint without either a hint instance or a dictionary with `hint_uid` key.')
-        send_expired = message.get('send_expired', False)
-        self.schedule_hint(hint, send_expired)
-
-    def schedule_hint(self, hint, send_expired=False):
-        try:
-            self.hint_events[hint.id].cancel()
-        except KeyError:
-            pass
-        
-        wait = hint.delay_for_team(self.team)
-        start = hint.starting_time_for_team(self.team)
-        delay = wait - (timezone.now() - start)
-        if delay is None:
-            return
-        delay = delay.total_seconds()
-        if not send_expired and delay < 0:
-            return
-        
-        sped_up = False
-        if wait < hint.time:
-            sped_up = True      
-        loop = sync_to_async.threadlocal.main_event_loop
-        # run the hint sender function on the asyncio event loop so we don't have to bother writing scheduler stuff
-        task = loop.create_task(self.send_new_hint(self.team, hint, delay, sped_up))
-        self.hint_events[hint.id] = task
-
-    def cancel_scheduled_hint(self, content):
-        hint = Hint.objects.get(id=content['hint_uid'])
-
-        try:
-            self.hint_events[hint.id].cancel()
-            del self.hint_events[hint.id]
-        except KeyError:
-            pass
+        await self.send_json(content['content'])
+
+    def _hint_releases(self, puzzle, hints=None):
+        """ The hints of the puzzle (or the given ones) with their release_time and sped_up for the
+            team, from the hint schedule (or after the episode start for staff without a team) """
+        if hints is None:
+            hints = puzzle.hint_set.all()
+        if self.team is None:
+            hints = list(hints)
+            for hint in hints:
+                hint.release_time, hint.sped_up = puzzle.episode.start_date + hint.time, False
+            return hints
+        links = TeamHintLink.objects.filter(hint=OuterRef('pk'), team=self.team)
+        return hints.annotate(release_time=Subquery(links.values('time')[:1]),
+                              sped_up=Subquery(links.values('sped_up')[:1]))
 
     @classmethod
-    def send_new_hint_to_team(cls, team, hint, sped_up):
-        cls._send_message(cls._puzzle_groupname(hint.puzzle, team), cls._new_hint_json(hint, sped_up))
+    def send_released_hint(cls, team_id, puzzle_id, hint, sped_up):
+        """ Broadcasts a hint released by the hint scheduler to the team's sockets on the puzzle """
+        cls._send_message(puzzle_group(puzzle_id, team_id), cls._new_hint_json(hint, sped_up))
 
     @classmethod
     def _new_hint_json(self, hint, sped_up):
@@ -206,22 +243,6 @@ class PuzzleWebsocket(JsonWebsocketConsumer):
             }
         }
 
-    async def send_new_hint(self, team, hint, delay, sped_up, **kwargs):
-        # We can't have a sync function (added to the event loop via call_later) because it would have to call back
-        # ultimately to SyncConsumer's send method, which is wrapped in async_to_sync, which refuses to run in a thread
-        # with a running asyncio event loop.
-        # See https://github.com/django/asgiref/issues/56
-        await asyncio.sleep(delay)
-
-        # AsyncConsumer replaces its own base_send attribute with an async_to_sync wrapped version if the instance is (a
-        # subclass of) SyncConsumer. While bizarre, the original async function is available as AsyncToSync.awaitable.
-        # We also have to reproduce the functionality of JsonWebsocketConsumer and WebsocketConsumer here (they don't
-        # have async versions.)
-        await self.base_send.awaitable({'type': 'websocket.send', 'text': self.encode_json(self._new_hint_json(hint, sped_up))})
-        del self.hint_events[hint.id]
-
-
-
     @classmethod
     def _new_guess_json(cls, guess):
         #correct = guess.get_correct_for() is not None
@@ -229,7 +250,7 @@ class PuzzleWebsocket(JsonWebsocketConsumer):
             'timestamp': str(guess.guess_time),
             'guess': guess.guess_text,
             'guess_uid': guess.id,
-            'correct': guess.is_correct,
+            'correct': guess.correct,
             'by': guess.user.username,
         }
 
@@ -252,8 +273,11 @@ class PuzzleWebsocket(JsonWebsocketConsumer):
         # Note this means an admin modifying a guess will not trigger anything.
         if raw:  # nocover
             return
+        # the staff queue also shows the responses given to guesses
+        StaffQueueWebsocket.send_guess(guess)
         if old:
             return
+        send_cells(guess.puzzle.episode_id, [cell(guess.team_id, guess.puzzle_id, GUESSED, guess.guess_time)])
 
         """
         # required info:
@@ -302,80 +326,294 @@ class PuzzleWebsocket(JsonWebsocketConsumer):
         eureka = teamEurekaLink.eureka
         if eureka.admin_only == False:
           cls.send_new_eureka(eureka, teamEurekaLink.team)
-        for hint in eureka.puzzle.hint_set.all():
-          if eureka in hint.eurekas.all(): #semi-check: hint may not be sped up yet, but prevents creating too many websockets
-            layer = get_channel_layer()
-            async_to_sync(layer.group_send)(cls._puzzle_groupname(eureka.puzzle, teamEurekaLink.team), {
-                'type': 'schedule_hint_msg',
-                'hint_uid': str(hint.id)
-            })
-
-    def receive_json(self, content):
+        # the hints it speeds up are rescheduled by teams.hints once the link is saved
+
+    async def receive_json(self, content):
         if 'type' not in content:
-            self._error('no type in message')
+            await self._error('no type in message')
             return
+        await self._replay(self.puzzle, content)
 
+    async def _replay(self, puzzle, content, tags={}):
+        """ Answers a request of the page for the past events of the puzzle, adding the given tags
+            to each message """
         if content['type'] == 'guesses-plz':
-            if 'from' not in content:
-                self._error('required field "from" is missing')
+            try:
+                after = int(content['after'])
+            except (KeyError, TypeError, ValueError):
+                await self._error('required field "after" is missing or not a guess id')
                 return
-            self.send_old_guesses(content['from'])
+            messages = await self._old_guesses(puzzle, after)
         elif content['type'] == 'unlocks-plz':
-            self.send_old_unlocks()
+            messages = await self._old_unlocks(puzzle)
         elif content['type'] == 'hints-plz':
             if 'from' not in content:
-                self._error('required field "from" is missing')
+                await self._error('required field "from" is missing')
                 return
-            self.send_old_hints(content['from'])
-        else:
-            self._error('invalid request type')
-
-    def _error(self, message):
-        self.send_json({'type': 'error', 'content': {'error': message}})
-
-    def send_old_guesses(self, start):
-        guesses = Guess.objects.filter(puzzle=self.puzzle, team=self.team).order_by('guess_time')
-        if start != 'all':
-            start = datetime.fromtimestamp(int(start) // 1000, timezone.utc)
-            # TODO: `start` is given by the client and is the timestamp of the most recently received guess.
-            # the following could miss guesses if guesses get the same timestamp, though this is very unlikely.
-            guesses = guesses.filter(guess_time__gt=start)
-            # The client requested guesses from a certain point in time, i.e. it already has some.
-            # Even though these are "old" they're "new" in the sense that the user will never have
-            # seen them before so should trigger the same UI effect.
-            msg_type = 'new_guess'
+            messages = await self._old_hints(puzzle, content['from'])
         else:
-            msg_type = 'old_guess'
-
-        for g in guesses:
-            content = self._new_guess_json(g)
-            self.send_json({
-                'type': msg_type,
-                'content': content
-            })
-
-    def send_old_hints(self, start='all'):
-        hints = self.puzzle.hint_set.all()
-        for hint in hints:
-            wait = hint.delay_for_team(self.team)
-            start = hint.starting_time_for_team(self.team)
-            delay = wait - (timezone.now() - start)
-            delay = delay.total_seconds()
-            
-            sped_up = False
-            if wait < hint.time:
-                sped_up = True      
-            if delay < 0 or (self.is_staff and self.team is not None):
-                self.send_new_hint_to_team(self.team, hint, sped_up)
-
-    def send_old_unlocks(self):
-        eurekas = self.team.eurekas.filter(puzzle=self.puzzle, admin_only=False, teameurekalink__time__lt=timezone.now()-timedelta(seconds=5)).order_by('teameurekalink__time')
+            await self._error('invalid request type')
+            return
+        for message in messages:
+            await self.send_json(dict(message, **tags))
+
+    async def _error(self, message):
+        await self.send_json({'type': 'error', 'content': {'error': message}})
+
+    # guesses per replay frame
+    guess_batch_size = 500
+
+    @database_sync_to_async
+    def _old_guesses(self, puzzle, after):
+        """ The guesses of the team on the puzzle with an id above after (0 for all of them), as
+            "guesses" frames of rows [id, timestamp, guess, correct, by] in id order. Each frame
+            has the id of its last guess as cursor, to be sent back as after when reconnecting. """
+        # read the queue of the write-behind ingestion first: a guess drained in between is then in
+        # both, rather than in none. Staff without a team have no queued guesses.
+        pending = []
+        if self.team is not None:
+            pending = pending_guesses(team_id=self.team.pk, puzzle_id=puzzle.pk, after=after)
+        guesses = (Guess.objects.filter(puzzle=puzzle, team=self.team, pk__gt=after).order_by('pk')
+                   .values_list('pk', 'guess_time', 'guess_text', 'correct', 'user__username'))
+        rows = {pk: [pk, str(time), text, correct, by] for pk, time, text, correct, by in guesses}
+        pending = [g for g in pending if g.pk not in rows]
+        if pending:
+            users = dict(User.objects.filter(pk__in={g.user_id for g in pending}).values_list('pk', 'username'))
+            for g in pending:
+                rows[g.pk] = [g.pk, str(g.guess_time), g.guess_text, g.correct, users.get(g.user_id)]
+        rows = [rows[pk] for pk in sorted(rows)]
+
+        # The client asking from a guess already has some: the others are "new" in the sense that
+        # the user never saw them, so they trigger the same UI effect as live guesses.
+        new = after > 0
+        return [{'type': 'guesses', 'content': {'new': new, 'cursor': batch[-1][0], 'guesses': batch}}
+                for batch in (rows[i:i + self.guess_batch_size] for i in range(0, len(rows), self.guess_batch_size))]
+
+    @database_sync_to_async
+    def _old_hints(self, puzzle, start='all'):
+        now = timezone.now()
+        messages = []
+        for hint in self._hint_releases(puzzle):
+            released = hint.release_time is not None and hint.release_time < now
+            if released or (self.is_staff and self.team is not None):
+                messages.append(self._new_hint_json(hint, bool(hint.sped_up)))
+        return messages
+
+    @database_sync_to_async
+    def _old_unlocks(self, puzzle):
+        eurekas = self.team.eurekas.filter(puzzle=puzzle, admin_only=False, teameurekalink__time__lt=timezone.now()-timedelta(seconds=5)).order_by('teameurekalink__time')
         # do not send super new eurekas to prevent players refreshing while someone is submitting getting those faster. The downside is that they will not get it if they don't refresh
-        for u in eurekas:
-            self.send_json({
-                'type': 'old_eureka',
-                'content': self._new_eureka_json(u)
-            })
+        return [{'type': 'old_eureka', 'content': self._new_eureka_json(u)} for u in eurekas]
+
+
+class TeamWebsocket(PuzzleWebsocket):
+    """ One socket per team session instead of one per puzzle page: the pages subscribe to their
+        puzzle over it, and it also carries the unlocks of the team and the solves of the hunt.
+        Events of a puzzle (and the answers to the requests about it) have a "puzzle" field. """
+
+    @database_sync_to_async
+    def _resolve(self):
+        user = self.scope['user']
+        context = resolve(user, hunt_num=self.scope['url_route']['kwargs']['hunt_num'])
+        return context, user.is_staff
+
+    async def connect(self):
+        context, self.is_staff = await self._resolve()
+        if context.hunt is None or (context.team is None and not self.is_staff):
+            await self.close()
+            return
+        self.hunt, self.team = context.hunt, context.team
+        # puzzle group -> puzzle
+        self.subscriptions = {}
+        self.groups = [hunt_group(self.hunt.pk)]
+        if self.team is not None:
+            self.groups.append(team_group(self.team.pk))
+        for group in self.groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        hint_scheduler.start(asyncio.get_event_loop())
+
+        self.connected = True
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if not self.connected:
+            return
+        for group in self.groups + list(self.subscriptions):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def send_json_msg(self, content, close=False):
+        message = content['content']
+        puzzle = self.subscriptions.get(content.get('group'))
+        if puzzle is not None:
+            message = dict(message, puzzle=puzzle.puzzle_id)
+        await self.send_json(message)
+
+    async def receive_json(self, content):
+        if 'type' not in content:
+            await self._error('no type in message')
+            return
+        if 'puzzle' not in content:
+            await self._error('required field "puzzle" is missing')
+            return
+
+        if content['type'] == 'subscribe':
+            puzzle = await self._accessible_puzzle(str(content['puzzle']))
+            if puzzle is None:
+                await self._error('unknown puzzle')
+                return
+            group = self._puzzle_groupname(puzzle, self.team)
+            if group not in self.subscriptions:
+                await self.channel_layer.group_add(group, self.channel_name)
+                self.subscriptions[group] = puzzle
+            return
+
+        puzzle = self._subscribed(str(content['puzzle']))
+        if puzzle is None:
+            await self._error('not subscribed to this puzzle')
+            return
+        if content['type'] == 'unsubscribe':
+            group = self._puzzle_groupname(puzzle, self.team)
+            await self.channel_layer.group_discard(group, self.channel_name)
+            del self.subscriptions[group]
+            return
+        # the answers go to the page that asked (through the shared worker of the pages)
+        tags = {'puzzle': puzzle.puzzle_id}
+        if 'request' in content:
+            tags['request'] = content['request']
+        await self._replay(puzzle, content, tags)
+
+    def _subscribed(self, puzzle_id):
+        for puzzle in self.subscriptions.values():
+            if puzzle.puzzle_id.lower() == puzzle_id.lower():
+                return puzzle
+        return None
+
+    @database_sync_to_async
+    def _accessible_puzzle(self, puzzle_id):
+        """ The puzzle with the given id if it is part of the hunt and the team can see it, or None
+            (the same rules as RequiredPuzzleAccessMixin, without a query once cached) """
+        puzzle = get_puzzle(puzzle_id)
+        if puzzle is None or puzzle.episode.hunt_id != self.hunt.pk:
+            return None
+        if self.is_staff or self.hunt.is_public:
+            return puzzle
+        if not get_progress(self.team).puzzle_visible(puzzle, self.team.is_playtester_team):
+            return None
+        return puzzle
+
+    @classmethod
+    def send_new_unlocks(cls, team_id, puzzle_ids):
+        cls._send_message(team_group(team_id), {
+            'type': 'new_unlocks',
+            'content': {'puzzles': puzzle_ids}
+        })
+
+    @classmethod
+    def send_new_episode(cls, team_id, episode):
+        cls._send_message(team_group(team_id), {
+            'type': 'new_episode',
+            'content': {'episode': episode.ep_number, 'name': episode.ep_name}
+        })
+
+    @classmethod
+    def send_leaderboard_change(cls, hunt_id, team):
+        cls._send_message(hunt_group(hunt_id), {
+            'type': 'leaderboard',
+            'content': {'team': team.team_name}
+        })
+
+
+class StaffQueueWebsocket(AsyncJsonWebsocketConsumer):
+    """ The socket of the staff queue: the guesses are pushed as they are written, already
+        rendered, to the queues of their hunt, which show those of their team or puzzle, instead of
+        being polled """
+
+    async def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated or not user.is_staff:
+            await self.close()
+            return
+        self.group = None
+        self.listening = None
+        self.team_id = None
+        self.puzzle_id = None
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self._leave()
+
+    async def _leave(self):
+        if getattr(self, 'group', None) is not None:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+            self.listening.cancel()
+            self.group = None
+
+    async def receive_json(self, content):
+        """ {"type": "subscribe", "team": pk or null, "puzzle": pk or null}, for the current hunt """
+        if content.get('type') != 'subscribe':
+            await self.send_json({'type': 'error', 'content': {'error': 'invalid request type'}})
+            return
+        try:
+            self.team_id = int(content['team']) if content.get('team') else None
+            self.puzzle_id = int(content['puzzle']) if content.get('puzzle') else None
+        except (TypeError, ValueError):
+            await self.send_json({'type': 'error', 'content': {'error': 'invalid team or puzzle'}})
+            return
+        try:
+            hunt = await database_sync_to_async(Hunt.objects.get_current)()
+        except Hunt.DoesNotExist:
+            await self.send_json({'type': 'error', 'content': {'error': 'no current hunt'}})
+            return
+        if self.group != queue_group(hunt.pk):
+            await self._leave()
+            self.group = queue_group(hunt.pk)
+            await self.channel_layer.group_add(self.group, self.channel_name)
+            self.listening = await listen(self.group)
+
+    async def send_json_msg(self, content, close=False):
+        message = content['content']
+        if ((self.team_id is not None and message['content']['team'] != self.team_id) or
+                (self.puzzle_id is not None and message['content']['puzzle'] != self.puzzle_id)):
+            return
+        await self.send_json(message)
+
+    @classmethod
+    def send_guess(cls, guess):
+        """ Sends a new or updated guess, rendered once, to the queues of its hunt if any is open """
+        group = queue_group(guess.team.hunt_id)
+        if guess.team.location == "DUMMY" or not has_listeners(group):
+            return
+        PuzzleWebsocket._send_message(group, {
+            'type': 'guess',
+            'content': {
+                'id': guess.pk,
+                'team': guess.team_id,
+                'puzzle': guess.puzzle_id,
+                'row': render_to_string('staff/queue_row.html', {'guess': guess}),
+            }
+        })
+
+
+class StaffProgressWebsocket(AsyncJsonWebsocketConsumer):
+    """ The socket of the staff progress board of an episode, which receives the changed cells """
+
+    async def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated or not user.is_staff:
+            await self.close()
+            return
+        self.group = board_group(int(self.scope['url_route']['kwargs']['ep_pk']))
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        self.listening = await listen(self.group)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'group', None) is not None:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+            self.listening.cancel()
+
+    async def send_json_msg(self, content, close=False):
+        await self.send_json(content['content'])
 
 
 pre_save.connect(PuzzleWebsocket._saved_guess, sender=Guess)
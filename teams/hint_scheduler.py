@@ -0,0 +1,141 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Release of the hints to the puzzle websockets: one timer per (team, puzzle, hint) instead of
+one per hint per open socket.
+
+The pending releases are kept in a redis sorted set scored by release time, which is persistent and
+shared by every ASGI process. Each process runs a loop that claims the due releases (ZREM: only one
+process wins each of them) and broadcasts them to the team's puzzle group. Without a redis cache
+(development, tests), the releases are kept in the memory of the process. """
+
+from channels.db import database_sync_to_async
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import TeamHintLink
+
+import asyncio
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _redis():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+class HintScheduler(object):
+    """ A priority queue of hint releases, keyed by (team pk, puzzle pk, hint pk) """
+
+    # seconds between two checks for due releases, i.e. how late a hint can be
+    interval = 1
+    batch_size = 500
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = {}
+        self._task = None
+
+    def _key(self):
+        return cache.make_key('hints:schedule')
+
+    def schedule(self, releases):
+        """ Schedules (or moves) the release of hints, given as (team pk, puzzle pk, hint pk, time) """
+        scores = {'%d:%d:%d' % (team_id, puzzle_id, hint_id): release.timestamp()
+                  for team_id, puzzle_id, hint_id, release in releases}
+        if not scores:
+            return
+        conn = _redis()
+        if conn is not None:
+            conn.zadd(self._key(), scores)
+        else:
+            with self._lock:
+                self._local.update(scores)
+
+    def _claim(self, now):
+        """ Removes the releases due at the given timestamp from the queue, and returns them """
+        conn = _redis()
+        if conn is None:
+            with self._lock:
+                due = sorted((score, member) for member, score in self._local.items() if score <= now)
+                for score, member in due[:self.batch_size]:
+                    del self._local[member]
+                return [member for score, member in due[:self.batch_size]]
+        key = self._key()
+        members = conn.zrangebyscore(key, '-inf', now, start=0, num=self.batch_size)
+        if not members:
+            return []
+        pipe = conn.pipeline(transaction=False)
+        for member in members:
+            pipe.zrem(key, member)
+        return [member.decode() for member, removed in zip(members, pipe.execute()) if removed]
+
+    def release_due(self):
+        """ Broadcasts the hints that are due to the teams; returns how many """
+        from .consumers import PuzzleWebsocket
+
+        now = timezone.now()
+        claimed = {}
+        for member in self._claim(now.timestamp()):
+            team_id, puzzle_id, hint_id = (int(pk) for pk in member.split(':'))
+            claimed[(team_id, hint_id)] = puzzle_id
+        if not claimed:
+            return 0
+        links = TeamHintLink.objects.filter(team_id__in={team_id for team_id, hint_id in claimed},
+                                            hint_id__in={hint_id for team_id, hint_id in claimed})
+        released = 0
+        for link in links.select_related('hint'):
+            puzzle_id = claimed.get((link.team_id, link.hint_id))
+            if puzzle_id is None:
+                continue
+            if link.time > now:
+                # moved back while being claimed
+                self.schedule([(link.team_id, puzzle_id, link.hint_id, link.time)])
+                continue
+            PuzzleWebsocket.send_released_hint(link.team_id, puzzle_id, link.hint, link.sped_up)
+            released += 1
+        return released
+
+    def load(self):
+        """ Schedules every hint release still to come (after a restart of a process without redis,
+            or the first time) """
+        links = TeamHintLink.objects.filter(time__gt=timezone.now())
+        self.schedule(links.values_list('team_id', 'hint__puzzle_id', 'hint_id', 'time').iterator())
+
+    async def _run(self):
+        await database_sync_to_async(self.load)()
+        while True:
+            try:
+                await database_sync_to_async(self.release_due)()
+            except Exception:
+                logger.exception("Hint release failed")
+            await asyncio.sleep(self.interval)
+
+    def start(self, loop):
+        """ Starts the release loop of this process on the given event loop, unless it is running """
+        with self._lock:
+            if self._task is not None:
+                return
+            self._task = True
+        loop.call_soon_threadsafe(self._create_task, loop)
+
+    def _create_task(self, loop):
+        self._task = loop.create_task(self._run())
+
+
+hint_scheduler = HintScheduler()
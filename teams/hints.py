@@ -0,0 +1,111 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Materialized hint schedule: the time each hint is released to each team that unlocked its
+puzzle is kept in TeamHintLink, and only recomputed when an unlock, a eureka of the team or the hint
+itself changes, so that counting or listing released hints is a query instead of nested loops """
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from hunts.models import Hint
+from .hint_scheduler import hint_scheduler
+from .models import TeamPuzzleLink, TeamEurekaLink, TeamHintLink
+
+
+def release_time(start, delay, number_eurekas, short_delay, found):
+    """ When a hint is released to a team that could start the puzzle at start, given the times at
+        which the team found the eurekas of the hint: returns (time, sped_up) """
+    release = start + delay
+    if found and len(found) >= number_eurekas:
+        early = max(found) + short_delay
+        if early < release:
+            return early, True
+    return release, False
+
+
+def refresh_hint_schedule(teams=None, puzzles=None, hints=None):
+    """ Recomputes the release of the hints of the given puzzles (or hints) to the given teams that
+        unlocked them; None stands for all of them. Each argument is a list of pks or a queryset.
+        Returns the TeamHintLinks that were created or moved. """
+    hint_set = Hint.objects.prefetch_related('eurekas')
+    if puzzles is not None:
+        hint_set = hint_set.filter(puzzle__in=puzzles)
+    if hints is not None:
+        hint_set = hint_set.filter(pk__in=hints)
+    hint_set = list(hint_set)
+    if not hint_set:
+        return []
+
+    unlocks = TeamPuzzleLink.objects.filter(puzzle__in={hint.puzzle_id for hint in hint_set})
+    if teams is not None:
+        unlocks = unlocks.filter(team__in=teams)
+    starts = {(team_id, puzzle_id): start or episode_start for team_id, puzzle_id, start, episode_start in
+              unlocks.values_list('team_id', 'puzzle_id', 'effective_start', 'puzzle__episode__start_date')}
+    if not starts:
+        return []
+    team_ids = {team_id for team_id, puzzle_id in starts}
+
+    found = {}
+    eureka_links = TeamEurekaLink.objects.filter(team__in=team_ids, eureka__hint__in=hint_set).distinct()
+    for team_id, eureka_id, time in eureka_links.values_list('team_id', 'eureka_id', 'time'):
+        found[(team_id, eureka_id)] = time
+
+    schedule = {}
+    for hint in hint_set:
+        eurekas = [eureka.pk for eureka in hint.eurekas.all()]
+        for team_id in team_ids:
+            start = starts.get((team_id, hint.puzzle_id))
+            if start is None:
+                continue
+            times = [found[(team_id, pk)] for pk in eurekas if (team_id, pk) in found]
+            schedule[(team_id, hint.pk)] = release_time(start, hint.time, hint.number_eurekas, hint.short_time, times)
+
+    with transaction.atomic():
+        existing = TeamHintLink.objects.select_for_update().filter(team__in=team_ids, hint__in=hint_set)
+        moved = []
+        for link in existing:
+            release = schedule.pop((link.team_id, link.hint_id), None)
+            if release is not None and release != (link.time, link.sped_up):
+                link.time, link.sped_up = release
+                moved.append(link)
+        TeamHintLink.objects.bulk_update(moved, ['time', 'sped_up'])
+        created = [TeamHintLink(team_id=team_id, hint_id=hint_id, time=time, sped_up=sped_up)
+                   for (team_id, hint_id), (time, sped_up) in schedule.items()]
+        # a concurrent refresh computes the same releases
+        TeamHintLink.objects.bulk_create(created, ignore_conflicts=True)
+    changed = moved + created
+    if changed:
+        puzzle_of = {hint.pk: hint.puzzle_id for hint in hint_set}
+        releases = [(link.team_id, puzzle_of[link.hint_id], link.hint_id, link.time) for link in changed]
+        transaction.on_commit(lambda: hint_scheduler.schedule(releases))
+    return changed
+
+
+def released_hints(team, puzzle, at=None):
+    """ The hints of the puzzle released to the team by the given time (now by default), in
+        release order, annotated with release_time and sped_up """
+    at = at or timezone.now()
+    return (Hint.objects.filter(puzzle=puzzle, teamhintlink__team=team, teamhintlink__time__lte=at)
+            .annotate(release_time=F('teamhintlink__time'), sped_up=F('teamhintlink__sped_up'))
+            .order_by('release_time'))
+
+
+def with_hint_counts(solves):
+    """ Annotates a PuzzleSolve queryset with the number of hints the team had received when it
+        solved the puzzle, as hints """
+    released = (TeamHintLink.objects.filter(team=OuterRef('team'), hint__puzzle=OuterRef('puzzle'),
+                                            time__lt=OuterRef('guess__guess_time'))
+                .order_by().values('team').annotate(count=Count('pk')).values('count'))
+    return solves.annotate(hints=Coalesce(Subquery(released, output_field=IntegerField()), 0))
@@ -0,0 +1,195 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Write-behind ingestion of wrong guesses: instead of being saved right away, they are appended
+to a redis stream that a huey task moves to the database in batches.
+
+Each guess gets its pk from the database sequence when it is queued, so that it keeps the same id
+in the websocket messages, in the stream and in the table, and so that draining it twice is
+harmless. Until it is drained, readers have to merge pending_guesses() with the table; queued
+guesses are also kept in sorted sets by id, per hunt, team, puzzle and team on a puzzle, so that
+they read a range of an index instead of the whole stream. """
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.utils.dateparse import parse_datetime
+
+from .models import Guess, Team
+
+import json
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _redis():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        return None
+
+
+def _stream_key():
+    return cache.make_key('guesses:stream')
+
+
+def _index_key(hunt_id=None, team_id=None, puzzle_id=None):
+    """ The key of the index of the queued guesses of a team on a puzzle, of a team, of a puzzle, of
+        a hunt or of all of them, by guess id """
+    if team_id is not None and puzzle_id is not None:
+        index = 'team:%s:puzzle:%s' % (team_id, puzzle_id)
+    elif team_id is not None:
+        index = 'team:%s' % team_id
+    elif puzzle_id is not None:
+        index = 'puzzle:%s' % puzzle_id
+    elif hunt_id is not None:
+        index = 'hunt:%s' % hunt_id
+    else:
+        index = 'all'
+    return cache.make_key('guesses:pending:%s' % index)
+
+
+def _index_keys(fields):
+    """ The keys of all the indexes a queued guess is in """
+    hunt_id, team_id, puzzle_id = fields['hunt'], fields['team'], fields['puzzle']
+    return [_index_key(), _index_key(hunt_id), _index_key(team_id=team_id), _index_key(puzzle_id=puzzle_id),
+            _index_key(team_id=team_id, puzzle_id=puzzle_id)]
+
+
+def _member(fields):
+    """ A queued guess in the indexes: its stream fields as JSON """
+    return json.dumps(fields, sort_keys=True)
+
+
+def write_behind_enabled():
+    """ A boolean indicating if wrong guesses should go through the stream """
+    return getattr(settings, 'GUESS_WRITE_BEHIND', False) and _redis() is not None
+
+
+def _next_pk():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))", [Guess._meta.db_table])
+        return cursor.fetchone()[0]
+
+
+def _encode(guess):
+    return {'id': str(guess.pk), 'user': str(guess.user_id), 'team': str(guess.team_id),
+            'puzzle': str(guess.puzzle_id), 'hunt': str(guess.team.hunt_id),
+            'time': guess.guess_time.isoformat(), 'text': guess.guess_text}
+
+
+def _decode(fields):
+    time = parse_datetime(fields['time'])
+    guess = Guess(pk=int(fields['id']), user_id=int(fields['user']), team_id=int(fields['team']),
+                  puzzle_id=int(fields['puzzle']), guess_time=time, modified_date=time,
+                  guess_text=fields['text'])
+    return int(fields['hunt']), guess
+
+
+def _decode_entry(fields):
+    return {k.decode(): v.decode() for k, v in fields.items()}
+
+
+def enqueue_guess(guess):
+    """ Queues an unsaved guess instead of saving it, and sends it to the team's websockets """
+    guess.pk = _next_pk()
+    guess.modified_date = guess.guess_time
+    fields = _encode(guess)
+    member = _member(fields)
+    pipe = _redis().pipeline()
+    pipe.xadd(_stream_key(), fields)
+    for key in _index_keys(fields):
+        pipe.zadd(key, {member: guess.pk})
+    pipe.execute()
+    # at most one drain per second, whatever the number of guesses
+    if cache.add('guesses:drain-scheduled', True, 1):
+        from .tasks import drain_guesses
+        drain_guesses.schedule(delay=1)
+    from .board import GUESSED, cell, send_cells
+    from .consumers import PuzzleWebsocket, StaffQueueWebsocket
+    PuzzleWebsocket.send_new_guess(guess)
+    StaffQueueWebsocket.send_guess(guess)
+    send_cells(guess.puzzle.episode_id, [cell(guess.team_id, guess.puzzle_id, GUESSED, guess.guess_time)])
+
+
+def pending_guesses(hunt_id=None, team_id=None, puzzle_id=None, after=None, before=None, limit=None):
+    """ The queued guesses that are not in the database yet, oldest first (unsaved instances), with
+        an id above after and below before, only the newest limit ones if given. They are read
+        from the index of the team on the puzzle, of the team, of the puzzle or of the hunt, so the
+        cost does not depend on the rest of the queue. """
+    conn = _redis()
+    if conn is None:
+        return []
+    key = _index_key(hunt_id, team_id, puzzle_id)
+    low = '(%d' % after if after is not None else '-inf'
+    high = '(%d' % before if before is not None else '+inf'
+    if limit is None:
+        members = conn.zrangebyscore(key, low, high)
+    else:
+        members = conn.zrevrangebyscore(key, high, low, start=0, num=limit)[::-1]
+    guesses = []
+    for member in members:
+        hunt, guess = _decode(json.loads(member))
+        if hunt_id is None or hunt == hunt_id:
+            guesses.append(guess)
+    return guesses
+
+
+def load_related(guesses):
+    """ Loads the teams and puzzles of queued guesses, one query for each """
+    from hunts.models import Puzzle
+
+    teams = Team.objects.in_bulk({g.team_id for g in guesses})
+    puzzles = Puzzle.objects.in_bulk({g.puzzle_id for g in guesses})
+    for g in guesses:
+        g.team = teams[g.team_id]
+        g.puzzle = puzzles[g.puzzle_id]
+    return guesses
+
+
+def drain(batch_size=None):
+    """ Moves the queued guesses to the database, batch_size at a time; returns how many """
+    from hunts.models import Puzzle
+
+    conn = _redis()
+    if conn is None:
+        return 0
+    batch_size = batch_size or getattr(settings, 'GUESS_WRITE_BEHIND_BATCH', 500)
+    key = _stream_key()
+    total = 0
+    while True:
+        entries = conn.xrange(key, count=batch_size)
+        if not entries:
+            break
+        fields = [_decode_entry(fields) for stream_id, fields in entries]
+        guesses = [_decode(f)[1] for f in fields]
+        # drop the guesses whose team, puzzle or user was deleted in the meantime
+        teams = set(Team.objects.filter(pk__in={g.team_id for g in guesses}).values_list('pk', flat=True))
+        puzzles = set(Puzzle.objects.filter(pk__in={g.puzzle_id for g in guesses}).values_list('pk', flat=True))
+        users = set(User.objects.filter(pk__in={g.user_id for g in guesses}).values_list('pk', flat=True))
+        valid = [g for g in guesses if g.team_id in teams and g.puzzle_id in puzzles and g.user_id in users]
+        if len(valid) < len(guesses):
+            logger.warning("Dropped %d queued guesses of deleted objects" % (len(guesses) - len(valid)))
+        # explicit pks: a batch inserted by a drain that died before XDEL is skipped the next time
+        Guess.objects.bulk_create(valid, ignore_conflicts=True)
+        pipe = conn.pipeline()
+        pipe.xdel(key, *[stream_id for stream_id, f in entries])
+        for f in fields:
+            for index in _index_keys(f):
+                pipe.zrem(index, _member(f))
+        pipe.execute()
+        total += len(entries)
+        if len(entries) < batch_size:
+            break
+    return total
@@ -0,0 +1,88 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Checks that a group message reaches sockets held by other processes, as it must when several
+daphne workers run: starts worker processes that each join a group like a puzzle websocket does,
+sends one message to the group and waits for every worker to receive it """
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import uuid
+
+
+class Command(BaseCommand):
+    help = "Checks that the channel layer delivers group messages across processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=3, help="Number of worker processes")
+        parser.add_argument('--timeout', type=float, default=10, help="Seconds to wait for each step")
+        # internal: run as one of the workers, listening on the given group
+        parser.add_argument('--listen', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['listen']:
+            return self.listen(options['listen'], options['timeout'])
+
+        layer = get_channel_layer()
+        if layer.__class__.__name__ == 'InMemoryChannelLayer':
+            raise CommandError("The in-memory channel layer only delivers within one process")
+        group = 'check-%s' % uuid.uuid4().hex
+        token = uuid.uuid4().hex
+        command = [sys.executable, '-m', 'django', 'check_channel_layer', '--listen', group,
+                   '--timeout', str(options['timeout'])]
+        workers = [subprocess.Popen(command, cwd=settings.BASE_DIR, env=os.environ.copy(),
+                                    stdout=subprocess.PIPE, universal_newlines=True)
+                   for i in range(options['workers'])]
+        try:
+            for worker in workers:
+                if self.read_line(worker, options['timeout']) != 'ready':
+                    raise CommandError("A worker could not join the group")
+            async_to_sync(layer.group_send)(group, {'type': 'check', 'token': token})
+            received = sum(self.read_line(worker, options['timeout']) == token for worker in workers)
+        finally:
+            for worker in workers:
+                worker.kill()
+                worker.wait()
+        if received < len(workers):
+            raise CommandError("%d of %d workers received the group message" % (received, len(workers)))
+        self.stdout.write("%d workers received the group message" % received)
+
+    def read_line(self, worker, timeout):
+        """ The next line written by a worker, or None if it writes nothing in time """
+        lines = []
+        reader = threading.Thread(target=lambda: lines.append(worker.stdout.readline().strip()), daemon=True)
+        reader.start()
+        reader.join(timeout)
+        return lines[0] if lines else None
+
+    def listen(self, group, timeout):
+        layer = get_channel_layer()
+
+        async def receive():
+            channel = await layer.new_channel()
+            await layer.group_add(group, channel)
+            self.stdout.write('ready')
+            self.stdout.flush()
+            message = await asyncio.wait_for(layer.receive(channel), timeout)
+            await layer.group_discard(group, channel)
+            return message['token']
+
+        self.stdout.write(async_to_sync(receive)())
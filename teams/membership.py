@@ -0,0 +1,47 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.db import transaction
+
+from hunts.caching import VersionedLocalCache
+from .models import Team
+
+import copy
+
+
+def build_user_teams(user_id):
+    """ Maps each hunt pk to the team of the user for that hunt (one query) """
+    teams = {}
+    for team in Team.objects.filter(person__user_id=user_id).order_by('-pk'):
+        teams[team.hunt_id] = team
+    return teams
+
+
+# ttl=0: the version token is checked on every request (one cache get), so that joining or
+# leaving a team is seen right away by every worker
+_user_teams = VersionedLocalCache('user_teams', ttl=0, shared_timeout=24 * 3600)
+
+
+def get_user_team(user_id, hunt_id):
+    """ Returns (a private copy of) the team of the user for the hunt, or None """
+    team = _user_teams.get(user_id, lambda: build_user_teams(user_id)).get(hunt_id)
+    return copy.deepcopy(team)
+
+
+def invalidate_user_teams(user_ids):
+    """ Drops the cached teams of the given users, now and once the transaction commits """
+    user_ids = list(user_ids)
+    def invalidate():
+        for user_id in user_ids:
+            _user_teams.invalidate(user_id)
+    invalidate()
+    transaction.on_commit(invalidate)
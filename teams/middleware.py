@@ -10,23 +10,23 @@
 #
 # You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
 
+from asgiref.sync import sync_to_async
+from django.utils.deprecation import MiddlewareMixin
 from .models import Team
+from hunts.middleware import resolved_by_view
 from hunts.models import Hunt
 
-class TeamMiddleware(object):
+class TeamMiddleware(MiddlewareMixin):
     """
     Automatically fetch the team of hunt if the user is logged in
     """
-    def __init__(self, get_response):
-        self.get_response = get_response
-
-    def __call__(self, request):
-        return self.get_response(request)
-
-    def process_view(self, request, view_func, view_args, view_kwargs):
+    async def process_view(self, request, view_func, view_args, view_kwargs):
         request.team = None
-
-        if not request.user.is_authenticated or request.hunt is None:
+        if resolved_by_view(view_func):
             return
+        request.team = await sync_to_async(self.get_team, thread_sensitive=True)(request)
 
-        request.team = request.hunt.team_from_user(request.user)
+    def get_team(self, request):
+        if not request.user.is_authenticated or request.hunt is None:
+            return None
+        return request.hunt.team_from_user(request.user)
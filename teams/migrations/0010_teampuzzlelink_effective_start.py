@@ -0,0 +1,33 @@
+# Generated by Django 3.1.7 on 2021-05-20 18:12
+
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+
+def fill_effective_start(apps, schema_editor):
+    TeamEpisodeLink = apps.get_model('teams', 'TeamEpisodeLink')
+    TeamPuzzleLink = apps.get_model('teams', 'TeamPuzzleLink')
+    for link in TeamEpisodeLink.objects.select_related('team', 'episode'):
+        unlocks = TeamPuzzleLink.objects.filter(team=link.team, puzzle__episode=link.episode)
+        if link.team.playtester:
+            unlocks.update(effective_start=F('time'))
+        else:
+            opens = Value(link.episode.start_date - link.headstart, output_field=models.DateTimeField())
+            unlocks.update(effective_start=Greatest('time', opens))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('teams', '0009_team_discord_linked'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teampuzzlelink',
+            name='effective_start',
+            field=models.DateTimeField(blank=True, help_text='The time the team could start working on the puzzle (filled in automatically)', null=True),
+        ),
+        migrations.RunPython(fill_effective_start, migrations.RunPython.noop),
+    ]
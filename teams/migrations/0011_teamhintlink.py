@@ -0,0 +1,59 @@
+# Generated by Django 3.1.7 on 2021-05-21 10:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# a copy of teams.hints.release_time at the time of this migration
+def release_time(start, delay, number_eurekas, short_delay, found):
+    release = start + delay
+    if found and len(found) >= number_eurekas:
+        early = max(found) + short_delay
+        if early < release:
+            return early, True
+    return release, False
+
+
+def fill_hint_schedule(apps, schema_editor):
+    Hint = apps.get_model('hunts', 'Hint')
+    TeamPuzzleLink = apps.get_model('teams', 'TeamPuzzleLink')
+    TeamEurekaLink = apps.get_model('teams', 'TeamEurekaLink')
+    TeamHintLink = apps.get_model('teams', 'TeamHintLink')
+    found = {}
+    for team_id, eureka_id, time in TeamEurekaLink.objects.values_list('team_id', 'eureka_id', 'time'):
+        found[(team_id, eureka_id)] = time
+    links = []
+    for hint in Hint.objects.prefetch_related('eurekas'):
+        eurekas = [eureka.pk for eureka in hint.eurekas.all()]
+        unlocks = TeamPuzzleLink.objects.filter(puzzle_id=hint.puzzle_id)
+        for team_id, start, episode_start in unlocks.values_list('team_id', 'effective_start', 'puzzle__episode__start_date'):
+            times = [found[(team_id, pk)] for pk in eurekas if (team_id, pk) in found]
+            time, sped_up = release_time(start or episode_start, hint.time, hint.number_eurekas, hint.short_time, times)
+            links.append(TeamHintLink(team_id=team_id, hint_id=hint.pk, time=time, sped_up=sped_up))
+    TeamHintLink.objects.bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hunts', '0014_hunt_guess_budgets'),
+        ('teams', '0010_teampuzzlelink_effective_start'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamHintLink',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(help_text='The time this hint is (or was) released to this team')),
+                ('sped_up', models.BooleanField(default=False, help_text='True if the eurekas found by the team brought the release forward')),
+                ('hint', models.ForeignKey(help_text='The hint released', on_delete=django.db.models.deletion.CASCADE, to='hunts.hint')),
+                ('team', models.ForeignKey(help_text='The team that this hint is released to', on_delete=django.db.models.deletion.CASCADE, to='teams.team')),
+            ],
+            options={
+                'verbose_name_plural': 'Hints released to teams',
+                'unique_together': {('hint', 'team')},
+            },
+        ),
+        migrations.RunPython(fill_hint_schedule, migrations.RunPython.noop),
+    ]
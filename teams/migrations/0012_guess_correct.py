@@ -0,0 +1,48 @@
+# Generated by Django 3.1.7 on 2021-05-22 09:31
+
+from django.db import migrations, models
+
+import re
+
+
+# a copy of the answer check of hunts.matching at the time of this migration
+def normalize_guess(text):
+    return text.upper().replace(" ", "")
+
+
+def fill_correct(apps, schema_editor):
+    Puzzle = apps.get_model('hunts', 'Puzzle')
+    Guess = apps.get_model('teams', 'Guess')
+    for puzzle in Puzzle.objects.all():
+        answer = normalize_guess(puzzle.answer)
+        try:
+            regex = re.compile(puzzle.answer_regex, re.IGNORECASE) if puzzle.answer_regex != "" else None
+        except re.error:
+            regex = None
+        guesses = Guess.objects.filter(puzzle=puzzle).values_list('pk', 'guess_text')
+        correct = []
+        for pk, text in guesses.iterator():
+            guess = normalize_guess(text)
+            if guess == answer or (regex is not None and regex.fullmatch(guess) is not None):
+                correct.append(pk)
+        Guess.objects.filter(pk__in=correct).update(correct=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('teams', '0011_teamhintlink'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='guess',
+            name='correct',
+            field=models.BooleanField(default=False, help_text='True if the guess was the answer when it was submitted (filled in automatically)'),
+        ),
+        migrations.AddIndex(
+            model_name='guess',
+            index=models.Index(fields=['team', 'puzzle', 'id'], name='teams_guess_team_id_312980_idx'),
+        ),
+        migrations.RunPython(fill_correct, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.7 on 2021-05-22 15:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('teams', '0012_guess_correct'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='guess',
+            index=models.Index(fields=['team', 'id'], name='teams_guess_team_id_ddb885_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='guess',
+            index=models.Index(fields=['puzzle', 'id'], name='teams_guess_puzzle__3b5646_idx'),
+        ),
+    ]
@@ -18,7 +18,7 @@ from dateutil import tz
 from django.conf import settings
 from datetime import timedelta
 from enum import Enum
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
 from django.template.defaultfilters import slugify
 
@@ -166,61 +166,8 @@ class Team(models.Model):
 
     def unlock_puzzles_and_episodes(self):
         """ Unlocks all puzzles and episodes a team is currently supposed to have unlocked """
-
-        # Unlock the first episodes that do not have prerequisites
-        if self.ep_unlocked.count() == 0:
-            for ep in self.hunt.episode_set.filter(episode=None):
-                TeamEpisodeLink.objects.create(team=self, episode=ep)
-
-        for ep in self.ep_unlocked.all():
-            # skip if the episode was already solved
-            if ep in self.ep_solved.all():
-                continue
-
-            # puzzles and associated numbers
-            puzzles = [puzzle for puzzle in ep.puzzle_set.all()]
-            puz_numbers = [puz.puzzle_number for puz in puzzles]
-            num_solved = 0
-            
-            if len(puzzles)>0:
-              # mapping between a puzzle number and the number of prerequisite puzzles already solved by a team
-              mapping = [0]*(max(puz_numbers) + 1)
-
-              # go through each solved puzzle and add to mapping for each puzzle it unlocks
-              # we also count the number of solved puzzles to determine if ep was solved
-              for puz in self.puz_solved.filter(episode=ep):
-                  num_solved += 1
-                  for num in puz.unlocks.values_list('puzzle_number', flat=True):
-                      mapping[num] += 1
-
-            # See if we can unlock the next episode (if there remains one)
-            if num_solved==len(puzzles) and ep.unlocks!=None and ep.unlocks not in self.ep_unlocked.all():
-                logger.info("Team %s finished episode %s" % (str(self.team_name),
-                                str(ep.ep_number)))
-                previous_finishers = EpisodeSolve.objects.filter(episode=ep).count()
-                if (previous_finishers < len(ep.headstarts)):
-                  headstart = ep.headstarts[previous_finishers]
-                else:
-                  headstart = '00:00:00'
-                EpisodeSolve.objects.create(team=self, episode=ep, time=timezone.now())
-                TeamEpisodeLink.objects.create(team=self, episode=ep.unlocks, headstart = headstart)
-                continue #all puzzles from this episode already solved so unlocked
-            
-            # If ep do not have an unlocks but was finished, only create an EpisodeSolve (for weird admins)
-            if num_solved==len(puzzles):
-                EpisodeSolve.objects.create(team=self, episode=ep, time=timezone.now())
-                continue
-            
-            # See if we can unlock any given puzzle (will only be exec if len(puzzles)>0 so mapping is well-defined)
-            unlocked_numbers = [puz.puzzle_number for puz in self.puz_unlocked.filter(episode=ep)]
-            for puz in puzzles:
-                if (puz.puzzle_number in unlocked_numbers):
-                    continue
-                if(puz.num_required_to_unlock <= mapping[puz.puzzle_number]):
-                    logger.info("Team %s unlocked puzzle %s" % (str(self.team_name),
-                                str(puz.puzzle_id)))
-                    TeamPuzzleLink.objects.create(team=self, puzzle=puz, time=timezone.now())
-        
+        from .unlocks import unlock_all
+        unlock_all(self)
 
     def reset(self):
         """ Resets/deletes all of the team's progress """
@@ -287,6 +234,12 @@ class Guess(models.Model):
     """ A class representing a guess to a given puzzle from a given team """
     class Meta:
         verbose_name_plural = '     Guesses'
+        indexes = [
+            # replay of the guesses of a team on a puzzle, and keyset pages of the staff queue
+            models.Index(fields=['team', 'puzzle', 'id']),
+            models.Index(fields=['team', 'id']),
+            models.Index(fields=['puzzle', 'id']),
+        ]
 
     user = models.ForeignKey(
         User,
@@ -309,6 +262,9 @@ class Guess(models.Model):
         help_text="The puzzle that this guess is in response to")
     modified_date = models.DateTimeField(
         help_text="Last date/time of response modification")
+    correct = models.BooleanField(
+        default=False,
+        help_text="True if the guess was the answer when it was submitted (filled in automatically)")
 
     def serialize_for_ajax(self):
         """ Serializes the time, puzzle, team, and status fields for ajax transmission """
@@ -324,9 +280,7 @@ class Guess(models.Model):
     def is_correct(self):
         """ A boolean indicating if the guess given is exactly correct (matches either the
         answer or the non-empty regex). Spaces do not matter so are removed. """
-        noSpace = self.guess_text.upper().replace(" ","")
-        return ( noSpace == self.puzzle.answer.upper().replace(" ","") or
-                 (self.puzzle.answer_regex!="" and not (re.fullmatch(self.puzzle.answer_regex, noSpace, re.IGNORECASE) is None )) )
+        return self.puzzle.matcher.is_correct(self.guess_text)
 
     @property
     def convert_markdown_response(self):
@@ -334,20 +288,18 @@ class Guess(models.Model):
         return re.sub(r'\[(.*?)\]\((.*?)\)', '<a href="\\2">\\1</a>', self.response_text)
 
     def save(self, *args, **kwargs):
-        """ Overrides the default save function to update the modified date on save """
+        """ Overrides the default save function to update the modified date on save, and to store
+            the correctness of a new guess """
         self.modified_date = timezone.now()
+        if self._state.adding:
+            self.correct = self.puzzle.matcher.is_correct(self.guess_text)
         super(Guess, self).save(*args, **kwargs)
 
     def create_solve(self):
-        """ Creates a solve based on this guess """
-        unlock = self.team.teampuzzlelink_set.filter(puzzle=self.puzzle)
-        if unlock.count() == 1: #normal case
-          duration = self.guess_time - self.puzzle.starting_time_for_team(self.team)
-        else:
-          duration = "00"
-        PuzzleSolve.objects.create(puzzle=self.puzzle, team=self.team, guess=self, duration=duration)
-        logger.info("Team %s correctly solved puzzle %s" % (str(self.team.team_name),
-                                                            str(self.puzzle.puzzle_id)))
+        """ Creates a solve based on this guess, unless the team already solved the puzzle, and
+            unlocks what it gives access to. Returns the solve or None """
+        from .unlocks import record_solve
+        return record_solve(self)
 
     # Automatic guess response system
     # Returning an empty string means that huntstaff should respond via the queue
@@ -356,32 +308,27 @@ class Guess(models.Model):
         """ Takes the guess's text and uses various methods to craft and populate a response.
             If the response is correct a solve is created and the correct puzzles are unlocked"""
 
-        noSpace = self.guess_text.upper().replace(" ","")
+        matcher = self.puzzle.matcher
         # Compare against correct answer
-        if(self.is_correct):
-            # Make sure we don't have duplicate or after hunt guess objects
-            if(self.puzzle not in self.team.puz_solved.all()):
-                self.create_solve()
-                t = self.team
-                t.save()
-                t.refresh_from_db()
-                t.unlock_puzzles_and_episodes()
+        if(matcher.is_correct(self.guess_text)):
+            # Does nothing if the team already solved the puzzle
+            self.create_solve()
 
             return {"status": "correct", "message": "Correct!"}
 
+        # TODO removed unlocked Eureka
+        resp = matcher.match_eureka(self.guess_text)
+        if resp is None:
+            # Give a default response if no regex matches
+            # Current philosphy is to auto-can wrong answers: If it's not right, it's wrong
+            return {"status" : "wrong", "message" : "Wrong Answer" }
+
+        if(not TeamEurekaLink.objects.filter(team=self.team, eureka_id=resp.pk).exists()):
+            TeamEurekaLink.objects.create(team=self.team, eureka_id=resp.pk, time=timezone.now())
+        if resp.admin_only:
+          return {"status" : "wrong", "message" : "Wrong Answer" }
         else:
-            # TODO removed unlocked Eureka
-            for resp in self.puzzle.eureka_set.all():
-                if(not re.fullmatch(resp.regex.replace(" ",""), noSpace, re.IGNORECASE) is None):
-                    if(resp not in self.team.eurekas.all()):
-                        TeamEurekaLink.objects.create(team=self.team, eureka=resp, time=timezone.now())
-                    if resp.admin_only:
-                      return {"status" : "wrong", "message" : "Wrong Answer" }
-                    else:
-                      return {"status": "eureka", "message": resp.get_feedback}
-            else:  # Give a default response if no regex matches
-                # Current philosphy is to auto-can wrong answers: If it's not right, it's wrong
-                return {"status" : "wrong", "message" : "Wrong Answer" }
+          return {"status": "eureka", "message": resp.feedback}
 
 
     def update_response(self, text):
@@ -434,12 +381,32 @@ class PuzzleSolve(models.Model):
         return self.team.short_name + " => " + self.puzzle.puzzle_name
 
 
+def effective_start(time, episode_start, headstart, playtester):
+    """ When a team can start working on a puzzle it unlocked at the given time: right away for
+        playtesters, not before the episode opens for the team (start date minus headstart) otherwise """
+    if playtester:
+        return time
+    return max(time, episode_start - (headstart or timedelta(0)))
+
+
+class TeamPuzzleLinkManager(models.Manager):
+    def starting_times(self, teams, puzzles):
+        """ The effective start of the unlocks of the given puzzles by the given teams, in one
+            query: a dict {(team pk, puzzle pk): time}. Pairs that are not unlocked are missing
+            (their starting time is the start date of the episode). """
+        links = self.filter(team__in=teams, puzzle__in=puzzles, effective_start__isnull=False)
+        return {(team_id, puzzle_id): start for team_id, puzzle_id, start in
+                links.values_list('team_id', 'puzzle_id', 'effective_start')}
+
+
 class TeamPuzzleLink(models.Model):
     """ A class that links a team and a puzzle to indicate that the team has unlocked the puzzle """
     class Meta:
         unique_together = ('puzzle', 'team',)
         verbose_name_plural = "   Puzzles unlocked by teams"
 
+    objects = TeamPuzzleLinkManager()
+
     puzzle = models.ForeignKey(
         "hunts.Puzzle",
         on_delete=models.CASCADE,
@@ -450,6 +417,20 @@ class TeamPuzzleLink(models.Model):
         help_text="The team that this unlocked puzzle is for")
     time = models.DateTimeField(
         help_text="The time this puzzle was unlocked for this team")
+    effective_start = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="The time the team could start working on the puzzle (filled in automatically)")
+
+    def save(self, *args, **kwargs):
+        """ Overrides the default save function to fill in the effective start of new unlocks """
+        if self.effective_start is None:
+            episode = self.puzzle.episode
+            headstart = TeamEpisodeLink.objects.filter(team_id=self.team_id, episode=episode)
+            self.effective_start = effective_start(self.time, episode.start_date,
+                                                   headstart.values_list('headstart', flat=True).first(),
+                                                   self.team.playtester)
+        super(TeamPuzzleLink, self).save(*args, **kwargs)
 
 
     def serialize_for_ajax(self):
@@ -559,14 +540,116 @@ class TeamEurekaLink(models.Model):
     def __str__(self):
         return self.team.short_name + ": " + self.eureka.answer
 
+
+class TeamHintLink(models.Model):
+    """ A class that links a team and a hint to record when the hint is released to the team
+    (maintained by teams.hints, one per hint of every puzzle the team unlocked) """
+    class Meta:
+        unique_together = ('hint', 'team',)
+        verbose_name_plural = "Hints released to teams"
+
+    hint = models.ForeignKey(
+        "hunts.Hint",
+        on_delete=models.CASCADE,
+        help_text="The hint released")
+    team = models.ForeignKey(
+        Team,
+        on_delete=models.CASCADE,
+        help_text="The team that this hint is released to")
+    time = models.DateTimeField(
+        help_text="The time this hint is (or was) released to this team")
+    sped_up = models.BooleanField(
+        default=False,
+        help_text="True if the eurekas found by the team brought the release forward")
+
+    def __str__(self):
+        return self.team.short_name + ": " + self.hint.text
+
         
 # unlock puzzles when admin unlocks episode
 @receiver(post_save, sender=TeamEpisodeLink)
 def my_callback_episode(sender, instance, *args, **kwargs):
-  instance.team.unlock_puzzles_and_episodes()
+  from .unlocks import episode_unlocked, refresh_effective_starts
+  # the headstart may have changed
+  refresh_effective_starts(team=instance.team, episode=instance.episode)
+  episode_unlocked(instance.team, instance.episode)
 
 # pre-unlock episode and puzzles (lie on starting time) when a team is created 
 @receiver(post_save, sender=Team)
-def my_callback_team(sender, instance, *args, **kwargs):
-  instance.unlock_puzzles_and_episodes()
+def my_callback_team(sender, instance, created, *args, **kwargs):
+  if created:
+    instance.unlock_puzzles_and_episodes()
+  else:
+    # playtesters start their puzzles as soon as they unlock them
+    from .unlocks import refresh_effective_starts
+    refresh_effective_starts(team=instance)
         
+
+# keep the cached team progress in sync with the unlock/solve tables
+@receiver(post_save, sender=TeamPuzzleLink)
+@receiver(post_save, sender=PuzzleSolve)
+@receiver(post_save, sender=TeamEpisodeLink)
+@receiver(post_save, sender=EpisodeSolve)
+@receiver(post_delete, sender=TeamPuzzleLink)
+@receiver(post_delete, sender=PuzzleSolve)
+@receiver(post_delete, sender=TeamEpisodeLink)
+@receiver(post_delete, sender=EpisodeSolve)
+def my_callback_progress(sender, instance, *args, **kwargs):
+  from .progress import invalidate_progress
+  invalidate_progress(instance.team_id)
+
+# forget the cached user -> team mapping when a membership or a team changes
+@receiver(post_save, sender=Team)
+@receiver(pre_delete, sender=Team)
+def my_callback_team_members(sender, instance, *args, **kwargs):
+  from .membership import invalidate_user_teams
+  invalidate_user_teams(instance.person_set.values_list('user_id', flat=True))
+
+@receiver(post_delete, sender=Person)
+def my_callback_person(sender, instance, *args, **kwargs):
+  from .membership import invalidate_user_teams
+  invalidate_user_teams([instance.user_id])
+
+@receiver(m2m_changed, sender=Person.teams.through)
+def my_callback_membership(sender, instance, action, reverse, pk_set, *args, **kwargs):
+  from .membership import invalidate_user_teams
+  if action not in ('post_add', 'post_remove', 'pre_clear'):
+    return
+  if not reverse:
+    invalidate_user_teams([instance.user_id])
+  elif action == 'pre_clear':
+    invalidate_user_teams(instance.person_set.values_list('user_id', flat=True))
+  else:
+    invalidate_user_teams(Person.objects.filter(pk__in=pk_set).values_list('user_id', flat=True))
+
+# a team that lost a eureka must get it again on its next matching guess
+@receiver(post_delete, sender=TeamEurekaLink)
+def my_callback_eureka_link(sender, instance, *args, **kwargs):
+  from hunts.guess_cache import invalidate_team_guesses
+  invalidate_team_guesses(instance.team_id)
+
+# the release of the hints of a puzzle depends on its unlock and on the eurekas found
+@receiver(post_save, sender=TeamPuzzleLink)
+@receiver(post_save, sender=TeamEurekaLink)
+@receiver(post_delete, sender=TeamEurekaLink)
+def my_callback_hint_schedule(sender, instance, *args, **kwargs):
+  from .hints import refresh_hint_schedule
+  puzzle_id = instance.puzzle_id if sender is TeamPuzzleLink else instance.eureka.puzzle_id
+  refresh_hint_schedule(teams=[instance.team_id], puzzles=[puzzle_id])
+
+@receiver(post_delete, sender=TeamPuzzleLink)
+def my_callback_puzzle_link(sender, instance, *args, **kwargs):
+  TeamHintLink.objects.filter(team_id=instance.team_id, hint__puzzle_id=instance.puzzle_id).delete()
+
+# live cells of the staff progress board (the bulk unlocks send theirs in teams.unlocks)
+@receiver(post_save, sender=TeamPuzzleLink)
+@receiver(post_save, sender=PuzzleSolve)
+def my_callback_progress_board(sender, instance, created, *args, **kwargs):
+  from .board import UNLOCKED, SOLVED, cell, send_cells
+  if not created:
+    return
+  if sender is TeamPuzzleLink:
+    state, time = UNLOCKED, instance.time
+  else:
+    state, time = SOLVED, instance.guess.guess_time
+  send_cells(instance.puzzle.episode_id, [cell(instance.team_id, instance.puzzle_id, state, time)])
@@ -0,0 +1,76 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from hunts.caching import VersionedLocalCache
+from .models import TeamPuzzleLink, PuzzleSolve, TeamEpisodeLink, EpisodeSolve
+
+
+class TeamProgress(namedtuple('TeamProgress', ['puz_unlocked', 'puz_solved', 'ep_unlocked', 'ep_solved', 'ep_open'])):
+    """ Compact snapshot of the progress of a team: frozensets of the pks of the puzzles and
+    episodes it unlocked/solved, and the time at which each unlocked episode opens for the team
+    (episode start date minus the team's headstart) """
+    __slots__ = ()
+
+    def visible_episodes(self, playtester=False):
+        """ The pks of the unlocked episodes that are already open (playtesters do not wait) """
+        now = timezone.now()
+        return [pk for pk, opens in self.ep_open.items() if playtester or opens <= now]
+
+    def puzzle_visible(self, puzzle, playtester=False):
+        """ A boolean indicating whether the puzzle is unlocked and its episode open """
+        if puzzle.pk not in self.puz_unlocked or puzzle.episode_id not in self.ep_open:
+            return False
+        return playtester or self.ep_open[puzzle.episode_id] <= timezone.now()
+
+
+def build_progress(team_pk):
+    """ Loads the progress of a team from the database (four queries) """
+    links = TeamEpisodeLink.objects.filter(team_id=team_pk)
+    ep_open = {pk: start - headstart for pk, start, headstart in
+               links.values_list('episode_id', 'episode__start_date', 'headstart')}
+    return TeamProgress(
+        frozenset(TeamPuzzleLink.objects.filter(team_id=team_pk).values_list('puzzle_id', flat=True)),
+        frozenset(PuzzleSolve.objects.filter(team_id=team_pk).values_list('puzzle_id', flat=True)),
+        frozenset(ep_open),
+        frozenset(EpisodeSolve.objects.filter(team_id=team_pk).values_list('episode_id', flat=True)),
+        ep_open)
+
+
+# ttl=0: the version tokens are checked on every access so that a solve is visible right away from
+# every worker, but the progress itself is only rebuilt (or fetched from redis) after a change
+_progress = VersionedLocalCache('progress', ttl=0, shared_timeout=24 * 3600)
+
+
+def get_progress(team):
+    """ Returns the (cached) progress of a team, or None if there is no team """
+    if team is None:
+        return None
+    return _progress.get(team.pk, lambda: build_progress(team.pk))
+
+
+def invalidate_progress(team_pk=None):
+    """ Bumps the progress version of one team, or of every team if team_pk is None.
+
+    This is done right away and again once the current transaction commits, so that a progress
+    rebuilt from not yet committed data does not stay in the cache. """
+    def invalidate():
+        if team_pk is None:
+            _progress.invalidate_all()
+        else:
+            _progress.invalidate(team_pk)
+    invalidate()
+    transaction.on_commit(invalidate)
@@ -16,4 +16,7 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r"^ws/puzzle/(?P<puzzle_id>[0-9a-zA-Z]{3,12})/$", consumers.PuzzleWebsocket.as_asgi(), name='puzzle_websocket'),
+    re_path(r"^ws/hunt/(?P<hunt_num>[0-9]+)/team/$", consumers.TeamWebsocket.as_asgi(), name='team_websocket'),
+    re_path(r"^ws/staff/queue/$", consumers.StaffQueueWebsocket.as_asgi(), name='queue_websocket'),
+    re_path(r"^ws/staff/progress/(?P<ep_pk>[0-9]+)/$", consumers.StaffProgressWebsocket.as_asgi(), name='progress_websocket'),
 ]
@@ -0,0 +1,33 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+from huey import crontab
+from huey.contrib.djhuey import db_task, db_periodic_task
+
+from . import ingest
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@db_task()
+def drain_guesses():
+    """ Moves the guesses queued by the write-behind ingestion to the database """
+    count = ingest.drain()
+    if count:
+        logger.info("Inserted %d queued guesses" % count)
+
+
+@db_periodic_task(crontab())
+def drain_guesses_periodically():
+    """ Catches up on the guesses whose drain task was lost (e.g. if huey restarted) """
+    drain_guesses.call_local()
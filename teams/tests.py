@@ -404,7 +404,7 @@ class HuntTests(TestCase):
                                         post_context)
         response = self.client.post(reverse('puzzle', kwargs={"puzzle_id": "101"}),
                                     post_context)
-        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.status_code, 429)
 
     def test_unlockables(self):
         "Test the unlockables view"
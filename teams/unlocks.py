@@ -0,0 +1,183 @@
+# Copyright (C) 2018 The MindbreakersServer Contributors.
+#
+# This file is part of MindbreakersServer.
+#
+# MindbreakersServer is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# MindbreakersServer is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with Hunter2.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Incremental unlock engine: computes only what changes for a team after a solve or an episode
+unlock, instead of recomputing the whole progress of the team """
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, DateTimeField, F, OuterRef, Subquery, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from hunts.dag import get_dag
+from hunts.models import Puzzle
+from .board import UNLOCKED, cell, send_cells
+from .consumers import TeamWebsocket
+from .models import Team, TeamPuzzleLink, TeamEpisodeLink, PuzzleSolve, EpisodeSolve, effective_start
+from .hints import refresh_hint_schedule
+from .progress import invalidate_progress
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _unlockable(dag, candidates, solved, unlocked):
+    """ The candidate puzzles that have enough solved prerequisites and are not unlocked yet """
+    return [pk for pk in candidates
+            if pk not in unlocked and
+            dag.required[pk] <= sum(1 for parent in dag.parents[pk] if parent in solved)]
+
+
+def _unlock_puzzles(team, episode, pks, now):
+    """ Unlocks the given puzzles of an episode (bulk_create skips TeamPuzzleLink.save, so their
+        effective start is computed here) """
+    if not pks:
+        return
+    headstart = TeamEpisodeLink.objects.filter(team=team, episode=episode).values_list('headstart', flat=True).first()
+    start = effective_start(now, episode.start_date, headstart, team.playtester)
+    TeamPuzzleLink.objects.bulk_create([TeamPuzzleLink(team=team, puzzle_id=pk, time=now, effective_start=start)
+                                        for pk in pks], ignore_conflicts=True)
+    # bulk_create sends no post_save
+    invalidate_progress(team.pk)
+    with_hints = []
+    puzzle_ids = []
+    for pk, puzzle_id, hints in Puzzle.objects.filter(pk__in=pks).annotate(hints=Count('hint')).values_list('pk', 'puzzle_id', 'hints'):
+        logger.info("Team %s unlocked puzzle %s" % (str(team.team_name), str(puzzle_id)))
+        puzzle_ids.append(puzzle_id)
+        if hints:
+            with_hints.append(pk)
+    if with_hints:
+        refresh_hint_schedule(teams=[team.pk], puzzles=with_hints)
+    transaction.on_commit(lambda: TeamWebsocket.send_new_unlocks(team.pk, puzzle_ids))
+    send_cells(episode.pk, [cell(team.pk, pk, UNLOCKED, now) for pk in pks])
+
+
+def _finish_episode(team, episode, now):
+    """ Records that the team finished the episode, and unlocks the next one if there is one """
+    if EpisodeSolve.objects.filter(team=team, episode=episode).exists():
+        return
+    logger.info("Team %s finished episode %s" % (str(team.team_name), str(episode.ep_number)))
+    previous_finishers = EpisodeSolve.objects.filter(episode=episode).count()
+    EpisodeSolve.objects.create(team=team, episode=episode, time=now)
+
+    # If ep do not have an unlocks but was finished, only create an EpisodeSolve (for weird admins)
+    if episode.unlocks_id is None or TeamEpisodeLink.objects.filter(team=team, episode_id=episode.unlocks_id).exists():
+        return
+    if previous_finishers < len(episode.headstarts):
+        headstart = episode.headstarts[previous_finishers]
+    else:
+        headstart = timedelta(0)
+    # bulk_create skips the post_save receiver: the next episode is handled right here
+    TeamEpisodeLink.objects.bulk_create([TeamEpisodeLink(team=team, episode_id=episode.unlocks_id, headstart=headstart)])
+    invalidate_progress(team.pk)
+    _open_episode(team, episode.unlocks, now)
+    transaction.on_commit(lambda: TeamWebsocket.send_new_episode(team.pk, episode.unlocks))
+
+
+def _open_episode(team, episode, now):
+    """ Unlocks every puzzle of an unlocked episode that the team can access """
+    dag = get_dag(episode.hunt_id)
+    puzzles = dag.episode_puzzles.get(episode.pk, ())
+    solved = set(team.puz_solved.filter(episode=episode).values_list('pk', flat=True))
+    unlocked = set(team.puz_unlocked.filter(episode=episode).values_list('pk', flat=True))
+    _unlock_puzzles(team, episode, _unlockable(dag, puzzles, solved, unlocked), now)
+    if len(solved) == len(puzzles):
+        _finish_episode(team, episode, now)
+
+
+def record_solve(guess):
+    """ Creates the solve of a correct guess and unlocks what it gives access to, as one transaction.
+
+    The team row is locked first (in the query that also fetches the effective start of the
+    puzzle), so that correct guesses submitted at the same time by teammates go through one after
+    the other and only the first one creates a solve. Returns the new PuzzleSolve, or None if the
+    team had already solved the puzzle. """
+    puzzle = guess.puzzle
+    with transaction.atomic():
+        start = (Team.objects.select_for_update().filter(pk=guess.team_id)
+                 .annotate(start=Subquery(TeamPuzzleLink.objects.filter(team=OuterRef('pk'), puzzle_id=puzzle.pk)
+                                          .values('effective_start')[:1]))
+                 .values_list('start', flat=True).get())
+        # checked once the lock is held: a solve committed while waiting for it is visible
+        if PuzzleSolve.objects.filter(team_id=guess.team_id, puzzle_id=puzzle.pk).exists():
+            return None
+
+        duration = guess.guess_time - start if start is not None else timedelta(0)
+        solve = PuzzleSolve.objects.create(puzzle=puzzle, team=guess.team, guess=guess, duration=duration)
+        logger.info("Team %s correctly solved puzzle %s" % (str(guess.team.team_name), str(puzzle.puzzle_id)))
+        puzzle_solved(solve)
+        if not guess.team.playtester:
+            transaction.on_commit(lambda: TeamWebsocket.send_leaderboard_change(puzzle.episode.hunt_id, guess.team))
+    return solve
+
+
+def puzzle_solved(solve):
+    """ Unlocks what a new PuzzleSolve gives access to: the puzzles it is a prerequisite for and,
+    if it completes its episode, the next episode """
+    team = solve.team
+    episode = solve.puzzle.episode
+    now = timezone.now()
+    dag = get_dag(episode.hunt_id)
+    # only prerequisites within the episode count
+    children = [pk for pk in dag.children.get(solve.puzzle_id, ()) if dag.episode_of[pk] == episode.pk]
+    with transaction.atomic():
+        solved = set(team.puz_solved.filter(episode=episode).values_list('pk', flat=True))
+        if children:
+            unlocked = set(team.puz_unlocked.filter(pk__in=children).values_list('pk', flat=True))
+            _unlock_puzzles(team, episode, _unlockable(dag, children, solved, unlocked), now)
+        if (len(solved) == len(dag.episode_puzzles.get(episode.pk, ())) and
+                team.ep_unlocked.filter(pk=episode.pk).exists()):
+            _finish_episode(team, episode, now)
+
+
+def episode_unlocked(team, episode):
+    """ Unlocks the puzzles of an episode that was just unlocked for the team """
+    with transaction.atomic():
+        _open_episode(team, episode, timezone.now())
+        transaction.on_commit(lambda: TeamWebsocket.send_new_episode(team.pk, episode))
+
+
+def unlock_all(team):
+    """ Unlocks all puzzles and episodes a team is currently supposed to have unlocked """
+    now = timezone.now()
+    with transaction.atomic():
+        # Unlock the first episodes that do not have prerequisites
+        if not team.ep_unlocked.exists():
+            dag = get_dag(team.hunt_id)
+            TeamEpisodeLink.objects.bulk_create([TeamEpisodeLink(team=team, episode_id=pk)
+                                                 for pk in dag.first_episodes])
+            invalidate_progress(team.pk)
+
+        solved = set(team.ep_solved.values_list('pk', flat=True))
+        for episode in team.ep_unlocked.exclude(pk__in=solved):
+            _open_episode(team, episode, now)
+
+
+def refresh_effective_starts(team=None, episode=None):
+    """ Recomputes the effective start of the unlocks of a team and/or of an episode, after a
+        headstart, an episode start date or the playtester status of a team changed """
+    links = TeamEpisodeLink.objects.select_related('team', 'episode')
+    if team is not None:
+        links = links.filter(team=team)
+    if episode is not None:
+        links = links.filter(episode=episode)
+    for link in links:
+        unlocks = TeamPuzzleLink.objects.filter(team=link.team, puzzle__episode=link.episode)
+        if link.team.playtester:
+            unlocks.update(effective_start=F('time'))
+        else:
+            opens = Value(link.episode.start_date - link.headstart, output_field=DateTimeField())
+            unlocks.update(effective_start=Greatest('time', opens))
+    refresh_hint_schedule(teams=[team.pk] if team is not None else None,
+                          puzzles=Puzzle.objects.filter(episode=episode) if episode is not None else None)
@@ -97,7 +97,7 @@ class Registration(LoginRequiredMixin, View):
     post request. The rendered page is nearly entirely static.
     """
     def get(self, request):
-        curr_hunt = Hunt.objects.get(is_current_hunt=True)
+        curr_hunt = Hunt.objects.get_current()
         team = curr_hunt.team_from_user(request.user)
 
         if(curr_hunt.is_locked):
@@ -110,7 +110,7 @@ class Registration(LoginRequiredMixin, View):
                           {'teams': teams, 'curr_hunt': curr_hunt})
 
     def post(self, request):
-        curr_hunt = Hunt.objects.get(is_current_hunt=True)
+        curr_hunt = Hunt.objects.get_current()
         
         if(request.POST["form_type"] == "create_team"):
             if(request.user.person.teams.filter(hunt=curr_hunt).count()>0):
@@ -160,7 +160,7 @@ class ManageTeam(View):
     """
 
     def get(self, request):
-        curr_hunt = Hunt.objects.get(is_current_hunt=True)
+        curr_hunt = Hunt.objects.get_current()
         team = curr_hunt.team_from_user(request.user)
 
         if(team is not None):
@@ -176,7 +176,7 @@ class ManageTeam(View):
 
 
     def post(self, request):
-        curr_hunt = Hunt.objects.get(is_current_hunt=True)
+        curr_hunt = Hunt.objects.get_current()
         team = curr_hunt.team_from_user(request.user)
 
         if("form_type" in request.POST):